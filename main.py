@@ -1,38 +1,48 @@
+import time
+
+_PROCESS_START = time.perf_counter()
+
 import asyncio
-import datetime
 import os
 
-from kivy.app import App
-from kivy.utils import platform
-from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.button import Button
-from kivy.uix.label import Label
-from kivy.uix.widget import Widget
-from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelHeader
-from kivy.clock import Clock
-from kivy.metrics import dp, sp
-from kivy.core.text import Label as CoreLabel
-from kivy.uix.scrollview import ScrollView
-
-# bind bleak's python logger into kivy's logger before importing python module using logging
-from kivy.logger import Logger  # isort: skip
-import logging  # isort: skip
-
-# import custom_exceptions
-# import csv_log
-
-from python.kraken_widget import KrakenWidget
-import python.ble_utils as ble_utils
-from python import csv_log
+# Startup timing report (KRAKEN_STARTUP_TIMING=1), see python/startup_timing.py
+from python.startup_timing import StartupTimer  # isort: skip
+STARTUP = StartupTimer.from_env(_PROCESS_START)
+
+# Only what the first frame (an empty dashboard) needs is imported here. bleak,
+# NumPy, the per-device UI and the log files are loaded once the window is up:
+# see AppRoot._start_core() and add_new_tab()
+with STARTUP.phase("imports"):
+    from kivy.app import App
+    from kivy.utils import platform
+    from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelHeader
+    from kivy.clock import Clock
+    from kivy.metrics import dp, sp
+
+    # bind bleak's python logger into kivy's logger before importing python module using logging
+    from kivy.logger import Logger  # isort: skip
+    import logging  # isort: skip
+
+    # import custom_exceptions
+    # import csv_log
+
+    from python import metrics
+    from python.render_scheduler import RenderScheduler
+    from python.dashboard import Dashboard
+    from python.metrics_view import MetricsView
 
 # from scan_and_add import ScanAndAddWidget
 # from kraken_monitor_subwin import KrakenMonitorSubWindow
 
+logging.Logger.manager.root = Logger
+
+UI_FRAME_SECONDS = metrics.histogram("kraken_ui_frame_seconds", "Time between Kivy Clock frames")
+
 # ==============================================================================
 # Android Bluetooth set up
 # ==============================================================================
 
-if platform == 'android':
+def _request_android_permissions():
     from android.permissions import request_permissions, Permission
 
     request_permissions([Permission.BLUETOOTH,
@@ -41,27 +51,25 @@ if platform == 'android':
         Permission.BLUETOOTH_ADMIN,
         Permission.ACCESS_FINE_LOCATION,
         Permission.ACCESS_COARSE_LOCATION,
-        Permission.ACCESS_BACKGROUND_LOCATION])
+        Permission.ACCESS_BACKGROUND_LOCATION,
+        Permission.WRITE_EXTERNAL_STORAGE,
+        Permission.READ_EXTERNAL_STORAGE])
 
 # ==============================================================================
 # Set up log and data dir
 # ==============================================================================
 
-logging.Logger.manager.root = Logger
-
-if platform == 'android':
-    from plyer import storagepath
-    from android.permissions import request_permissions, Permission
-    request_permissions([Permission.WRITE_EXTERNAL_STORAGE, Permission.READ_EXTERNAL_STORAGE])
+def _data_dir():
+    if platform == 'android':
+        from plyer import storagepath
 
-    out_dir = storagepath.get_documents_dir()
-    out_dir = os.path.join(out_dir, 'KrakenData')
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-else:
-    out_dir = os.path.expanduser('Data') # Simply put data in a dir alongside the scripts
+        out_dir = storagepath.get_documents_dir()
+        out_dir = os.path.join(out_dir, 'KrakenData')
+    else:
+        out_dir = os.path.expanduser('Data') # Simply put data in a dir alongside the scripts
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
+    return out_dir
 
 # ==============================================================================
 # Main code
@@ -77,44 +85,122 @@ class AppRoot(App):
         self.max_tab_width = dp(120)  # start reasonable
         self.font_name = None         # set to your bundled TTF for consistent metrics (see note below)
         self.font_size_sp = 16
+        self._text_width_cache = {}
 
         self.kraken_widgets = {}
+        self.tab_headers = {}
+        # Label updates from BLE callbacks are coalesced and applied at this rate
+        self.render_scheduler = RenderScheduler(rate_hz=float(os.environ.get("KRAKEN_UI_RATE_HZ", 10)))
 
-        self.csv_ble_info_logger = csv_log.CSVLogger(["address", "name", "kraken_rssi", "kraken_power", "kraken_phy", "connection_count", "central_rssi", "central_phy", "channel_map", "available_channels", "current_channel", "connection_interval_ms", "supervision_timeout_ms"], os.path.join(out_dir, f"KrakenBleConnectionData_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"))
-        self.csv_event_logger = csv_log.CSVLogger(["source", "event", "notes"], os.path.join(out_dir, f"KrakenEventLog_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"))
-        # NOTE: Modify this if you change the format of the data being logged
-        self.csv_event_logger.write(['APP', "LOG_VERSION", '1'])
+        # Scanning, connections, decoding and logging live in the UI-free core
+        # (python/kraken_core.py), created by _start_core() after the first frame
+        self.core = None
+        self.core_task = None
 
 
     def build(self):
-        self.layout = TabbedPanel(do_default_tab=False)
+        with STARTUP.phase("build"):
+            self.layout = TabbedPanel(do_default_tab=False)
+
+            self.dashboard = Dashboard(self.render_scheduler)
 
-        self.dashboard_scroll = ScrollView(size_hint=(1, 1))
-        # Inner content that actually stacks widgets
-        self.dashboard_layout = BoxLayout(
-            orientation="vertical",
-            size_hint_y=None,
-            spacing=dp(6),
-            padding=(dp(10), dp(10))
-        )
-        # Critical: content height expands to fit children
-        self.dashboard_layout.bind(minimum_height=self.dashboard_layout.setter("height"))
+            dashboard = TabbedPanelHeader(text="Dashboard")
+            dashboard.content = self.dashboard.build()
+            self.layout.add_widget(dashboard)
+            self.dashboard_header = dashboard
 
-        self.dashboard_scroll.add_widget(self.dashboard_layout)
-        
-        dashboard = TabbedPanelHeader(text="Dashboard")
-        dashboard.content = self.dashboard_scroll
-        self.layout.add_widget(dashboard)
+            self.metrics_view = MetricsView()
+            self.metrics_header = TabbedPanelHeader(text="Metrics")
+            self.metrics_header.content = self.metrics_view.build()
+            self.layout.add_widget(self.metrics_header)
 
-        return self.layout
+            self.layout.bind(current_tab=self._on_tab_changed)
+
+            return self.layout
 
 
     def on_start(self):
-        asyncio.create_task(self.run())
+        from kivy.core.window import Window # already created by App.run()
+        self.render_scheduler.start()
+        Window.bind(on_flip=self._on_first_frame)
+        Clock.schedule_interval(self._observe_frame, 0)
+
+
+    def _observe_frame(self, dt):
+        UI_FRAME_SECONDS.observe(dt)
+
+
+    def _on_first_frame(self, window):
+        window.unbind(on_flip=self._on_first_frame)
+        first_frame_ms = STARTUP.mark("first frame")
+        logging.info(f"First frame {first_frame_ms:.0f} ms after start")
+        # Everything not needed to draw the (empty) dashboard happens from here on
+        Clock.schedule_once(self._start_core)
+
+
+    def _start_core(self, dt):
+        with STARTUP.phase("core start"):
+            if platform == 'android':
+                _request_android_permissions()
+            if os.environ.get("KRAKEN_MULTIPROCESS") and platform != 'android':
+                # BLE, decoding and logging in a separate I/O process, see python/io_process.py.
+                # KRAKEN_SIMULATED_DEVICES is passed on and handled there.
+                from python.io_process import RemoteCore as KrakenCore
+            else:
+                if os.environ.get("KRAKEN_SIMULATED_DEVICES"):
+                    # Optional simulated BLE backend (no radio required)
+                    from python.sim_kraken import SimulatedFleet
+                    SimulatedFleet(int(os.environ["KRAKEN_SIMULATED_DEVICES"])).install()
+                from python.kraken_core import KrakenCore
+
+            from python.kraken_core import peak_rss_mb
+            self.core = KrakenCore(_data_dir(),
+                                   binary_log=bool(os.environ.get("KRAKEN_BINARY_LOG")),
+                                   capture=bool(os.environ.get("KRAKEN_CAPTURE")),
+                                   max_in_flight=int(os.environ.get("KRAKEN_MAX_CONNECTS_IN_FLIGHT", 4)),
+                                   # Prometheus text export of python/metrics.py, also shown in the Metrics tab
+                                   metrics_file=os.environ.get("KRAKEN_METRICS_FILE"),
+                                   metrics_port=os.environ.get("KRAKEN_METRICS_PORT"),
+                                   # On-device log capture, see python/log_stream.py
+                                   log_streams=os.environ.get("KRAKEN_LOG_STREAMS"),
+                                   log_password=os.environ.get("KRAKEN_LOG_PASSWORD"),
+                                   # Reconnect from cached GATT metadata, see python/gatt_cache.py
+                                   gatt_cache=not os.environ.get("KRAKEN_NO_GATT_CACHE"))
+            self.core.on_session_added.append(self._on_session_added)
+            # LED / clear error / reset / sleep for the ticked dashboard rows, see python/fleet_commands.py
+            from python.fleet_commands import COMMANDS
+            self.dashboard.add_command_bar([(c.name, c.title, c.disconnects) for c in COMMANDS.values()],
+                                           lambda name, addresses: self.core.broadcast_command(name, addresses))
+        rss = peak_rss_mb()
+        logging.info(f"Core started {STARTUP.elapsed_ms():.0f} ms after start"
+                     + (f", peak RSS {rss:.1f} MB" if rss is not None else ""))
+        STARTUP.finish()
+        self.core_task = asyncio.create_task(self.run())
+
+
+    def _on_tab_changed(self, panel, tab):
+        # Only the widgets on screen get their labels refreshed
+        self.dashboard.set_visible(tab is self.dashboard_header)
+        self.metrics_view.set_visible(tab is self.metrics_header)
+        for address, widget in self.kraken_widgets.items():
+            widget.set_visibility(detail=self.tab_headers.get(address) is tab)
 
 
     def _measure_text_w(self, text: str) -> float:
-        """Measure text width using CoreLabel; add dp padding."""
+        """Measure text width using CoreLabel; add dp padding.
+
+        Memoized per (text length, font, size): tab titles are addresses of
+        the same length, so after the first tab this never renders a texture.
+        """
+        key = (len(text), self.font_name, self.font_size_sp)
+        if key not in self._text_width_cache:
+            self._text_width_cache[key] = self._render_text_w(text)
+        return self._text_width_cache[key]
+
+
+    def _render_text_w(self, text: str) -> float:
+        from kivy.core.text import Label as CoreLabel
+
         kwargs = {
             'text': text,
             'font_size': sp(self.font_size_sp)
@@ -129,7 +215,15 @@ class AppRoot(App):
         return w + dp(40)  # padding on both sides
 
 
-    def add_new_tab(self, address):
+    def _on_session_added(self, session):
+        # Called from the core's scan task; build the tab outside the BLE path
+        Clock.schedule_once(lambda dt: self.add_new_tab(session))
+
+
+    def add_new_tab(self, session):
+        from python.kraken_widget import KrakenWidget # first tab pays for the per-device UI import
+
+        address = session.address
         if address in self.kraken_widgets.keys():
             return # Already have a tab, so ignore the request
 
@@ -137,8 +231,10 @@ class AppRoot(App):
             tab.width = tab.texture_size[0] + dp(40)
 
         logging.info(f"Adding new tab for address {address}")
-        self.kraken_widgets[address] = KrakenWidget(address, self.csv_ble_info_logger, self.csv_event_logger)
+        self.kraken_widgets[address] = KrakenWidget(session, self.render_scheduler, self.dashboard,
+                                                    teardown_hidden=bool(os.environ.get("KRAKEN_TEARDOWN_HIDDEN_TABS")))
         new_panel = TabbedPanelHeader(text=str(address))
+        self.tab_headers[address] = new_panel
         new_panel.content = self.kraken_widgets[address].build()
         self.layout.add_widget(new_panel)
         tab_width = self._measure_text_w(address) #new_panel.texture_size[0] + dp(40)
@@ -148,11 +244,13 @@ class AppRoot(App):
             self.max_tab_width = tab_width
             self.layout.tab_width = tab_width
 
-        self.dashboard_layout.add_widget(self.kraken_widgets[address].get_dashboard_widget())
-
 
     def on_stop(self):
         self.running = False
+        self.render_scheduler.stop()
+        if self.core is not None:
+            # run() disconnects and drains the pipeline into the logs, then closes them
+            self.core.stop()
 
     # def on_close_sub_window(self, instance):
     #     # NOTE: Iterate over a copy of the list, to allow safe removal
@@ -165,22 +263,10 @@ class AppRoot(App):
 
 
     async def run(self):
-        while self.running:
-            await asyncio.sleep(1)
-            krakens_in_range = await ble_utils.scan_for_kraken_beacons()
-            for address, data in krakens_in_range.items():
-                if address not in self.kraken_widgets.keys():
-                    # self.add_new_tab(address)
-                    Clock.schedule_once(lambda dt: self.add_new_tab(address))
-
-                if address in self.kraken_widgets.keys():
-                    self.kraken_widgets[address].process_beacon_data(data)
-
-            # Execute all runners for subwindows
-            # NOTE: Work on a copy since the dictionary size can change while iterating
-            opened_widgets = list(self.kraken_widgets.values())
-            for k in opened_widgets:
-                await k.run()
+        try:
+            await self.core.run()
+        finally:
+            self.core.close()
 
             # TODO: Would be good to "blink" and LED to indicate things are running ok
         #     new_kraken_address = await self.scan_and_add_widget.run()
@@ -233,9 +319,16 @@ class AppRoot(App):
         #     await sw['obj'].on_close()
 
 
+    async def main(self):
+        await self.async_run(async_lib="asyncio")
+        if self.core_task is not None:
+            await self.core_task # let the core wind down before the loop goes
+
+
 if __name__ == "__main__":
     Logger.setLevel(logging.DEBUG)
 
     # app running on one thread with two async coroutines
-    app = AppRoot()
-    asyncio.run(app.async_run(async_lib="asyncio"))
+    with STARTUP.phase("app init"):
+        app = AppRoot()
+    asyncio.run(app.main())
@@ -0,0 +1,316 @@
+"""
+Compact binary columnar log, written next to (or instead of) the CSV logs.
+
+File layout (little-endian):
+
+    b"KRKBLOG1"  uint32 schema_len  schema_json  (padded to 8 bytes)
+    chunk*       b"CHNK" uint32 n_rows, then for each column n_rows values
+                 stored contiguously (each column padded to 8 bytes)
+
+Every column has a fixed width, so a chunk can be read straight out of a
+memory map with np.frombuffer; nothing is parsed. The first column is always
+"Timestamp" as int64 ns since the epoch. Column types are looked up by name in
+COLUMN_TYPES, so BinaryLogger takes the same column-name list as CSVLogger.
+"""
+
+import csv
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from python import metrics
+from python.connection_info_decoder import PHY_DESCRIPTIONS
+
+MAGIC = b"KRKBLOG1"
+CHUNK_MAGIC = b"CHNK"
+
+_PHY_CODES = {desc: code for code, desc in PHY_DESCRIPTIONS.items()}
+
+# Sentinels for values the CSV logs write as '?' / empty
+UNKNOWN_RSSI = -128
+UNKNOWN_U8 = 255
+
+COLUMN_TYPES = {
+    "Timestamp": "<i8",
+    "address": "S17",
+    "name": "S16",
+    # BLE connection info
+    "kraken_rssi": "i1",
+    "kraken_power": "i1",
+    "kraken_phy": "u1",
+    "connection_count": "u1",
+    "central_rssi": "i1",
+    "central_phy": "u1",
+    "channel_map": "<u8",
+    "available_channels": "u1",
+    "current_channel": "u1",
+    "connection_interval_ms": "<f4",
+    "supervision_timeout_ms": "<u4",
+    # Pressure samples
+    "pressure_psi": "<f4",
+    "battery": "u1",
+    "scanner_tick": "u1",
+    "charging_state": "u1",
+}
+
+PRESSURE_COLUMNS = ["address", "name", "pressure_psi", "battery", "scanner_tick", "charging_state"]
+
+# ==============================================================================
+# Value conversion
+# ==============================================================================
+
+def _encode_phy(value):
+    if isinstance(value, str):
+        return _PHY_CODES.get(value, UNKNOWN_U8)
+    return value if value is not None else UNKNOWN_U8
+
+
+def _encode_channel_map(value):
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+
+def _encode_rssi(value):
+    if isinstance(value, (int, float, np.integer)):
+        return value
+    return UNKNOWN_RSSI
+
+
+def _encode_u8(value):
+    return UNKNOWN_U8 if value is None else value
+
+
+def _encode_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _encode_str(value):
+    return b"" if value is None else str(value).encode('utf-8')
+
+
+_ENCODERS = {
+    "kraken_phy": _encode_phy,
+    "central_phy": _encode_phy,
+    "channel_map": _encode_channel_map,
+    "central_rssi": _encode_rssi,
+    "charging_state": _encode_u8,
+    "pressure_psi": _encode_float,
+}
+
+
+def _format_phy(code):
+    return PHY_DESCRIPTIONS.get(code, code)
+
+
+_CSV_FORMATTERS = {
+    "kraken_phy": _format_phy,
+    "central_phy": _format_phy,
+    "channel_map": lambda v: f"0x{v:X}",
+    "central_rssi": lambda v: '?' if v == UNKNOWN_RSSI else v,
+    "charging_state": lambda v: '' if v == UNKNOWN_U8 else v,
+    "pressure_psi": lambda v: round(v, 1),
+}
+
+
+def _padded(n):
+    return (n + 7) & ~7
+
+# ==============================================================================
+# Writer
+# ==============================================================================
+
+BINARY_ROWS_DROPPED = metrics.counter("kraken_binary_rows_dropped_total", "Rows written to a BinaryLogger after close()")
+# One child per file, each only observed by that logger's writer thread
+BINARY_CHUNK_WRITE_SECONDS = metrics.histogram("kraken_binary_chunk_write_seconds", "Time to write one binary log chunk",
+                                               labels=("file",))
+
+class BinaryLogger:
+    """
+    Drop-in companion to CSVLogger: same constructor shape, write(), flush(), close().
+
+    write() only packs the row into the column buffers. Each full chunk is
+    handed to a background thread that writes it, as in a buffered
+    CSVLogger, so the caller only waits on the disk once `max_queue_chunks`
+    chunks are already waiting.
+    """
+    def __init__(self, col_names, log_file='log.kbl', chunk_rows=1024, max_queue_chunks=64):
+        names = [c for c in col_names if c != "Timestamp"]
+        unknown = [c for c in names if c not in COLUMN_TYPES]
+        if unknown:
+            raise ValueError(f"No binary column type defined for {unknown}")
+
+        self.log_file = log_file
+        self.chunk_rows = chunk_rows
+        self.columns = ["Timestamp"] + names
+        self._dtypes = [np.dtype(COLUMN_TYPES[c]) for c in self.columns]
+        self._encoders = [_ENCODERS.get(c) or (_encode_str if dt.kind == 'S' else None)
+                          for c, dt in zip(names, self._dtypes[1:])]
+        self._buffers = [np.zeros(chunk_rows, dtype=dt) for dt in self._dtypes]
+        self._rows = 0
+        self.dropped_rows = 0
+        self._closed = False
+
+        self._file = open(self.log_file, mode='ab')
+        if self._file.tell() == 0:
+            schema = json.dumps({"columns": [[c, dt.str] for c, dt in zip(self.columns, self._dtypes)]}).encode('utf-8')
+            header = MAGIC + struct.pack("<I", len(schema)) + schema
+            self._file.write(header + b"\0" * (_padded(len(header)) - len(header)))
+
+        self._chunk_write_seconds = BINARY_CHUNK_WRITE_SECONDS.labels(os.path.basename(log_file))
+        self._queue = queue.Queue(maxsize=max_queue_chunks)
+        self._thread = threading.Thread(target=self._writer_thread, name=f"BinaryLogger({log_file})", daemon=True)
+        self._thread.start()
+
+    def write(self, data, timestamp_ns=None):
+        if self._closed:
+            # Late notifications can still arrive while the app shuts down
+            self.dropped_rows += 1
+            BINARY_ROWS_DROPPED.inc()
+            return
+        i = self._rows
+        self._buffers[0][i] = time.time_ns() if timestamp_ns is None else timestamp_ns
+        for buffer, encode, value in zip(self._buffers[1:], self._encoders, data):
+            buffer[i] = encode(value) if encode else value
+        self._rows += 1
+        if self._rows == self.chunk_rows:
+            self._queue_chunk()
+
+    def _queue_chunk(self):
+        n = self._rows
+        if n == 0:
+            return
+        parts = [CHUNK_MAGIC, struct.pack("<I", n)]
+        for buffer in self._buffers:
+            raw = buffer[:n].tobytes()
+            parts.append(raw)
+            parts.append(b"\0" * (_padded(len(raw)) - len(raw)))
+        self._queue.put(b"".join(parts))
+        self._rows = 0
+
+    def flush(self, wait=True):
+        """Hand the rows buffered so far to the writer thread and, with `wait`, block until they are on disk."""
+        if self._closed:
+            return
+        self._queue_chunk()
+        self._queue.put(_FLUSH)
+        if wait:
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._queue_chunk()
+        self._queue.put(_CLOSE)
+        self._closed = True
+        self._thread.join()
+        if self.dropped_rows:
+            logging.warning(f"BinaryLogger dropped {self.dropped_rows} rows for {self.log_file}")
+
+    def _writer_thread(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _FLUSH:
+                    self._file.flush()
+                elif item is _CLOSE:
+                    self._file.close()
+                    return
+                else:
+                    start = time.perf_counter()
+                    self._file.write(item)
+                    self._chunk_write_seconds.observe(time.perf_counter() - start)
+            except OSError as e:
+                logging.error(f"BinaryLogger could not write to {self.log_file} ({e})")
+            finally:
+                self._queue.task_done()
+
+
+# Markers passed through the queue to the writer thread
+_FLUSH = object()
+_CLOSE = object()
+
+# ==============================================================================
+# Reader
+# ==============================================================================
+
+def _read_schema(buf):
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a Kraken binary log (bad magic)")
+    (schema_len,) = struct.unpack_from("<I", buf, len(MAGIC))
+    start = len(MAGIC) + 4
+    schema = json.loads(bytes(buf[start:start + schema_len]).decode('utf-8'))
+    columns = [(name, np.dtype(dt)) for name, dt in schema["columns"]]
+    return columns, _padded(start + schema_len)
+
+
+def iter_chunks(log_file):
+    """Yield one {column: array} dict per chunk. Arrays are views on a read-only memory map."""
+    buf = np.memmap(log_file, dtype=np.uint8, mode='r')
+    columns, offset = _read_schema(buf)
+    while offset + 8 <= len(buf):
+        if bytes(buf[offset:offset + 4]) != CHUNK_MAGIC:
+            raise ValueError(f"Corrupt chunk header at offset {offset} in {log_file}")
+        (n,) = struct.unpack_from("<I", buf, offset + 4)
+        offset += 8
+        chunk = {}
+        for name, dtype in columns:
+            size = n * dtype.itemsize
+            if offset + size > len(buf):
+                logging.warning(f"Truncated final chunk in {log_file}, ignoring it")
+                return
+            chunk[name] = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+            offset += _padded(size)
+        yield chunk
+
+
+def read_binary_log(log_file):
+    """Return {column: array} for the whole file."""
+    buf = np.memmap(log_file, dtype=np.uint8, mode='r')
+    columns, _ = _read_schema(buf)
+    chunks = list(iter_chunks(log_file))
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([c[name] for c in chunks]) if chunks else np.empty(0, dtype=dtype)
+            for name, dtype in columns}
+
+
+def binary_log_to_csv(log_file, csv_file):
+    """Convert a binary log to the same layout CSVLogger writes."""
+    columns, _ = _read_schema(np.memmap(log_file, dtype=np.uint8, mode='r'))
+    names = [name for name, _ in columns]
+    with open(csv_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(names)
+        for chunk in iter_chunks(log_file):
+            columns = []
+            for name in names:
+                values = chunk[name]
+                if name == "Timestamp":
+                    columns.append([datetime.fromtimestamp(ns / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] for ns in values.tolist()])
+                elif values.dtype.kind == 'S':
+                    columns.append([v.decode('utf-8', 'replace') for v in values.tolist()])
+                elif name in _CSV_FORMATTERS:
+                    columns.append([_CSV_FORMATTERS[name](v) for v in values.tolist()])
+                else:
+                    columns.append(values.tolist())
+            writer.writerows(zip(*columns))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert a Kraken binary log to CSV")
+    parser.add_argument("log_file")
+    parser.add_argument("csv_file")
+    args = parser.parse_args()
+    binary_log_to_csv(args.log_file, args.csv_file)
@@ -0,0 +1,36 @@
+"""
+Pluggable BLE backend.
+
+Everything that needs a scanner or a client should go through
+`create_scanner` / `create_client` instead of instantiating bleak directly, so
+the real radio can be swapped for the in-process simulator (see
+`python.sim_kraken`) when testing scaling on a box without Bluetooth.
+"""
+
+from bleak import BleakClient, BleakScanner
+
+_scanner_class = BleakScanner
+_client_class = BleakClient
+
+
+def set_backend(scanner_class, client_class):
+    """Use the given classes in place of BleakScanner / BleakClient."""
+    global _scanner_class, _client_class
+    _scanner_class = scanner_class
+    _client_class = client_class
+
+
+def reset_backend():
+    set_backend(BleakScanner, BleakClient)
+
+
+def is_simulated():
+    return _client_class is not BleakClient
+
+
+def create_scanner(*args, **kwargs):
+    return _scanner_class(*args, **kwargs)
+
+
+def create_client(*args, **kwargs):
+    return _client_class(*args, **kwargs)
@@ -1,13 +1,20 @@
 import logging
 import asyncio
+import time
 
-from bleak import BleakScanner
-
+import python.ble_backend as ble_backend
 import python.kraken_uuids as kraken_uuids
+from python import metrics
+
+SCAN_CYCLE_SECONDS = metrics.histogram("kraken_scan_cycle_seconds", "Duration of a scan_for_kraken_beacons() cycle, including stack recovery")
+ADVERTISEMENTS = metrics.counter("kraken_advertisements_total", "Kraken advertisements seen by the continuous scanner")
+SCAN_EVENTS = metrics.counter("kraken_scan_events_total", "Scanner events after deduplication", labels=("event",))
+SCAN_EVENTS_DROPPED = metrics.counter("kraken_scan_events_dropped_total", "Scanner events dropped because the consumer fell behind")
 
 async def scan_for_kraken_beacons(scan_duration_seconds=1):
+    cycle_start = time.perf_counter()
     kraken_list = {}
-    
+
     def detection_callback(device, advertisement_data):
         nonlocal kraken_list
         if kraken_uuids.KRAKEN_SERVICE_UUID in advertisement_data.service_uuids:
@@ -17,7 +24,7 @@ async def scan_for_kraken_beacons(scan_duration_seconds=1):
                     "rssi": advertisement_data.rssi
                 }
 
-    scanner = BleakScanner(detection_callback)
+    scanner = ble_backend.create_scanner(detection_callback)
     logging.info(f"Performing {scan_duration_seconds} second scan for BLE devices")
     await scanner.start()
     await asyncio.sleep(scan_duration_seconds)
@@ -26,4 +33,97 @@ async def scan_for_kraken_beacons(scan_duration_seconds=1):
 
     await asyncio.sleep(3) # time for BLE stack to recover
 
-    return kraken_list
\ No newline at end of file
+    SCAN_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
+    return kraken_list
+
+
+# ==============================================================================
+# Continuous scanning
+# ==============================================================================
+
+class KrakenScanner:
+    """
+    Long-lived scanner that keeps the radio scanning and yields events as an
+    async iterator:
+
+        async for event, address, data in scanner.events():
+            ...
+
+    `event` is "discovered" the first time an address is seen and "updated"
+    afterwards. Repeated advertisements are deduplicated: an update is only
+    emitted when the RSSI moved by at least `rssi_delta_db`, or when
+    `update_interval_seconds` has passed since the last event for that address.
+    """
+    def __init__(self, update_interval_seconds=1.0, rssi_delta_db=3, max_pending_events=1000):
+        self.update_interval_seconds = update_interval_seconds
+        self.rssi_delta_db = rssi_delta_db
+
+        # address -> {"rssi": int, "last_event": float}
+        self.seen = {}
+        self._events = asyncio.Queue(maxsize=max_pending_events)
+        self._scanner = None
+        self.dropped_events = 0
+
+    def _detection_callback(self, device, advertisement_data):
+        # The OS level filter should already restrict results to Krakens, but
+        # some backends (e.g. Android without a matching filter) still pass
+        # everything through.
+        if kraken_uuids.KRAKEN_SERVICE_UUID not in advertisement_data.service_uuids:
+            return
+        ADVERTISEMENTS.inc()
+
+        now = time.monotonic()
+        rssi = advertisement_data.rssi
+        entry = self.seen.get(device.address)
+        if entry is None:
+            logging.info(f"Scanner found new Kraken {device.address}")
+            self.seen[device.address] = {"rssi": rssi, "last_event": now}
+            self._push("discovered", device.address, {"rssi": rssi})
+            return
+
+        if (abs(rssi - entry["rssi"]) < self.rssi_delta_db
+                and now - entry["last_event"] < self.update_interval_seconds):
+            return # Duplicate advertisement, nothing new to report
+
+        entry["rssi"] = rssi
+        entry["last_event"] = now
+        self._push("updated", device.address, {"rssi": rssi})
+
+    def _push(self, event, address, data):
+        try:
+            self._events.put_nowait((event, address, data))
+            SCAN_EVENTS.labels(event).inc()
+        except asyncio.QueueFull:
+            # Consumer is not keeping up, the next advertisement will refresh it
+            self.dropped_events += 1
+            SCAN_EVENTS_DROPPED.inc()
+
+    async def start(self):
+        if self._scanner is not None:
+            return
+        self._scanner = ble_backend.create_scanner(self._detection_callback,
+                                                  service_uuids=[kraken_uuids.KRAKEN_SERVICE_UUID])
+        logging.info("Starting continuous BLE scan for Krakens")
+        await self._scanner.start()
+
+    async def stop(self):
+        if self._scanner is None:
+            return
+        await self._scanner.stop()
+        self._scanner = None
+        logging.info("Continuous BLE scan stopped")
+
+    def forget(self, address):
+        """Drop dedup state so the next advertisement is reported as a discovery."""
+        self.seen.pop(address, None)
+
+    async def events(self):
+        while True:
+            yield await self._events.get()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
@@ -0,0 +1,334 @@
+"""
+Raw BLE notification capture and replay.
+
+Capture file layout (little-endian):
+
+    b"KRKCAP01"  uint32 header_len  header_json
+    record*      uint8 kind, uint32 payload_len, payload
+
+Record kinds:
+
+    CHANNEL  uint16 channel_id, uint8 address_len, address (utf-8), 16 byte UUID
+    NOTIFY   int64 timestamp_ns, uint16 channel_id, notification bytes
+
+A channel is one (address, characteristic UUID) pair and is written once,
+before its first notification, so a notification record costs 15 bytes on
+top of its payload. Timestamps are time.time_ns() at the moment the callback
+ran.
+
+Replay feeds a capture back through the KrakenSession notification callbacks,
+either paced at 1x/Nx the recorded rate or as fast as possible, which also
+makes it a repeatable benchmark of the decode/log/UI path:
+
+    python -m python.capture replay capture.kcap --speed max
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import struct
+import time
+import uuid
+
+from bleak.uuids import normalize_uuid_str
+
+import python.kraken_uuids as kraken_uuids
+
+MAGIC = b"KRKCAP01"
+FORMAT_VERSION = 1
+
+KIND_CHANNEL = 1
+KIND_NOTIFY = 2
+
+_RECORD_HEADER = struct.Struct("<BI")
+_NOTIFY_HEADER = struct.Struct("<qH")
+_CHANNEL_ID = struct.Struct("<H")
+
+MAX_CHANNELS = 0xFFFF
+
+
+def _uuid_bytes(char_uuid):
+    return uuid.UUID(normalize_uuid_str(str(char_uuid))).bytes
+
+# ==============================================================================
+# Writer
+# ==============================================================================
+
+class CaptureWriter:
+    def __init__(self, capture_file, buffer_size=1 << 16, **header):
+        self.capture_file = capture_file
+        self._channels = {}
+        self.records = 0
+
+        self._file = open(capture_file, mode='wb', buffering=buffer_size)
+        meta = json.dumps(dict(header, version=FORMAT_VERSION, created_ns=time.time_ns())).encode('utf-8')
+        self._file.write(MAGIC + struct.pack("<I", len(meta)) + meta)
+
+    def write(self, address, char_uuid, data, timestamp_ns=None):
+        if self._file.closed:
+            return
+        key = (address, char_uuid)
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._add_channel(address, char_uuid)
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        self._file.write(_RECORD_HEADER.pack(KIND_NOTIFY, _NOTIFY_HEADER.size + len(data))
+                         + _NOTIFY_HEADER.pack(timestamp_ns, channel) + bytes(data))
+        self.records += 1
+
+    def _add_channel(self, address, char_uuid):
+        channel = len(self._channels)
+        if channel >= MAX_CHANNELS:
+            raise ValueError(f"Capture {self.capture_file} is limited to {MAX_CHANNELS} channels")
+        encoded_address = address.encode('utf-8')
+        payload = _CHANNEL_ID.pack(channel) + bytes([len(encoded_address)]) + encoded_address + _uuid_bytes(char_uuid)
+        self._file.write(_RECORD_HEADER.pack(KIND_CHANNEL, len(payload)) + payload)
+        self._channels[(address, char_uuid)] = channel
+        return channel
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+# ==============================================================================
+# Reader
+# ==============================================================================
+
+def read_header(capture_file):
+    with open(capture_file, mode='rb') as file:
+        return _read_header(file)
+
+
+def _read_header(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a Kraken capture file (bad magic)")
+    (header_len,) = struct.unpack("<I", file.read(4))
+    return json.loads(file.read(header_len).decode('utf-8'))
+
+
+def iter_capture(capture_file):
+    """Yield (timestamp_ns, address, char_uuid, data) for every notification."""
+    # Memory-mapped so a long capture is paged in as it is replayed rather than read whole
+    with open(capture_file, mode='rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        _read_header(file)
+        yield from _iter_records(buf, file.tell(), capture_file)
+
+
+def _iter_records(buf, offset, capture_file):
+    channels = {}
+    end = len(buf)
+    while offset + _RECORD_HEADER.size <= end:
+        kind, length = _RECORD_HEADER.unpack_from(buf, offset)
+        offset += _RECORD_HEADER.size
+        if offset + length > end:
+            logging.warning(f"Truncated final record in {capture_file}, ignoring it")
+            return
+        if kind == KIND_NOTIFY:
+            timestamp_ns, channel = _NOTIFY_HEADER.unpack_from(buf, offset)
+            address, char_uuid = channels[channel]
+            yield timestamp_ns, address, char_uuid, buf[offset + _NOTIFY_HEADER.size:offset + length]
+        elif kind == KIND_CHANNEL:
+            (channel,) = _CHANNEL_ID.unpack_from(buf, offset)
+            address_len = buf[offset + 2]
+            address = buf[offset + 3:offset + 3 + address_len].decode('utf-8')
+            uuid_start = offset + 3 + address_len
+            channels[channel] = (address, str(uuid.UUID(bytes=buf[uuid_start:uuid_start + 16])))
+        else:
+            raise ValueError(f"Unknown record kind {kind} at offset {offset - _RECORD_HEADER.size} in {capture_file}")
+        offset += length
+
+# ==============================================================================
+# Replay
+# ==============================================================================
+
+class ReplayCharacteristic:
+    """Stands in for the BleakGATTCharacteristic passed to notification callbacks."""
+    __slots__ = ("uuid",)
+
+    def __init__(self, char_uuid):
+        self.uuid = char_uuid
+
+    def __str__(self):
+        return f"{self.uuid} (replay)"
+
+
+def session_callbacks(session):
+    """char UUID -> notification callback for a KrakenSession."""
+    return {
+        normalize_uuid_str(kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID): session._process_pressure_data_notification,
+        normalize_uuid_str(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID): session._process_ble_connection_info_notification,
+    }
+
+
+async def replay(capture_file, get_session, speed=1.0, on_tick=None, tick_interval_seconds=0.1):
+    """
+    Feed a capture through KrakenSession callbacks.
+
+    `get_session(address)` returns the session for an address (creating it if
+    needed). `speed` is the playback rate relative to the recording, or None
+    to go as fast as possible. `on_tick` is called every
+    `tick_interval_seconds` of wall time, e.g. to flush a RenderScheduler.
+
+    Returns a dict with replayed/skipped notification counts and timings.
+    """
+    callbacks = {}
+    characteristics = {}
+    replayed = skipped = 0
+    first_ns = None
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    next_tick = start + tick_interval_seconds
+
+    for timestamp_ns, address, char_uuid, data in iter_capture(capture_file):
+        key = (address, char_uuid)
+        callback = callbacks.get(key)
+        if callback is None and key not in callbacks:
+            callback = callbacks[key] = session_callbacks(get_session(address)).get(char_uuid)
+            characteristics[key] = ReplayCharacteristic(char_uuid)
+        if callback is None:
+            skipped += 1
+            continue
+
+        if first_ns is None:
+            first_ns = timestamp_ns
+        if speed is not None:
+            delay = start + (timestamp_ns - first_ns) / 1e9 / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        callback(characteristics[key], bytearray(data))
+        replayed += 1
+
+        now = loop.time()
+        if now >= next_tick:
+            if on_tick is not None:
+                on_tick()
+            next_tick = now + tick_interval_seconds
+            if speed is None:
+                await asyncio.sleep(0) # let other tasks run
+    if on_tick is not None:
+        on_tick()
+
+    elapsed = loop.time() - start
+    return {
+        "replayed": replayed,
+        "skipped": skipped,
+        "elapsed_s": elapsed,
+        "notifications_per_s": replayed / elapsed if elapsed > 0 else float('inf'),
+    }
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+async def _record(capture_file, device_count, duration_seconds):
+    # Record a capture from the simulated fleet, handy for benchmarks and demos
+    from python.sim_kraken import SimulatedFleet
+    import python.ble_backend as ble_backend
+
+    fleet = SimulatedFleet(device_count)
+    fleet.install()
+    writer = CaptureWriter(capture_file, source="simulated", devices=device_count)
+    clients = []
+    try:
+        for address in fleet.devices:
+            client = ble_backend.create_client(address)
+            await client.connect()
+            for char_uuid in (kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID, kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID):
+                await client.start_notify(char_uuid, lambda char, data, address=address: writer.write(address, char.uuid, data))
+            clients.append(client)
+        await asyncio.sleep(duration_seconds)
+    finally:
+        for client in clients:
+            await client.disconnect()
+        ble_backend.reset_backend()
+        writer.close()
+    logging.info(f"Recorded {writer.records} notifications from {device_count} simulated Krakens to {capture_file}")
+
+
+async def _replay(capture_file, speed, out_dir, with_ui, with_pipeline):
+    from python import csv_log
+    from python.kraken_core import CONNECTION_INFO_COLUMNS, create_pipeline
+    from python.kraken_session import KrakenSession
+
+    info_logger = csv_log.CSVLogger(list(CONNECTION_INFO_COLUMNS), f"{out_dir}/replay_connection_info.csv", buffered=True)
+    event_logger = csv_log.CSVLogger(["source", "event", "notes"], f"{out_dir}/replay_events.csv", buffered=True)
+    render_scheduler = None
+    if with_ui:
+        # Kivy is only imported when the UI path is part of the benchmark
+        from python.kraken_widget import KrakenWidget
+        from python.render_scheduler import RenderScheduler
+        render_scheduler = RenderScheduler()
+    sessions = {}
+    widgets = []
+    bus = None
+    if with_pipeline:
+        bus = create_pipeline()
+        bus.start()
+
+    def get_session(address):
+        session = sessions.get(address)
+        if session is None:
+            session = sessions[address] = KrakenSession(address, info_logger, event_logger, bus=bus)
+            if with_ui:
+                widget = KrakenWidget(session, render_scheduler=render_scheduler)
+                widget.set_visibility(True)
+                widgets.append(widget)
+        return session
+
+    try:
+        result = await replay(capture_file, get_session, speed=speed,
+                              on_tick=render_scheduler.flush if render_scheduler is not None else None)
+        if bus is not None:
+            # Count the time the stages need to catch up, then report what they dropped
+            start = time.perf_counter()
+            await bus.join()
+            result["elapsed_s"] += time.perf_counter() - start
+            result["notifications_per_s"] = result["replayed"] / result["elapsed_s"]
+            result["bus"] = bus.stats()
+            await bus.stop()
+    finally:
+        info_logger.close()
+        event_logger.close()
+    result["devices"] = len(sessions)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Record or replay raw Kraken notification captures")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record-sim", help="record a capture from the simulated fleet")
+    rec.add_argument("capture_file")
+    rec.add_argument("--devices", type=int, default=10)
+    rec.add_argument("--duration", type=float, default=10.0)
+    rep = sub.add_parser("replay", help="replay a capture through KrakenSession")
+    rep.add_argument("capture_file")
+    rep.add_argument("--speed", default="1", help="playback rate relative to the recording, or 'max'")
+    rep.add_argument("--out-dir", default=None, help="where the replayed CSV logs go (default: a temp dir)")
+    rep.add_argument("--ui", action="store_true", help="also drive a KrakenWidget detail view per device")
+    rep.add_argument("--pipeline", action="store_true", help="go through the event bus stages like the app does")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "record-sim":
+        asyncio.run(_record(args.capture_file, args.devices, args.duration))
+    else:
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+        speed = None if args.speed == "max" else float(args.speed)
+        out_dir = args.out_dir or tempfile.mkdtemp(prefix="kraken_replay_")
+        result = asyncio.run(_replay(args.capture_file, speed, out_dir, args.ui, args.pipeline))
+        print(f"replayed {result['replayed']} notifications from {result['devices']} devices "
+              f"({result['skipped']} skipped) in {result['elapsed_s']:.2f} s "
+              f"= {result['notifications_per_s']:.0f} notifications/s")
+        for name, stage in result.get("bus", {}).items():
+            print(f"  {name:<10} high water {stage['high_water']:>6}/{stage['maxsize']}  "
+                  f"dropped {stage['dropped']}  errors {stage['errors']}")
@@ -0,0 +1,206 @@
+"""
+Decoder for BLE_CONNECTION_INFO_CHAR_UUID notifications.
+
+Packet layout (18 bytes, multi-byte fields big-endian):
+
+    0   int8    kraken_rssi
+    1   int8    kraken_current_power
+    2   uint8   kraken_max_power
+    3   5 bytes channel_map (40 bits, data channels 0-36 in use)
+    8   uint8   current_channel
+    9   uint16  connection_interval     (units of 1.25 ms)
+    11  uint16  supervision_timeout     (units of 10 ms)
+    13  uint8   central_phy
+    14  uint8   kraken_phy
+    15  uint16  last_disconnect_reason  (sl_status_t)
+    17  uint8   open_connections
+
+decode() handles one packet (the notification callback), decode_batch()
+handles N packets laid out back to back (log replay, offline analysis) in one
+vectorized call. Both reject short or malformed input with
+ConnectionInfoDecodeError.
+"""
+
+import struct
+
+import numpy as np
+
+PACKET_SIZE = 18
+
+PACKET_DTYPE = np.dtype([
+    ("kraken_rssi", "i1"),
+    ("kraken_current_power", "i1"),
+    ("kraken_max_power", "u1"),
+    ("channel_map", "u1", (5,)),
+    ("current_channel", "u1"),
+    ("connection_interval", ">u2"),
+    ("supervision_timeout", ">u2"),
+    ("central_phy", "u1"),
+    ("kraken_phy", "u1"),
+    ("last_disconnect_reason", ">u2"),
+    ("open_connections", "u1"),
+])
+assert PACKET_DTYPE.itemsize == PACKET_SIZE
+
+# What decode_batch() returns, one record per packet
+DECODED_DTYPE = np.dtype([
+    ("kraken_rssi", "i1"),
+    ("kraken_current_power", "i1"),
+    ("kraken_max_power", "u1"),
+    ("channel_map", "u8"),
+    ("channel_count", "u1"),
+    ("current_channel", "u1"),
+    ("connection_interval_ms", "f4"),
+    ("supervision_timeout_ms", "u4"),
+    ("central_phy", "u1"),
+    ("kraken_phy", "u1"),
+    ("last_disconnect_reason", "u2"),
+    ("open_connections", "u1"),
+])
+
+_PACKET_STRUCT = struct.Struct(">bbB5sBHHBBHB")
+
+# BLE PHY id -> description
+PHY_DESCRIPTIONS = {
+    1: "1M",
+    2: "2M",
+    4: "Coded PHY - 125k (S=8) or 500k (S=2)"
+}
+
+# The channel map is 40 bits wide, only data channels 0-36 exist
+MAX_DATA_CHANNEL = 36
+
+_POPCOUNT_U8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class ConnectionInfoDecodeError(ValueError):
+    pass
+
+
+def phy_description(phy_id):
+    return PHY_DESCRIPTIONS.get(phy_id, phy_id)
+
+
+def decode(packet):
+    """Decode one packet into a dict of plain Python values (PHYs and disconnect reason as raw codes)."""
+    if len(packet) < PACKET_SIZE:
+        raise ConnectionInfoDecodeError(f"BLE connection info packet too short ({len(packet)} bytes, expected {PACKET_SIZE})")
+
+    (kraken_rssi, kraken_current_power, kraken_max_power, channel_map_bytes, current_channel,
+     connection_interval, supervision_timeout, central_phy, kraken_phy, last_disconnect_reason,
+     open_connections) = _PACKET_STRUCT.unpack_from(packet)
+
+    if current_channel > MAX_DATA_CHANNEL:
+        raise ConnectionInfoDecodeError(f"BLE connection info packet has invalid current channel {current_channel}")
+
+    channel_map = int.from_bytes(channel_map_bytes, 'big')
+    return {
+        "kraken_rssi": kraken_rssi,
+        "kraken_current_power": kraken_current_power,
+        "kraken_max_power": kraken_max_power,
+        "channel_map": channel_map,
+        "channel_count": bin(channel_map).count("1"),
+        "current_channel": current_channel,
+        "connection_interval_ms": connection_interval * 1.25,
+        "supervision_timeout_ms": supervision_timeout * 10,
+        "central_phy": central_phy,
+        "kraken_phy": kraken_phy,
+        "last_disconnect_reason": last_disconnect_reason,
+        "open_connections": open_connections,
+    }
+
+
+def decode_batch(buffer, strict=True):
+    """
+    Decode N packets stored back to back in `buffer` (bytes-like or uint8 array).
+
+    Returns a DECODED_DTYPE structured array. With strict=True any packet with
+    an invalid current channel fails the whole batch; with strict=False those
+    records are dropped instead.
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size % PACKET_SIZE:
+        raise ConnectionInfoDecodeError(f"BLE connection info batch of {raw.size} bytes is not a multiple of {PACKET_SIZE}")
+
+    packets = raw.view(PACKET_DTYPE)
+    bad = packets["current_channel"] > MAX_DATA_CHANNEL
+    if bad.any():
+        if strict:
+            index = int(np.flatnonzero(bad)[0])
+            raise ConnectionInfoDecodeError(f"BLE connection info packet {index} has invalid current channel {packets['current_channel'][index]}")
+        packets = packets[~bad]
+
+    channel_map_bytes = packets["channel_map"]
+    channel_map = np.zeros(len(packets), dtype=np.uint64)
+    for i in range(5):
+        channel_map = (channel_map << np.uint64(8)) | channel_map_bytes[:, i].astype(np.uint64)
+
+    out = np.empty(len(packets), dtype=DECODED_DTYPE)
+    out["kraken_rssi"] = packets["kraken_rssi"]
+    out["kraken_current_power"] = packets["kraken_current_power"]
+    out["kraken_max_power"] = packets["kraken_max_power"]
+    out["channel_map"] = channel_map
+    out["channel_count"] = _POPCOUNT_U8[channel_map_bytes].sum(axis=1)
+    out["current_channel"] = packets["current_channel"]
+    out["connection_interval_ms"] = packets["connection_interval"] * np.float32(1.25)
+    out["supervision_timeout_ms"] = packets["supervision_timeout"].astype(np.uint32) * 10
+    out["central_phy"] = packets["central_phy"]
+    out["kraken_phy"] = packets["kraken_phy"]
+    out["last_disconnect_reason"] = packets["last_disconnect_reason"]
+    out["open_connections"] = packets["open_connections"]
+    return out
+
+# ==============================================================================
+# Microbenchmark
+# ==============================================================================
+
+def _decode_legacy(data):
+    # Verbatim copy of the decode previously inlined in
+    # KrakenWidget._process_ble_connection_info_notification (minus logging/UI)
+    interpreted_data = {
+        "kraken_rssi": np.frombuffer(data, dtype=np.int8, count=1)[0],
+        "kraken_current_power": np.frombuffer(data, dtype=np.int8, count=2)[1],
+        "kraken_max_power": data[2],
+        "channel_map": (data[3] << (4*8)) | (data[4] << (3*8)) | (data[5] << (2*8)) | (data[6] << (1*8)) | (data[7]),
+        "current_channel": data[8],
+        "connection_interval_ms": ((data [9] << 8) | data[10]) * 1.25,
+        "supervision_timeout_ms": ((data[11] << 8) | data[12]) * 10,
+        "central_phy": data[13],
+        "kraken_phy": data[14],
+        "last_disconnect_reason": (data[15] << 8) | data[16],
+        "open_connections": data[17]
+    }
+    channel_count = 0
+    working_channel_map = interpreted_data["channel_map"]
+    for i in range(8*5):
+        if working_channel_map & 0x01:
+            channel_count += 1
+        working_channel_map >>= 1
+    return interpreted_data, channel_count
+
+
+def _benchmark(n=20000):
+    import random
+    import timeit
+
+    rng = random.Random(0)
+    packets = [struct.pack(">bbB5sBHHBBHB", rng.randint(-100, -30), 4, 8,
+                           rng.getrandbits(37).to_bytes(5, 'big'), rng.randrange(37),
+                           24, 400, 1, 2, 0x1008, 1) for _ in range(n)]
+    blob = b"".join(packets)
+
+    for packet in packets[:100]:
+        legacy, legacy_count = _decode_legacy(packet)
+        new = decode(packet)
+        assert legacy_count == new["channel_count"]
+        assert all(legacy[k] == new[k] for k in legacy)
+
+    t_legacy = min(timeit.repeat(lambda: [_decode_legacy(p) for p in packets], number=1, repeat=3))
+    t_single = min(timeit.repeat(lambda: [decode(p) for p in packets], number=1, repeat=3))
+    t_batch = min(timeit.repeat(lambda: decode_batch(blob), number=1, repeat=3))
+    for label, t in (("legacy", t_legacy), ("decode", t_single), ("decode_batch", t_batch)):
+        print(f"{label:>13}: {1e6 * t / n:8.3f} us/packet  ({t_legacy / t:6.1f}x)")
+
+
+if __name__ == "__main__":
+    _benchmark()
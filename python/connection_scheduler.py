@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+class ConnectionScheduler:
+    """
+    Runs connection attempts concurrently as asyncio tasks.
+
+    At most `max_in_flight` attempts run at once, each is cancelled after its
+    timeout, and queued attempts are started lowest `priority` first (pass
+    -rssi to connect the strongest devices first). A key (normally the device
+    address) can only be queued or in flight once at a time.
+
+    `connect` is a coroutine function returning True on success.
+    """
+    def __init__(self, max_in_flight=4, connect_timeout_seconds=15, latency_history=256):
+        self.max_in_flight = max_in_flight
+        self.connect_timeout_seconds = connect_timeout_seconds
+
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count() # tie breaker, keeps FIFO within a priority
+        self._pending = set()
+        self._workers = []
+        self.in_flight = 0
+
+        self.latencies = deque(maxlen=latency_history)
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_in_flight)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, key, connect, priority=0, timeout_seconds=None):
+        """Queue a connection attempt. Returns False if `key` is already queued or connecting."""
+        if key in self._pending:
+            return False
+        self._pending.add(key)
+        self._queue.put_nowait((priority, next(self._order), key, connect, timeout_seconds))
+        return True
+
+    def is_pending(self, key):
+        return key in self._pending
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """Connect latency percentiles in ms over the recent successful attempts."""
+        if not self.latencies:
+            return {p: None for p in percentiles}
+        ordered = sorted(self.latencies)
+        return {p: 1000 * ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] for p in percentiles}
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "latency_ms": self.latency_percentiles(),
+        }
+
+    async def _worker(self):
+        while True:
+            priority, _, key, connect, timeout_seconds = await self._queue.get()
+            timeout_seconds = timeout_seconds or self.connect_timeout_seconds
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                if await asyncio.wait_for(connect(), timeout_seconds):
+                    self.succeeded += 1
+                    self.latencies.append(time.perf_counter() - start)
+                else:
+                    self.failed += 1
+            except asyncio.TimeoutError:
+                logging.warning(f"Connection to {key} timed out after {timeout_seconds} s")
+                self.timed_out += 1
+            except Exception as e:
+                logging.warning(f"Connection to {key} failed ({e})")
+                self.failed += 1
+            finally:
+                self.in_flight -= 1
+                self._pending.discard(key)
+                self._queue.task_done()
+
+    async def wait_idle(self):
+        """Wait until everything queued so far has been attempted."""
+        await self._queue.join()
@@ -1,8 +1,42 @@
 import csv
+import logging
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+from python import metrics
+
+CSV_WRITE_SECONDS = metrics.histogram("kraken_csv_write_seconds", "Time spent in CSVLogger.write() by the caller")
+# One child per file, each only observed by that logger's writer thread
+CSV_BATCH_WRITE_SECONDS = metrics.histogram("kraken_csv_batch_write_seconds", "Time to write and flush one batch of buffered rows", labels=("file",))
+CSV_ROWS_DROPPED = metrics.counter("kraken_csv_rows_dropped_total", "Rows dropped by buffered CSVLoggers")
+
 class CSVLogger:
-    def __init__(self, col_names, csv_file='log.csv'):
+    """
+    Appends timestamped rows to a CSV file.
+
+    By default every write() opens, appends and closes the file. With
+    `buffered=True` the file stays open and rows are queued for a background
+    thread that writes them in batches, flushing when `flush_rows` rows are
+    waiting or `flush_interval_s` has passed. The queue holds at most
+    `max_queue` rows; when it is full `overflow` decides what happens:
+
+      "block"       - write() waits for room (no data loss)
+      "drop_newest" - the new row is discarded
+      "drop_oldest" - the oldest queued row is discarded to make room
+
+    Dropped rows are counted in `dropped_rows`. Call close() (or flush()) before
+    exiting so queued rows reach the disk.
+    """
+    OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, col_names, csv_file='log.csv', buffered=False,
+                 flush_rows=256, flush_interval_s=1.0, max_queue=10000, overflow="block"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {self.OVERFLOW_POLICIES}")
+
         self.csv_file = csv_file
         col_names.insert(0, "Timestamp")
         # Create the CSV file and write the header if it doesn't exist
@@ -10,15 +44,151 @@ class CSVLogger:
             writer = csv.writer(file)
             writer.writerow(col_names)
 
-    def write(self, data):
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        with open(self.csv_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            row = [timestamp] + data
-            writer.writerow(row)
+        self.buffered = buffered
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self.overflow = overflow
+        self.dropped_rows = 0
+        self._closed = False
+
+        if buffered:
+            self._batch_write_seconds = CSV_BATCH_WRITE_SECONDS.labels(os.path.basename(csv_file))
+            self._queue = queue.Queue(maxsize=max_queue)
+            self._file = open(self.csv_file, mode='a', newline='')
+            self._writer = csv.writer(self._file)
+            self._thread = threading.Thread(target=self._writer_thread, name=f"CSVLogger({csv_file})", daemon=True)
+            self._thread.start()
+
+    def write(self, data, timestamp_ns=None):
+        """Append a row, timestamped now or at `timestamp_ns` (time.time_ns()) if given."""
+        start = time.perf_counter()
+        self._write(data, datetime.now() if timestamp_ns is None else datetime.fromtimestamp(timestamp_ns / 1e9))
+        CSV_WRITE_SECONDS.observe(time.perf_counter() - start)
+
+    def _write(self, data, timestamp):
+        if not self.buffered:
+            timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            with open(self.csv_file, mode='a', newline='') as file:
+                writer = csv.writer(file)
+                row = [timestamp] + data
+                writer.writerow(row)
+            return
+
+        if self._closed:
+            # Late notifications can still arrive while the app shuts down
+            self.dropped_rows += 1
+            CSV_ROWS_DROPPED.inc()
+            return
+
+        # Only capture the time here, formatting happens on the writer thread
+        item = (timestamp, data)
+        if self.overflow == "block":
+            self._queue.put(item)
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == "drop_oldest":
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    pass # lost the race with another writer, drop this one instead
+            self.dropped_rows += 1
+            CSV_ROWS_DROPPED.inc()
+
+    def flush(self):
+        """Block until every row queued so far is on disk."""
+        if self.buffered and not self._closed:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        if not self.buffered or self._closed:
+            return
+        self._queue.put(_CLOSE)
+        self._closed = True
+        self._thread.join()
+        if self.dropped_rows:
+            logging.warning(f"CSVLogger dropped {self.dropped_rows} rows for {self.csv_file}")
+
+    def _writer_thread(self):
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval_s - (time.monotonic() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _FLUSH and item is not _CLOSE:
+                batch.append(item)
+
+            if (item is _FLUSH or item is _CLOSE or len(batch) >= self.flush_rows
+                    or time.monotonic() - last_flush >= self.flush_interval_s):
+                self._write_batch(batch)
+                batch = []
+                last_flush = time.monotonic()
+
+            if item is not None:
+                self._queue.task_done()
+            if item is _CLOSE:
+                self._file.close()
+                return
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        if batch:
+            self._writer.writerows([ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]] + data for ts, data in batch)
+        self._file.flush()
+        if batch:
+            self._batch_write_seconds.observe(time.perf_counter() - start)
+
+
+class TeeLogger:
+    """Fans each row out to several loggers sharing one column layout (e.g. CSV + binary)."""
+    def __init__(self, *loggers):
+        self.loggers = loggers
+
+    def write(self, data, timestamp_ns=None):
+        for logger in self.loggers:
+            logger.write(data, timestamp_ns)
+
+    def flush(self):
+        for logger in self.loggers:
+            logger.flush()
+
+    def close(self):
+        for logger in self.loggers:
+            logger.close()
+
+
+# Markers passed through the queue to the writer thread
+_FLUSH = object()
+_CLOSE = object()
+
+
+def _benchmark(rows=20000):
+    import tempfile
+
+    row = ["C0:DE:00:00:00:01", "SimKraken0001", -60, 8, "1M", 1, -58, "1M", "0x1FFFFFFFFF", 37, 12, 30.0, 4000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for buffered in (False, True):
+            logger = CSVLogger([f"c{i}" for i in range(len(row))], os.path.join(tmp, f"bench_{buffered}.csv"), buffered=buffered)
+            start = time.perf_counter()
+            for _ in range(rows):
+                logger.write(row)
+            enqueue = time.perf_counter() - start
+            logger.close()
+            total = time.perf_counter() - start
+            print(f"buffered={buffered!s:5}  caller {rows / enqueue:>10.0f} rows/s  end-to-end {rows / total:>10.0f} rows/s")
 
 # Example usage
 if __name__ == "__main__":
-    logger = CSVLogger()
-    logger.write('Device1', '123', 'Sample data')
-    logger.write('Device2', '456', 'More sample data')
\ No newline at end of file
+    _benchmark()
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import time
+
+from kivy.metrics import dp
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.checkbox import CheckBox
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+ROW_HEIGHT = dp(32)
+SELECT_WIDTH = dp(32)
+
+def _fmt_rssi(value):
+    return f"{value} dBm" if value is not None else "?"
+
+def _fmt_pressure(value):
+    if value is None:
+        return "?"
+    return f"{value} PSI" if isinstance(value, (int, float)) else str(value)
+
+def _fmt_last_seen(value):
+    return time.strftime('%H:%M:%S', time.localtime(value)) if value is not None else "?"
+
+# (key in the row dict, header text, formatter)
+COLUMNS = [
+    ("name", "Name", lambda v: v if v is not None else "?"),
+    ("mode", "Mode", str),
+    ("address", "Address", str),
+    ("kraken_rssi", "Kraken RSSI", _fmt_rssi),
+    ("central_rssi", "Central RSSI", _fmt_rssi),
+    ("pressure", "Pressure", _fmt_pressure),
+    ("last_seen", "Last Seen", _fmt_last_seen),
+]
+
+# Trailing sparkline column, drawn from the row's "history" series
+SPARKLINE_TITLE = "Pressure Trend"
+
+# Sortable columns and whether they sort high-to-low on the first click
+SORTABLE = {
+    "name": False,
+    "kraken_rssi": True,
+    "central_rssi": True,
+    "last_seen": True,
+}
+
+
+class DashboardRow(RecycleDataViewBehavior, BoxLayout):
+    """One device row. Instances are recycled by the RecycleView as the list scrolls."""
+    def __init__(self, **kwargs):
+        super().__init__(orientation='horizontal', spacing=dp(6), **kwargs)
+        self.address = None
+        self.dashboard = None
+        self.select = CheckBox(size_hint_x=None, width=SELECT_WIDTH)
+        self.select.bind(active=self._on_select)
+        self.add_widget(self.select)
+        self.cells = []
+        for _ in COLUMNS:
+            cell = Label(halign='left', valign='middle', font_size='16sp', shorten=True)
+            cell.bind(size=lambda inst, size: setattr(inst, "text_size", size))
+            self.cells.append(cell)
+            self.add_widget(cell)
+        # Deferred import: rows (and NumPy, via the sparkline) only exist
+        # once a Kraken shows up, the empty dashboard on the first frame doesn't need them
+        from python.sparkline import Sparkline
+        self.sparkline = Sparkline()
+        self.add_widget(self.sparkline)
+
+    def refresh_view_attrs(self, rv, index, data):
+        # Not calling super(): it would setattr every data key onto the row
+        self.address = None # so setting the checkbox below doesn't count as a click
+        self.dashboard = rv.dashboard
+        self.select.active = data["address"] in rv.dashboard.selected
+        self.address = data["address"]
+        for cell, (key, _, fmt) in zip(self.cells, COLUMNS):
+            text = fmt(data.get(key))
+            if cell.text != text:
+                cell.text = text
+        # Same series: only new samples are folded in. Recycled for another device: rebuilt
+        self.sparkline.set_series(data.get("history"))
+        self.sparkline.refresh()
+
+    def _on_select(self, checkbox, active):
+        if self.address is not None:
+            self.dashboard.set_selected(self.address, active)
+
+
+class Dashboard:
+    """
+    Dashboard tab backed by a RecycleView, so only rows on screen have widgets.
+
+    The model is a flat list of per-device dicts (`rows`). update() only
+    changes the dict and marks the dashboard dirty; the render scheduler then
+    calls flush_ui(), which re-sorts if needed and refreshes the visible rows.
+
+    Rows can be ticked; add_command_bar() adds buttons that run a command
+    on the ticked devices.
+    """
+    def __init__(self, render_scheduler=None):
+        self.render_scheduler = render_scheduler
+        self.rows = {}
+        self.visible = True
+        self.sort_key = None
+        self.sort_descending = False
+        self._dirty = False
+        self._needs_sort = False
+        self.header_buttons = {}
+        self.selected = set()
+        self.command_status = None
+
+        self.root = BoxLayout(orientation='vertical', padding=(dp(10), dp(10)), spacing=dp(6))
+
+        header = BoxLayout(orientation='horizontal', size_hint_y=None, height=ROW_HEIGHT, spacing=dp(6))
+        header.add_widget(Label(size_hint_x=None, width=SELECT_WIDTH))
+        for key, title, _ in COLUMNS:
+            if key in SORTABLE:
+                button = Button(text=title, bold=True)
+                button.bind(on_release=lambda inst, key=key: self.sort_by(key))
+                self.header_buttons[key] = button
+                header.add_widget(button)
+            else:
+                header.add_widget(Label(text=f"[b]{title}[/b]", markup=True))
+        header.add_widget(Label(text=f"[b]{SPARKLINE_TITLE}[/b]", markup=True))
+        self.root.add_widget(header)
+
+        self.rv = RecycleView(do_scroll_x=False)
+        self.rv.dashboard = self
+        layout = RecycleBoxLayout(orientation='vertical',
+                                  default_size=(None, ROW_HEIGHT),
+                                  default_size_hint=(1, None),
+                                  size_hint_y=None,
+                                  spacing=dp(2))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.rv.add_widget(layout)
+        # viewclass is forwarded to the layout manager, so set it after adding one
+        self.rv.viewclass = DashboardRow
+        self.root.add_widget(self.rv)
+
+    def build(self):
+        return self.root
+
+    def add_command_bar(self, commands, run_command):
+        """
+        Buttons above the table for `commands`, [(name, title, confirm)].
+        Clicking one awaits `run_command(name, addresses)` for the ticked
+        devices (after a confirmation for `confirm` commands) and shows the
+        returned object's result_lines().
+        """
+        bar = BoxLayout(orientation='horizontal', size_hint_y=None, height=ROW_HEIGHT, spacing=dp(6))
+        select_all = Button(text="All", size_hint_x=None, width=dp(60))
+        select_all.bind(on_release=lambda inst: self.select_all(True))
+        bar.add_widget(select_all)
+        select_none = Button(text="None", size_hint_x=None, width=dp(60))
+        select_none.bind(on_release=lambda inst: self.select_all(False))
+        bar.add_widget(select_none)
+        for name, title, confirm in commands:
+            button = Button(text=title)
+            button.bind(on_release=lambda inst, name=name, title=title, confirm=confirm:
+                        self._on_command(name, title, confirm, run_command))
+            bar.add_widget(button)
+        self.command_status = Label(text="", halign='left', valign='middle', shorten=True, size_hint_x=2)
+        self.command_status.bind(size=lambda inst, size: setattr(inst, "text_size", size))
+        bar.add_widget(self.command_status)
+        self.root.add_widget(bar, index=len(self.root.children)) # on top
+
+    def set_selected(self, address, selected):
+        if selected:
+            self.selected.add(address)
+        else:
+            self.selected.discard(address)
+        self._update_command_status()
+
+    def select_all(self, selected):
+        self.selected = set(self.rows) if selected else set()
+        self.rv.refresh_from_data()
+        self._update_command_status()
+
+    def _update_command_status(self, text=None):
+        if self.command_status is not None:
+            self.command_status.text = text or f"{len(self.selected)} selected"
+
+    def _on_command(self, name, title, confirm, run_command):
+        addresses = [address for address in self.rows if address in self.selected]
+        if not addresses:
+            self._update_command_status("Select Krakens first")
+            return
+        if not confirm:
+            asyncio.ensure_future(self._run_command(name, title, addresses, run_command))
+            return
+        buttons = BoxLayout(orientation='horizontal', spacing=dp(6))
+        popup = Popup(title=f"{title} {len(addresses)} Krakens?", content=buttons,
+                      size_hint=(None, None), size=(dp(360), dp(140)))
+        cancel = Button(text="Cancel")
+        cancel.bind(on_release=lambda inst: popup.dismiss())
+        go = Button(text=title)
+        go.bind(on_release=lambda inst: (popup.dismiss(),
+                                         asyncio.ensure_future(self._run_command(name, title, addresses, run_command))))
+        buttons.add_widget(cancel)
+        buttons.add_widget(go)
+        popup.open()
+
+    async def _run_command(self, name, title, addresses, run_command):
+        self._update_command_status(f"{title}: running on {len(addresses)} Krakens...")
+        try:
+            result = await run_command(name, addresses)
+        except Exception as e:
+            logging.warning(f"{title} failed ({e})")
+            self._update_command_status(f"{title} failed: {e}")
+            return
+        lines = result.result_lines()
+        self._update_command_status(lines[-1])
+        from kivy.uix.scrollview import ScrollView
+
+        text = Label(text="\n".join(lines), font_name="RobotoMono-Regular", font_size='13sp',
+                     halign='left', valign='top', size_hint=(None, None))
+        text.bind(texture_size=lambda inst, size: setattr(inst, "size", size))
+        scroll = ScrollView()
+        scroll.add_widget(text)
+        Popup(title=title, content=scroll, size_hint=(0.9, 0.8)).open()
+
+    def add_device(self, address, history=None):
+        if address in self.rows:
+            return
+        self.rows[address] = {
+            "address": address,
+            "name": None,
+            "mode": "Beacon",
+            "kraken_rssi": None,
+            "central_rssi": None,
+            "pressure": None,
+            "last_seen": time.time(),
+            "history": history,
+        }
+        self._needs_sort = True
+        self._mark_dirty()
+
+    def update(self, address, **fields):
+        row = self.rows.get(address)
+        if row is None:
+            return
+        for key, value in fields.items():
+            if row.get(key) != value:
+                row[key] = value
+                if key == self.sort_key:
+                    self._needs_sort = True
+        row["last_seen"] = time.time()
+        if self.sort_key == "last_seen":
+            self._needs_sort = True
+        self._mark_dirty()
+
+    def sort_by(self, key):
+        if key == self.sort_key:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_key = key
+            self.sort_descending = SORTABLE[key]
+        for k, button in self.header_buttons.items():
+            title = next(t for c, t, _ in COLUMNS if c == k)
+            arrow = (" v" if self.sort_descending else " ^") if k == key else ""
+            button.text = title + arrow
+        self._needs_sort = True
+        self._mark_dirty()
+
+    def set_visible(self, visible):
+        self.visible = visible
+        if visible and self._dirty:
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self.render_scheduler is None:
+            self.flush_ui()
+        else:
+            self.render_scheduler.mark_dirty(self)
+
+    def _sorted_rows(self):
+        rows = list(self.rows.values())
+        if self.sort_key is None:
+            return rows
+        key = self.sort_key
+        present = [r for r in rows if r.get(key) is not None]
+        missing = [r for r in rows if r.get(key) is None]
+        present.sort(key=lambda r: r[key], reverse=self.sort_descending)
+        # Devices without a value always go to the bottom
+        return present + missing
+
+    def flush_ui(self):
+        if not self.visible or not self._dirty:
+            return
+        if self._needs_sort or len(self.rv.data) != len(self.rows):
+            # Reassigning data re-binds the existing row views, it doesn't rebuild them
+            self.rv.data = self._sorted_rows()
+            self._needs_sort = False
+        else:
+            self.rv.refresh_from_data()
+        self._dirty = False
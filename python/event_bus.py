@@ -0,0 +1,203 @@
+"""
+In-process publish/subscribe between the BLE callbacks and the stages that
+consume their data, with a bounded queue per subscriber.
+
+    bus = EventBus()
+    bus.subscribe("raw", decode, name="decoder", maxsize=10000, policy="drop_oldest")
+    bus.subscribe("decoded", write_csv, name="log_sinks", policy="block")
+    bus.start()
+    ...
+    bus.publish("raw", packet)                  # from a callback, never blocks
+    await bus.publish_async("decoded", sample)  # from a stage, waits on "block" subscribers
+
+Every subscriber is a Stage: its own asyncio.Queue plus a task that feeds the
+items to its handler (a function or a coroutine function) one at a time. A
+slow stage only fills its own queue; what happens then is its policy:
+
+  "block"       - publish_async() waits for room, pushing back on the
+                  producing stage. publish() can't wait (it runs inside a
+                  callback), so there the item is dropped and counted.
+  "drop_newest" - the new item is discarded
+  "drop_oldest" - the oldest queued item is discarded to make room
+
+Each stage reports its queue depth, high-water mark and drop/error counts
+through stats() and the python/metrics.py registry.
+"""
+
+import asyncio
+import inspect
+import logging
+
+from python import metrics
+
+POLICIES = ("block", "drop_newest", "drop_oldest")
+
+QUEUE_DEPTH = metrics.gauge("kraken_bus_queue_depth", "Items waiting in an event bus stage", labels=("stage",))
+HIGH_WATER = metrics.gauge("kraken_bus_queue_high_water", "Deepest an event bus stage queue has been", labels=("stage",))
+DROPPED = metrics.counter("kraken_bus_dropped_total", "Items an event bus stage dropped because its queue was full",
+                          labels=("stage",))
+PROCESSED = metrics.counter("kraken_bus_processed_total", "Items an event bus stage has handled", labels=("stage",))
+
+
+class Stage:
+    """One subscriber: a bounded queue and the task draining it into `handler`."""
+    def __init__(self, name, handler, maxsize=1000, policy="drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', expected one of {POLICIES}")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.maxsize = maxsize
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._is_coroutine = inspect.iscoroutinefunction(handler)
+        self._task = None
+        self.busy = False
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+
+        QUEUE_DEPTH.labels(name).fn = lambda: self.depth
+        HIGH_WATER.labels(name).fn = lambda: self.high_water
+        self._dropped_counter = DROPPED.labels(name)
+        self._processed_counter = PROCESSED.labels(name)
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def offer(self, item):
+        """Queue without waiting. Returns False if the item (or, for drop_oldest, an older one) was dropped."""
+        self.received += 1
+        queue = self.queue
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._dropped_counter.inc()
+            if self.policy != "drop_oldest":
+                return False
+            queue.get_nowait()
+            queue.task_done()
+            queue.put_nowait(item)
+            return False
+        depth = queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+        return True
+
+    async def put(self, item):
+        if self.policy != "block":
+            return self.offer(item)
+        self.received += 1
+        await self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"Stage({self.name})")
+
+    async def stop(self, drain_timeout_seconds=5):
+        """Let the stage finish what is queued (up to the timeout), then stop it."""
+        if self._task is None:
+            return
+        if drain_timeout_seconds:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout_seconds)
+            except asyncio.TimeoutError:
+                logging.warning(f"Event bus stage {self.name} stopped with {self.depth} items still queued")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        queue = self.queue
+        handler = self.handler
+        while True:
+            item = await queue.get()
+            self.busy = True
+            try:
+                if self._is_coroutine:
+                    await handler(item)
+                else:
+                    handler(item)
+                self.processed += 1
+                self._processed_counter.inc()
+            except Exception as e:
+                # One bad item must not take the stage down
+                self.errors += 1
+                logging.warning(f"Event bus stage {self.name} failed on an item ({e!r})")
+            finally:
+                self.busy = False
+                queue.task_done()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "high_water": self.high_water,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+class EventBus:
+    def __init__(self):
+        self.topics = {}  # topic -> [Stage]
+        self.stages = []
+        self.running = False
+
+    def subscribe(self, topic, handler, name=None, maxsize=1000, policy="drop_oldest"):
+        stage = Stage(name or f"{topic}:{getattr(handler, '__name__', 'handler')}", handler, maxsize, policy)
+        self.topics.setdefault(topic, []).append(stage)
+        self.stages.append(stage)
+        if self.running:
+            stage.start()
+        return stage
+
+    def unsubscribe(self, stage):
+        for subscribers in self.topics.values():
+            if stage in subscribers:
+                subscribers.remove(stage)
+        self.stages.remove(stage)
+        if stage._task is not None:
+            stage._task.cancel()
+            stage._task = None
+
+    def publish(self, topic, item):
+        """Hand `item` to every subscriber of `topic` without waiting (safe in callbacks)."""
+        for stage in self.topics.get(topic, ()):
+            stage.offer(item)
+
+    async def publish_async(self, topic, item):
+        """Like publish(), but waits for room in "block" subscribers."""
+        for stage in self.topics.get(topic, ()):
+            await stage.put(item)
+
+    def start(self):
+        self.running = True
+        for stage in self.stages:
+            stage.start()
+
+    async def join(self):
+        """Wait until every stage is idle, including items published by other stages meanwhile."""
+        while any(stage.depth or stage.busy for stage in self.stages):
+            for stage in self.stages:
+                await stage.queue.join()
+
+    async def stop(self, drain_timeout_seconds=5):
+        # Upstream stages first (subscription order), so their output still gets drained downstream
+        self.running = False
+        for stage in self.stages:
+            await stage.stop(drain_timeout_seconds)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
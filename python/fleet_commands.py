@@ -0,0 +1,252 @@
+"""
+One GATT write applied to many Krakens at once: LED pattern, soft reset,
+deep sleep, clear error.
+
+    broadcast = FleetBroadcast(COMMANDS["soft_reset"], addresses, concurrency=8)
+    await broadcast.run()
+    print("\\n".join(broadcast.result_lines()))
+
+At most `concurrency` devices are worked on at the same time. A device whose
+connection `connected_client(address)` hands back (e.g. the KrakenCore
+session's) is written through it; any other device is connected on demand
+and disconnected again afterwards. Each attempt, connect included, is bounded
+by `timeout_seconds` and a failed one is retried `retries` times.
+
+Soft reset and deep sleep take the device off the air, sometimes before the
+write is acknowledged: for them a write that fails because the link went
+down counts as done.
+
+    python -m python.fleet_commands soft_reset --simulated 50 --concurrency 8
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import python.ble_backend as ble_backend
+import python.kraken_uuids as kraken_uuids
+from python import metrics
+
+# How long after a failed write a disconnecting command's link may take to
+# be reported down: the disconnect callback can run after the write failed
+DISCONNECT_GRACE_SECONDS = 1.0
+
+FLEET_COMMANDS = metrics.counter("kraken_fleet_commands_total", "Fleet command writes by command and outcome",
+                                 labels=("command", "outcome"))
+FLEET_COMMAND_SECONDS = metrics.histogram("kraken_fleet_command_seconds",
+                                          "Time to apply a fleet command to one Kraken, retries included",
+                                          buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+
+class FleetCommand:
+    """A write of `payload` to characteristic `uuid`; `disconnects` if the device drops off afterwards."""
+    def __init__(self, name, uuid, payload=b"\x01", disconnects=False, title=None):
+        self.name = name
+        self.uuid = uuid
+        self.payload = bytes(payload)
+        self.disconnects = disconnects
+        self.title = title or name.replace("_", " ").capitalize()
+
+    def with_payload(self, payload):
+        return FleetCommand(self.name, self.uuid, payload, self.disconnects, self.title)
+
+
+COMMANDS = {command.name: command for command in (
+    FleetCommand("led_pattern", kraken_uuids.LED_PATTERN_UUID, title="LED pattern"),
+    FleetCommand("led_clear", kraken_uuids.LED_CLEAR_UUID, title="LED off"),
+    FleetCommand("clear_error", kraken_uuids.KRAKEN_STATE_TRY_CLEAR_ERROR_CHAR_UUID),
+    FleetCommand("soft_reset", kraken_uuids.KRAKEN_SOFT_RESET_CHAR_UUID, disconnects=True),
+    FleetCommand("deep_sleep", kraken_uuids.KRAKEN_DEEP_SLEEP_CHAR_UUID, disconnects=True),
+)}
+
+
+class CommandResult:
+    __slots__ = ("address", "state", "attempts", "reused_connection", "latency_seconds", "elapsed_seconds", "error")
+
+    def __init__(self, address):
+        self.address = address
+        self.state = "queued" # queued, running, done, failed
+        self.attempts = 0
+        self.reused_connection = None
+        self.latency_seconds = None # the write of the attempt that succeeded
+        self.elapsed_seconds = None # first attempt to done/failed, connects and retries included
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.state == "done"
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+class FleetBroadcast:
+    def __init__(self, command, addresses, connected_client=None, concurrency=8, retries=2, timeout_seconds=10,
+                 retry_delay_seconds=0.5):
+        self.command = command
+        self.connected_client = connected_client or (lambda address: None)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout_seconds = timeout_seconds
+        self.retry_delay_seconds = retry_delay_seconds
+        self.results = {address: CommandResult(address) for address in addresses}
+        self.started = None
+        self.finished = None
+
+    async def run(self):
+        """Apply the command to every device. Returns True if all of them succeeded."""
+        self.started = time.monotonic()
+        queue = deque(self.results.values())
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(self.concurrency, len(queue)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished = time.monotonic()
+        return all(result.ok for result in self.results.values())
+
+    async def _worker(self, queue):
+        while queue:
+            result = queue.popleft()
+            result.state = "running"
+            start = time.perf_counter()
+            while result.state == "running":
+                if result.attempts:
+                    await asyncio.sleep(self.retry_delay_seconds * result.attempts)
+                result.attempts += 1
+                try:
+                    await asyncio.wait_for(self._attempt(result), self.timeout_seconds)
+                    result.state = "done"
+                    result.error = None
+                except asyncio.TimeoutError:
+                    result.error = f"timed out after {self.timeout_seconds} s"
+                except Exception as e:
+                    result.error = str(e) or type(e).__name__
+                if result.state == "running" and result.attempts > self.retries:
+                    result.state = "failed"
+            result.elapsed_seconds = time.perf_counter() - start
+            FLEET_COMMANDS.labels(self.command.name, result.state).inc()
+            FLEET_COMMAND_SECONDS.observe(result.elapsed_seconds)
+            if result.state == "failed":
+                logging.warning(f"{self.command.title} failed on Kraken {result.address} after "
+                                f"{result.attempts} attempts ({result.error})")
+
+    async def _attempt(self, result):
+        client = self.connected_client(result.address)
+        result.reused_connection = client is not None
+        if client is None:
+            client = ble_backend.create_client(result.address)
+        try:
+            # Inside the try: a timeout or cancel mid-connect must not leave a half-open link behind
+            if not result.reused_connection:
+                await client.connect()
+            start = time.perf_counter()
+            try:
+                await client.write_gatt_char(self.command.uuid, self.command.payload, response=True)
+            except Exception:
+                if not (self.command.disconnects and await self._went_down(client)):
+                    raise
+                # Went down before acknowledging, which is what the command does
+            result.latency_seconds = time.perf_counter() - start
+        finally:
+            if not result.reused_connection:
+                try:
+                    await client.disconnect()
+                except Exception as e:
+                    logging.debug(f"Ignoring error while disconnecting from Kraken {result.address} ({e})")
+
+    async def _went_down(self, client):
+        deadline = time.monotonic() + DISCONNECT_GRACE_SECONDS
+        while client.is_connected:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def stats(self):
+        results = self.results.values()
+        latencies = [r.latency_seconds for r in results if r.ok]
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started is not None else 0
+        return {
+            "command": self.command.name,
+            "devices": len(self.results),
+            "done": sum(1 for r in results if r.ok),
+            "failed": sum(1 for r in results if r.state == "failed"),
+            "reused_connections": sum(1 for r in results if r.ok and r.reused_connection),
+            "retried": sum(1 for r in results if r.attempts > 1),
+            "latency_p50_ms": 1000 * _percentile(latencies, 0.5) if latencies else None,
+            "latency_p95_ms": 1000 * _percentile(latencies, 0.95) if latencies else None,
+            "elapsed_seconds": elapsed,
+        }
+
+    def result_lines(self):
+        """The per-device result table, one line per device plus a header and a summary line."""
+        lines = [f"  {'address':<20}{'result':<8}{'tries':>6}  {'connection':<11}{'write ms':>9}{'total ms':>10}"]
+        for r in self.results.values():
+            connection = "" if r.reused_connection is None else ("reused" if r.reused_connection else "on demand")
+            write_ms = f"{1000 * r.latency_seconds:.0f}" if r.ok else "-"
+            total_ms = f"{1000 * r.elapsed_seconds:.0f}" if r.elapsed_seconds is not None else "-"
+            line = f"  {r.address:<20}{r.state:<8}{r.attempts:>6}  {connection:<11}{write_ms:>9}{total_ms:>10}"
+            if r.error and not r.ok:
+                line += f"  {r.error}"
+            lines.append(line)
+        stats = self.stats()
+        summary = (f"{stats['command']}: {stats['done']}/{stats['devices']} done, {stats['failed']} failed, "
+                   f"{stats['reused_connections']} reused, {stats['retried']} retried in {stats['elapsed_seconds']:.1f} s")
+        if stats["latency_p50_ms"] is not None:
+            summary += f", write p50 {stats['latency_p50_ms']:.0f} / p95 {stats['latency_p95_ms']:.0f} ms"
+        lines.append(summary)
+        return lines
+
+# ==============================================================================
+# Command line
+# ==============================================================================
+
+async def _run(args):
+    from python.ota import _scan_for_krakens
+
+    addresses = args.address or await _scan_for_krakens(args.scan_seconds)
+    if not addresses:
+        print("no Krakens found")
+        return False
+    command = COMMANDS[args.command]
+    if args.payload is not None:
+        command = command.with_payload(bytes.fromhex(args.payload))
+    broadcast = FleetBroadcast(command, addresses, concurrency=args.concurrency, retries=args.retries,
+                               timeout_seconds=args.timeout)
+    print(f"{command.title} on {len(addresses)} Krakens, {args.concurrency} at a time")
+    ok = await broadcast.run()
+    print("\n".join(broadcast.result_lines()))
+    return ok
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Apply a command to many Krakens at once")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--payload", default=None, help="bytes to write, in hex (default: 01)")
+    parser.add_argument("--address", action="append", help="Kraken to command, repeat for several (default: scan)")
+    parser.add_argument("--scan-seconds", type=float, default=5, help="how long to scan when no --address is given")
+    parser.add_argument("--concurrency", type=int, default=8, help="devices worked on at the same time")
+    parser.add_argument("--retries", type=int, default=2, help="further attempts after a failed one")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per attempt, connect included")
+    parser.add_argument("--simulated", type=int, default=0, help="command N simulated Krakens instead of real ones")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if args.simulated:
+        from python.sim_kraken import SimulatedFleet
+        fleet = SimulatedFleet(args.simulated, pressure_rate_hz=0, connection_info_rate_hz=0)
+        fleet.install()
+        args.address = args.address or list(fleet.devices)
+    sys.exit(0 if asyncio.run(_run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
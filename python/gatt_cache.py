@@ -0,0 +1,164 @@
+"""
+Persistent per-address cache of what a KrakenSession learns on its first
+connection: display name, FW version and the handles of the characteristics
+it uses. On a reconnect with a cache entry the session
+
+  - asks the OS stack for its cached GATT database instead of a full service
+    discovery (CONNECT_KWARGS / CLIENT_KWARGS, ignored by backends without one),
+  - subscribes to pressure and connection info notifications straight away,
+  - and only then re-reads name and FW version in the background.
+
+An entry belongs to the FW version it was read from: when the background
+read finds another version (e.g. after an OTA update) or a cached handle no
+longer matches the device, the entry is dropped and the session reconnects
+with a full discovery.
+
+    cache = GattCache(os.path.join(out_dir, "KrakenGattCache.json"))
+
+    python -m python.gatt_cache bench --devices 10 --duration 20
+"""
+
+import json
+import logging
+import os
+import time
+
+from python import metrics
+
+CACHE_VERSION = 1
+
+# Backend specific "use the OS GATT cache" switches: BlueZ reads them from
+# connect(), WinRT from the client constructor
+CONNECT_KWARGS = {"dangerous_use_bleak_cache": True}
+CLIENT_KWARGS = {"winrt": {"use_cached_services": True}}
+
+GATT_CACHE_LOOKUPS = metrics.counter("kraken_gatt_cache_lookups_total", "GATT cache lookups on connect",
+                                     labels=("result",))
+GATT_CACHE_INVALIDATIONS = metrics.counter("kraken_gatt_cache_invalidations_total",
+                                           "GATT cache entries dropped, by reason", labels=("reason",))
+
+
+class GattCache:
+    """Address -> {"fw_ver", "name", "handles": {uuid: handle}, "updated"}, kept in a JSON file."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path, encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data.get("entries", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable GATT cache {path} ({e})")
+
+    def get(self, address):
+        entry = self.entries.get(address)
+        GATT_CACHE_LOOKUPS.labels("hit" if entry is not None else "miss").inc()
+        return entry
+
+    def store(self, address, name, fw_ver, services, uuids):
+        """Remember name, FW version and the handles `services` gives the characteristics in `uuids`."""
+        handles = {}
+        for uuid in uuids:
+            char = services.get_characteristic(uuid)
+            if char is not None:
+                handles[uuid] = char.handle
+        self.entries[address] = {"fw_ver": fw_ver, "name": name, "handles": handles, "updated": time.time()}
+        self.dirty = True
+
+    def invalidate(self, address, reason):
+        if self.entries.pop(address, None) is not None:
+            logging.info(f"Dropping the GATT cache entry of Kraken {address} ({reason})")
+            GATT_CACHE_INVALIDATIONS.labels(reason).inc()
+            self.dirty = True
+
+    def matches(self, entry, services):
+        """True if every cached handle still belongs to the same characteristic in `services`."""
+        for uuid, handle in entry["handles"].items():
+            char = services.get_characteristic(uuid)
+            if char is None or char.handle != handle:
+                return False
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, mode='w', encoding='utf-8') as file:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, file, indent=1, sort_keys=True)
+            os.replace(tmp, self.path) # never leave a half written cache behind
+            self.dirty = False
+        except OSError as e:
+            logging.warning(f"Could not save the GATT cache to {self.path} ({e})")
+
+# ==============================================================================
+# Benchmark
+# ==============================================================================
+
+async def _run_fleet(args, use_cache, out_dir):
+    import asyncio
+
+    from python.kraken_core import KrakenCore
+    from python.sim_kraken import SimulatedFleet
+
+    fleet = SimulatedFleet(args.devices, mean_seconds_between_disconnects=args.reconnect_seconds,
+                           discovery_seconds=args.discovery_ms / 1000)
+    fleet.install()
+    core = KrakenCore(out_dir, max_in_flight=args.devices, gatt_cache=use_cache)
+
+    async def stop_later():
+        await asyncio.sleep(args.duration)
+        core.stop()
+
+    asyncio.create_task(stop_later())
+    await core.run()
+    core.close()
+    samples = [sample for session in core.sessions.values() for sample in session.first_notification_seconds]
+    return [seconds for hit, seconds in samples if not hit], [seconds for hit, seconds in samples if hit]
+
+
+def _describe(label, values):
+    if not values:
+        return f"  {label:<34}{'-':>6}"
+    values = sorted(values)
+    median = values[len(values) // 2]
+    p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+    return f"  {label:<34}{len(values):>6}{1000 * median:>10.0f}{1000 * p95:>10.0f}"
+
+
+async def _bench(args):
+    import tempfile
+
+    print(f"{args.devices} simulated Krakens, a dropped connection every ~{args.reconnect_seconds} s each, "
+          f"{args.discovery_ms} ms service discovery, {args.duration} s per run")
+    print(f"  {'time to first notification':<34}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}")
+    without_cache, _ = await _run_fleet(args, False, tempfile.mkdtemp(prefix="kraken_gatt_cache_"))
+    print(_describe("no cache", without_cache))
+    misses, hits = await _run_fleet(args, True, tempfile.mkdtemp(prefix="kraken_gatt_cache_"))
+    print(_describe("cache, first connect", misses))
+    print(_describe("cache, reconnects", hits))
+
+
+def main():
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Kraken GATT metadata cache tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="time to first notification on reconnect, with and without the cache")
+    bench.add_argument("--devices", type=int, default=10)
+    bench.add_argument("--duration", type=float, default=20, help="seconds per run")
+    bench.add_argument("--reconnect-seconds", type=float, default=2, help="mean time between dropped connections")
+    bench.add_argument("--discovery-ms", type=float, default=400, help="simulated full service discovery time")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(_bench(args))
+
+
+if __name__ == "__main__":
+    main()
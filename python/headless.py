@@ -0,0 +1,115 @@
+"""
+Headless Kraken collector for gateways: the same scan/connect/decode/log
+pipeline as the app, without importing Kivy or any windowing stack.
+
+    python -m python.headless --out-dir Data [--binary-log] [--capture]
+
+Runs until interrupted (or for --duration seconds) and logs a status line
+every --status-interval seconds. --simulated N uses the in-process simulated
+fleet instead of the radio (same as KRAKEN_SIMULATED_DEVICES for the app).
+"""
+
+import time
+
+_PROCESS_START = time.perf_counter()
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from python.kraken_core import KrakenCore, peak_rss_mb
+
+
+def _rss_text():
+    rss = peak_rss_mb()
+    return f"peak RSS {rss:.1f} MB" if rss is not None else "peak RSS n/a"
+
+
+async def _status_loop(core, interval_seconds):
+    last_notifications = 0
+    last_time = time.monotonic()
+    while True:
+        await asyncio.sleep(interval_seconds)
+        stats = core.stats()
+        now = time.monotonic()
+        rate = (stats["notifications"] - last_notifications) / (now - last_time)
+        last_notifications, last_time = stats["notifications"], now
+        bus = ", ".join(f"{name} {s['depth']}/{s['maxsize']} ({s['dropped']} dropped)" for name, s in stats["bus"].items())
+        streams = stats["log_streams"]
+        logging.info(f"{stats['connected']}/{stats['sessions']} Krakens connected, {rate:.0f} notifications/s, "
+                     f"{_rss_text()}, scheduler {stats['scheduler']}" + (f", queues {bus}" if bus else "")
+                     + (f", log streams {streams['received_bytes']} bytes ({streams['lost_bytes']} lost)"
+                        if streams["streams"] else ""))
+
+
+async def run(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    core = KrakenCore(args.out_dir, binary_log=args.binary_log, capture=args.capture, max_in_flight=args.max_in_flight,
+                      metrics_file=args.metrics_file, metrics_port=args.metrics_port,
+                      log_streams=args.log_streams, log_password=args.log_password, gatt_cache=not args.no_gatt_cache)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, core.stop)
+        except (NotImplementedError, RuntimeError):
+            pass # Windows, Ctrl+C still raises KeyboardInterrupt
+
+    def started():
+        logging.info(f"Headless collector scanning {1000 * (time.perf_counter() - _PROCESS_START):.0f} ms after start, {_rss_text()}")
+        if "kivy" in sys.modules:
+            logging.warning("Kivy got imported in headless mode")
+
+    status_task = asyncio.create_task(_status_loop(core, args.status_interval))
+    if args.duration is not None:
+        loop.call_later(args.duration, core.stop)
+    try:
+        await core.run(started=started)
+    finally:
+        status_task.cancel()
+        core.close()
+        stats = core.stats()
+        logging.info(f"Stopped: {stats['sessions']} Krakens seen, {stats['notifications']} notifications handled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Kraken collector")
+    parser.add_argument("--out-dir", default="Data", help="where the logs go")
+    parser.add_argument("--binary-log", action="store_true", default=bool(os.environ.get("KRAKEN_BINARY_LOG")),
+                        help="also write binary logs (python/binary_log.py)")
+    parser.add_argument("--capture", action="store_true", default=bool(os.environ.get("KRAKEN_CAPTURE")),
+                        help="record raw notifications (python/capture.py)")
+    parser.add_argument("--max-in-flight", type=int, default=int(os.environ.get("KRAKEN_MAX_CONNECTS_IN_FLIGHT", 4)),
+                        help="concurrent connection attempts")
+    parser.add_argument("--metrics-file", default=os.environ.get("KRAKEN_METRICS_FILE"),
+                        help="rewrite this file with Prometheus text metrics every 10 s")
+    parser.add_argument("--metrics-port", type=int, default=os.environ.get("KRAKEN_METRICS_PORT"),
+                        help="serve Prometheus text metrics on localhost:PORT")
+    parser.add_argument("--log-streams", default=os.environ.get("KRAKEN_LOG_STREAMS"),
+                        help='capture the device logs of these Krakens ("all" or comma separated addresses)')
+    parser.add_argument("--log-password", default=os.environ.get("KRAKEN_LOG_PASSWORD"),
+                        help="logging service password (prefer the KRAKEN_LOG_PASSWORD environment variable)")
+    parser.add_argument("--no-gatt-cache", action="store_true", default=bool(os.environ.get("KRAKEN_NO_GATT_CACHE")),
+                        help="always run a full service discovery and re-read name and FW version on connect")
+    parser.add_argument("--simulated", type=int, default=int(os.environ.get("KRAKEN_SIMULATED_DEVICES", 0)),
+                        help="use N simulated Krakens instead of the radio")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--status-interval", type=float, default=10, help="seconds between status lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.simulated:
+        from python.sim_kraken import SimulatedFleet
+        SimulatedFleet(args.simulated).install()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
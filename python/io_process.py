@@ -0,0 +1,484 @@
+"""
+Multi-process mode: BLE scanning, connecting, decoding and logging run in a
+separate "I/O" process, so Kivy's rendering and bleak/NumPy/CSV work no
+longer share one interpreter and one GIL.
+
+    UI process (main.py, KRAKEN_MULTIPROCESS=1)          I/O process (python -m python.io_process)
+    RemoteCore ---- control channel (commands) ------>   KrakenCore + pipeline
+               <--- control channel (device events) ---
+               <--- shared memory rings (samples) -----
+
+Decoded pressure and connection info samples travel as fixed-size records
+through two ShmRing buffers (python/shm_ring.py) owned by the UI process:
+the UI reads them as NumPy views into shared memory, no pickling. Everything
+low-rate (device discovered, mode, identity, beacon RSSI, stats) and the
+commands the other way go over a multiprocessing.connection channel on
+localhost, authenticated with a per-run key.
+
+The I/O process is started as a fresh interpreter (not a multiprocessing
+spawn of main.py) so it never imports Kivy. It is meant for desktop and
+gateway hardware; on Android the single-process app stays the default.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from python import connection_info_decoder, metrics
+from python.kraken_session import CONNECTION_INFO, PRESSURE, SessionModel
+from python.shm_ring import ShmRing
+from python.sl_status_code_parser import sl_status_from_string, sl_status_to_string
+
+AUTHKEY_ENV = "KRAKEN_IO_AUTHKEY"
+LOG_PASSWORD_ENV = "KRAKEN_LOG_PASSWORD" # passed through the environment, not the command line
+
+PRESSURE_RECORD = np.dtype([
+    ("timestamp_ns", "<i8"),
+    ("device", "<u2"),
+    ("reading", "S5"),        # raw reading, shown when it isn't a number
+    ("pressure", "<f8"),      # NaN when the reading isn't a number
+    ("battery", "u1"),
+    ("scanner_tick", "u1"),
+    ("charging_state", "<i2"), # -1 for firmware that doesn't send it
+])
+
+CONNECTION_INFO_RECORD = np.dtype([("timestamp_ns", "<i8"), ("device", "<u2")]
+                                  + connection_info_decoder.DECODED_DTYPE.descr)
+_CONNECTION_INFO_FIELDS = connection_info_decoder.DECODED_DTYPE.names
+
+# Ring sizes in records: ~30 s of 500 Krakens at 10 pressure + 1 info notifications/s
+PRESSURE_RING_CAPACITY = 1 << 17
+CONNECTION_INFO_RING_CAPACITY = 1 << 14
+
+STATS_INTERVAL_SECONDS = 2
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PHY_CODES = {description: phy for phy, description in connection_info_decoder.PHY_DESCRIPTIONS.items()}
+
+
+def _phy_code(description):
+    # phy_description() passes unknown ids through unchanged
+    return _PHY_CODES.get(description, description)
+
+
+def _status_code(name):
+    try:
+        return sl_status_from_string(name)
+    except KeyError:
+        return int(name.rsplit("0x", 1)[1].rstrip(")"), 16) # "CODE_UNKNOWN (0x....)"
+
+# ==============================================================================
+# I/O process side
+# ==============================================================================
+
+class _SessionPublisher:
+    """Session listener in the I/O process: samples into the rings, the rest onto the control channel."""
+    def __init__(self, conn, pressure_ring, info_ring):
+        self.conn = conn
+        self.pressure_ring = pressure_ring
+        self.info_ring = info_ring
+        self.devices = {} # address -> device index
+
+    def add_session(self, session):
+        device = self.devices[session.address] = len(self.devices)
+        self.conn.send(("device", device, session.address))
+        session.add_listener(self._on_session_event)
+
+    def _on_session_event(self, session, event, value):
+        device = self.devices[session.address]
+        if event == "pressure":
+            pressure = value.pressure
+            if isinstance(pressure, str):
+                reading, pressure = pressure.encode('utf-8', errors='replace')[:5], float('nan')
+            else:
+                reading = b""
+            charging_state = value.charging_state if value.charging_state is not None else -1
+            self.pressure_ring.append((time.time_ns(), device, reading, pressure,
+                                       value.battery_raw, value.scanner_tick, charging_state))
+        elif event == "connection_info":
+            # The ring carries the raw codes, the UI side turns them back into text
+            raw = dict(value,
+                       central_phy=_phy_code(value["central_phy"]),
+                       kraken_phy=_phy_code(value["kraken_phy"]),
+                       last_disconnect_reason=_status_code(value["last_disconnect_reason"]))
+            self.info_ring.append((time.time_ns(), device) + tuple(raw[name] for name in _CONNECTION_INFO_FIELDS))
+        elif event == "identity":
+            self.conn.send(("identity", device, session.name, session.fw_ver))
+        else: # mode, beacon
+            self.conn.send((event, device, value))
+
+
+async def _control_loop(conn, core):
+    """Commands from the UI process, plus periodic stats back to it."""
+    commands = {
+        "stop": lambda: core.stop(),
+        "disconnect": lambda address: _disconnect(core, address),
+        "broadcast": lambda request_id, *args: asyncio.ensure_future(_broadcast(conn, core, request_id, *args)),
+    }
+    next_stats = time.monotonic()
+    while core.running:
+        try:
+            while conn.poll():
+                command, *args = conn.recv()
+                handler = commands.get(command)
+                if handler is None:
+                    logging.warning(f"I/O process ignoring unknown command {command!r}")
+                else:
+                    handler(*args)
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + STATS_INTERVAL_SECONDS
+                conn.send(("stats", core.stats()))
+        except (EOFError, OSError):
+            logging.warning("UI process went away, stopping the I/O process")
+            core.stop()
+            return
+        await asyncio.sleep(0.05)
+
+
+def _disconnect(core, address):
+    session = core.sessions.get(address)
+    if session is not None:
+        asyncio.ensure_future(session.disconnect())
+
+
+async def _broadcast(conn, core, request_id, name, payload, addresses, kwargs):
+    from python.fleet_commands import COMMANDS
+
+    try:
+        broadcast = await core.broadcast_command(COMMANDS[name].with_payload(payload), addresses, **kwargs)
+        conn.send(("broadcast_done", request_id, broadcast.result_lines(), broadcast.stats()))
+    except Exception as e:
+        logging.warning(f"Broadcast of {name} failed ({e})")
+        conn.send(("broadcast_done", request_id, None, str(e)))
+
+
+async def _io_main(args):
+    from python.kraken_core import KrakenCore
+
+    authkey = bytes.fromhex(os.environ.pop(AUTHKEY_ENV))
+    conn = Client(("127.0.0.1", args.control_port), authkey=authkey)
+    pressure_ring = ShmRing.attach(args.pressure_ring, PRESSURE_RECORD)
+    info_ring = ShmRing.attach(args.info_ring, CONNECTION_INFO_RECORD)
+    publisher = _SessionPublisher(conn, pressure_ring, info_ring)
+
+    core = KrakenCore(args.out_dir, binary_log=args.binary_log, capture=args.capture, max_in_flight=args.max_in_flight,
+                      metrics_file=args.metrics_file, metrics_port=args.metrics_port,
+                      log_streams=args.log_streams, log_password=os.environ.pop(LOG_PASSWORD_ENV, None),
+                      gatt_cache=not args.no_gatt_cache)
+    core.on_session_added.append(publisher.add_session)
+
+    def started():
+        conn.send(("started", os.getpid()))
+        asyncio.ensure_future(_control_loop(conn, core))
+
+    try:
+        await core.run(started=started)
+    finally:
+        core.close()
+        try:
+            conn.send(("stats", core.stats()))
+            conn.send(("stopped",))
+        except OSError:
+            pass
+        conn.close()
+        pressure_ring.close()
+        info_ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kraken BLE I/O process, started by the app in multi-process mode")
+    parser.add_argument("--control-port", type=int, required=True)
+    parser.add_argument("--pressure-ring", required=True)
+    parser.add_argument("--info-ring", required=True)
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--binary-log", action="store_true")
+    parser.add_argument("--capture", action="store_true")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--metrics-file", default=None)
+    parser.add_argument("--metrics-port", type=int, default=None)
+    parser.add_argument("--log-streams", default=None)
+    parser.add_argument("--no-gatt-cache", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s io %(levelname)s %(message)s")
+    if os.environ.get("KRAKEN_SIMULATED_DEVICES"):
+        from python.sim_kraken import SimulatedFleet
+        SimulatedFleet(int(os.environ["KRAKEN_SIMULATED_DEVICES"])).install()
+    asyncio.run(_io_main(args))
+
+# ==============================================================================
+# UI process side
+# ==============================================================================
+
+class RemotePressureData:
+    """What the UI needs of a PressureData, rebuilt from a ring record."""
+    __slots__ = ("name", "pressure", "battery_raw", "battery", "scanner_tick", "charging_state")
+
+    def __init__(self, name, pressure, battery_raw, scanner_tick, charging_state):
+        self.name = name
+        self.pressure = pressure
+        self.battery_raw = battery_raw
+        self.battery = "Charging.." if battery_raw == 255 else f"{battery_raw}%"
+        self.scanner_tick = scanner_tick
+        self.charging_state = charging_state
+
+    def __repr__(self):
+        return f"RemotePressureData(name={self.name!r}, pressure={self.pressure!r}, battery={self.battery!r})"
+
+
+class RemoteSession(SessionModel):
+    """SessionModel fed by RemoteCore from the I/O process."""
+    def __init__(self, address, core):
+        super().__init__(address)
+        self.core = core
+
+    async def disconnect(self):
+        self.core.send_command("disconnect", self.address)
+
+
+class RemoteBroadcast:
+    """What the UI needs of a finished FleetBroadcast, as sent back by the I/O process."""
+    def __init__(self, lines, stats):
+        self._lines = lines
+        self._stats = stats
+
+    def result_lines(self):
+        return self._lines
+
+    def stats(self):
+        return self._stats
+
+
+class RemoteCore:
+    """
+    Stand-in for KrakenCore in the UI process: starts the I/O process, turns
+    its events and ring records back into RemoteSessions and listener calls.
+    Same surface the app uses: sessions, on_session_added, run(), stop(),
+    close(), stats() and broadcast_command().
+    """
+    def __init__(self, out_dir, binary_log=False, capture=False, max_in_flight=4, metrics_file=None, metrics_port=None,
+                 log_streams=None, log_password=None, gatt_cache=True, poll_interval_seconds=0.02):
+        self.out_dir = out_dir
+        self.options = {"binary_log": binary_log, "capture": capture, "max_in_flight": max_in_flight,
+                        "metrics_file": metrics_file, "metrics_port": metrics_port, "log_streams": log_streams,
+                        "gatt_cache": gatt_cache}
+        self.log_password = log_password
+        self.poll_interval_seconds = poll_interval_seconds
+        self.sessions = {}
+        self.on_session_added = []
+        self.running = False
+        self.process = None
+        self.remote_stats = {}
+        self._devices = {} # device index -> RemoteSession
+        self._conn = None
+        self._broadcasts = {} # request id -> future of a running broadcast_command()
+        self._next_request_id = 0
+
+        self.pressure_ring = ShmRing.create(PRESSURE_RECORD, PRESSURE_RING_CAPACITY)
+        self.info_ring = ShmRing.create(CONNECTION_INFO_RECORD, CONNECTION_INFO_RING_CAPACITY)
+        for ring_name, ring in (("pressure", self.pressure_ring), ("connection_info", self.info_ring)):
+            metrics.gauge("kraken_ring_lost", "Samples the UI process lost because the I/O process lapped it",
+                          labels=("ring",)).labels(ring_name).fn = lambda ring=ring: ring.lost
+
+        self._handlers = {
+            "started": self._on_started,
+            "device": self._on_device,
+            "mode": lambda device, mode: self._devices[device]._set_mode(mode),
+            "identity": lambda device, name, fw_ver: self._devices[device]._set_identity(name, fw_ver),
+            "beacon": lambda device, rssi: self._devices[device]._set_beacon_rssi(rssi),
+            "stats": self._on_stats,
+            "broadcast_done": self._on_broadcast_done,
+            "stopped": lambda: None,
+        }
+
+    # ==========================================================================
+    # Control channel
+    # ==========================================================================
+
+    def send_command(self, command, *args):
+        if self._conn is not None:
+            try:
+                self._conn.send((command, *args))
+            except OSError as e:
+                logging.warning(f"Could not send {command} to the I/O process ({e})")
+
+    def _on_started(self, pid):
+        logging.info(f"I/O process {pid} is scanning")
+
+    def _on_device(self, device, address):
+        session = RemoteSession(address, self)
+        self._devices[device] = session
+        self.sessions[address] = session
+        for callback in self.on_session_added:
+            callback(session)
+
+    def _on_stats(self, stats):
+        self.remote_stats = stats
+
+    async def broadcast_command(self, command, addresses=None, **broadcast_kwargs):
+        """KrakenCore.broadcast_command() run by the I/O process; returns a RemoteBroadcast."""
+        from python.fleet_commands import COMMANDS
+
+        if isinstance(command, str):
+            command = COMMANDS[command]
+        self._next_request_id += 1
+        request_id = self._next_request_id
+        future = self._broadcasts[request_id] = asyncio.get_running_loop().create_future()
+        self.send_command("broadcast", request_id, command.name, command.payload,
+                          list(addresses) if addresses is not None else None, broadcast_kwargs)
+        try:
+            return await future
+        finally:
+            self._broadcasts.pop(request_id, None)
+
+    def _on_broadcast_done(self, request_id, lines, stats):
+        future = self._broadcasts.get(request_id)
+        if future is None or future.done():
+            return
+        if lines is None:
+            future.set_exception(RuntimeError(stats))
+        else:
+            future.set_result(RemoteBroadcast(lines, stats))
+
+    # ==========================================================================
+    # Samples
+    # ==========================================================================
+
+    def _poll(self):
+        # Take the ring contents before draining the control channel: the I/O
+        # process sends a device's "device" event before it writes that
+        # device's first sample, so every sample taken here has a session
+        pressure_chunks, _ = self.pressure_ring.read()
+        info_chunks, _ = self.info_ring.read()
+        conn = self._conn
+        while conn.poll():
+            event, *args = conn.recv()
+            self._handlers[event](*args)
+
+        devices = self._devices
+        for chunk in pressure_chunks:
+            for timestamp_ns, device, reading, pressure, battery, scanner_tick, charging_state in chunk.tolist():
+                session = devices[device]
+                if pressure != pressure: # NaN: not a number, show the raw reading like PressureData does
+                    pressure = reading.decode('utf-8', errors='replace')
+                session.notifications += 1
+                session.update_model(PRESSURE, RemotePressureData(session.name, pressure, battery, scanner_tick,
+                                                                  charging_state if charging_state >= 0 else None))
+
+        for chunk in info_chunks:
+            for record in chunk.tolist():
+                session = devices[record[1]]
+                info = dict(zip(_CONNECTION_INFO_FIELDS, record[2:]))
+                info["central_phy"] = connection_info_decoder.phy_description(info["central_phy"])
+                info["kraken_phy"] = connection_info_decoder.phy_description(info["kraken_phy"])
+                info["last_disconnect_reason"] = sl_status_to_string(info["last_disconnect_reason"])
+                session.notifications += 1
+                session.update_model(CONNECTION_INFO, info)
+
+    # ==========================================================================
+    # Lifecycle
+    # ==========================================================================
+
+    async def _start_process(self):
+        authkey = secrets.token_bytes(16)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        command = [sys.executable, "-m", "python.io_process",
+                   "--control-port", str(listener.address[1]),
+                   "--pressure-ring", self.pressure_ring.name,
+                   "--info-ring", self.info_ring.name,
+                   "--out-dir", os.path.abspath(self.out_dir),
+                   "--max-in-flight", str(self.options["max_in_flight"])]
+        if self.options["binary_log"]:
+            command.append("--binary-log")
+        if self.options["capture"]:
+            command.append("--capture")
+        if self.options["metrics_file"]:
+            command += ["--metrics-file", self.options["metrics_file"]]
+        if self.options["metrics_port"]:
+            command += ["--metrics-port", str(self.options["metrics_port"])]
+        if not self.options["gatt_cache"]:
+            command.append("--no-gatt-cache")
+        if self.options["log_streams"]:
+            command += ["--log-streams", ",".join(self.options["log_streams"])
+                        if not isinstance(self.options["log_streams"], str) else self.options["log_streams"]]
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        if self.log_password is not None:
+            env[LOG_PASSWORD_ENV] = self.log_password
+        self.process = subprocess.Popen(command, cwd=_REPO_ROOT, env=env)
+
+        accept = asyncio.ensure_future(asyncio.to_thread(listener.accept))
+        try:
+            while not accept.done():
+                await asyncio.wait({accept}, timeout=0.2)
+                if not accept.done() and self.process.poll() is not None:
+                    raise RuntimeError(f"I/O process exited with code {self.process.returncode} before connecting")
+            self._conn = accept.result()
+        finally:
+            listener.close() # also unblocks accept() if we gave up
+
+    async def run(self, started=None):
+        self.running = True
+        await self._start_process()
+        if started is not None:
+            started()
+        try:
+            while self.running and self.process.poll() is None:
+                self._poll()
+                await asyncio.sleep(self.poll_interval_seconds)
+        except (EOFError, OSError):
+            logging.warning("Lost the control channel to the I/O process")
+        finally:
+            for future in self._broadcasts.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("the I/O process stopped"))
+            if self._conn is not None: # not already close()d
+                self.send_command("stop")
+                await asyncio.to_thread(self._wait_for_process)
+
+    def _wait_for_process(self, timeout_seconds=15):
+        try:
+            self.process.wait(timeout_seconds)
+        except subprocess.TimeoutExpired:
+            logging.warning("I/O process did not stop, killing it")
+            self.process.kill()
+            self.process.wait()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        """Stop the I/O process (it flushes and closes the logs) and free the rings."""
+        self.running = False
+        if self.process is not None and self.process.poll() is None:
+            self.send_command("stop")
+            self._wait_for_process()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self.pressure_ring.close()
+        self.info_ring.close()
+
+    def stats(self):
+        stats = {
+            "sessions": len(self.sessions),
+            "connected": sum(1 for s in self.sessions.values() if s.current_mode == "Connected"),
+            "notifications": sum(s.notifications for s in self.sessions.values()),
+            "scheduler": self.remote_stats.get("scheduler", {}),
+            "bus": self.remote_stats.get("bus", {}),
+            "log_streams": self.remote_stats.get("log_streams", {"streams": 0, "received_bytes": 0, "lost_bytes": 0}),
+            "ring_lost": {"pressure": self.pressure_ring.lost, "connection_info": self.info_ring.lost},
+        }
+        return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+UI-free collector: scanning, connection scheduling, per-device sessions and
+the log sinks. Runs on any asyncio loop; the Kivy app and the headless
+gateway entry point (python -m python.headless) are both consumers of it.
+
+Nothing in here (or imported from here) may pull in Kivy.
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import time
+
+import python.ble_utils as ble_utils
+from python import csv_log, metrics
+from python.connection_scheduler import ConnectionScheduler
+from python.event_bus import EventBus
+from python.gatt_cache import GattCache
+from python.kraken_session import DECODED_TOPIC, RAW_TOPIC, KrakenSession, Sample
+
+GATT_CACHE_FILE = "KrakenGattCache.json"
+
+# Advertisements a Kraken sent before going to deep sleep may still be on their way
+DEEP_SLEEP_GRACE_SECONDS = 3.0
+
+CONNECTION_INFO_COLUMNS = ["address", "name", "kraken_rssi", "kraken_power", "kraken_phy", "connection_count", "central_rssi", "central_phy", "channel_map", "available_channels", "current_channel", "connection_interval_ms", "supervision_timeout_ms"]
+
+# ==============================================================================
+# Process stats
+# ==============================================================================
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux/Android, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+# ==============================================================================
+# Notification pipeline
+# ==============================================================================
+
+def create_pipeline(decoder_queue=10000, log_queue=10000, model_queue=10000, capture=None, capture_queue=10000):
+    """
+    EventBus with the standard stages behind the KrakenSession callbacks:
+
+        raw -> decoder -> decoded -> log_sinks  (CSV/binary, "block": no rows lost)
+                                  -> ui_model   (history + listeners, "drop_oldest")
+            -> capture  (raw bytes to a CaptureWriter, only with `capture`)
+
+    The decoder drops the oldest raw packets if it falls behind, so a stalled
+    disk pushes back through log_sinks onto the decoder and ends up as counted
+    drops there, never as a blocked BLE callback. Further consumers (e.g.
+    alert rules) subscribe to DECODED_TOPIC with their own queue and policy.
+    The bus still has to be start()ed on the running loop.
+    """
+    bus = EventBus()
+
+    async def decode(packet):
+        packet.session.count_notification(packet.timestamp_ns)
+        value = packet.session.decode(packet.kind, packet.data)
+        if value is not None:
+            await bus.publish_async(DECODED_TOPIC, Sample(packet.timestamp_ns, packet.session, packet.kind, value))
+
+    bus.subscribe(RAW_TOPIC, decode, name="decoder", maxsize=decoder_queue, policy="drop_oldest")
+    bus.subscribe(DECODED_TOPIC, lambda s: s.session.log(s.kind, s.value, s.timestamp_ns),
+                  name="log_sinks", maxsize=log_queue, policy="block")
+    bus.subscribe(DECODED_TOPIC, lambda s: s.session.update_model(s.kind, s.value),
+                  name="ui_model", maxsize=model_queue, policy="drop_oldest")
+    if capture is not None:
+        # publish() can't wait, so a full capture queue drops (and counts) the packet
+        bus.subscribe(RAW_TOPIC, lambda p: capture.write(p.session.address, p.char_uuid, p.data, p.timestamp_ns),
+                      name="capture", maxsize=capture_queue, policy="block")
+    return bus
+
+# ==============================================================================
+# Core
+# ==============================================================================
+
+class KrakenCore:
+    """
+    Owns the log files, the scanner, the ConnectionScheduler and one
+    KrakenSession per discovered Kraken.
+
+    `on_session_added` callbacks are called with each new session, before its
+    first beacon is processed, so a consumer can attach a listener.
+
+    `metrics_file` / `metrics_port` export the python/metrics.py registry in
+    Prometheus text format while run() is running.
+
+    `log_streams` ("all", a collection of addresses or a comma separated
+    string of them) captures those
+    Krakens' on-device logs with `log_password`, see python/log_stream.py;
+    enable_log_stream() adds one later.
+
+    Notifications go through create_pipeline()'s event bus (`self.bus`), or
+    are handled inside the BLE callbacks with `pipeline=False`.
+
+    With `gatt_cache` the sessions keep each Kraken's name, FW version and
+    characteristic handles in <out_dir>/KrakenGattCache.json and reconnect
+    without waiting for discovery and reads, see python/gatt_cache.py.
+    """
+    def __init__(self, out_dir, binary_log=False, capture=False, max_in_flight=4, metrics_file=None, metrics_port=None,
+                 pipeline=True, log_streams=None, log_password=None, gatt_cache=True):
+        self.out_dir = out_dir
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.sessions = {}
+        self.on_session_added = []
+        self.held = set() # addresses run() must not reconnect, e.g. during an OTA update
+        self.asleep = {} # address -> when it was sent to deep sleep, held until it advertises again
+        self.log_streams = {} # address -> LogStream
+        if isinstance(log_streams, str) and log_streams != "all":
+            log_streams = [address.strip() for address in log_streams.split(",") if address.strip()]
+        self.log_stream_addresses = log_streams if log_streams == "all" else set(log_streams or ())
+        self.log_password = log_password
+        self.gatt_cache = None
+        if gatt_cache:
+            self.gatt_cache = GattCache(os.path.join(out_dir, GATT_CACHE_FILE))
+        self.running = False
+        self.run_active = False # run() is looping or still draining the pipeline in its clean-up
+        self.scanner = None
+        self.connection_scheduler = ConnectionScheduler(max_in_flight=max_in_flight)
+
+        stamp = self.stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.csv_ble_info_logger = csv_log.CSVLogger(list(CONNECTION_INFO_COLUMNS), os.path.join(out_dir, f"KrakenBleConnectionData_{stamp}.csv"), buffered=True)
+        self.pressure_logger = None
+        self.binary_loggers = []
+        if binary_log:
+            # Compact columnar copies of the connection info and pressure streams, see python/binary_log.py
+            from python import binary_log as binary_log_module
+            self.binary_loggers = [
+                binary_log_module.BinaryLogger(CONNECTION_INFO_COLUMNS, os.path.join(out_dir, f"KrakenBleConnectionData_{stamp}.kbl")),
+                binary_log_module.BinaryLogger(binary_log_module.PRESSURE_COLUMNS, os.path.join(out_dir, f"KrakenPressure_{stamp}.kbl")),
+            ]
+            self.csv_ble_info_logger = csv_log.TeeLogger(self.csv_ble_info_logger, self.binary_loggers[0])
+            self.pressure_logger = self.binary_loggers[1]
+        self.capture = None
+        if capture:
+            # Raw notification bytes for replay, see python/capture.py
+            from python.capture import CaptureWriter
+            self.capture = CaptureWriter(os.path.join(out_dir, f"KrakenCapture_{stamp}.kcap"))
+        self.bus = create_pipeline(capture=self.capture) if pipeline else None
+        self.csv_event_logger = csv_log.CSVLogger(["source", "event", "notes"], os.path.join(out_dir, f"KrakenEventLog_{stamp}.csv"), buffered=True)
+        # NOTE: Modify this if you change the format of the data being logged
+        self.csv_event_logger.write(['APP', "LOG_VERSION", '1'])
+
+        metrics.gauge("kraken_sessions", "Krakens seen since start", fn=lambda: len(self.sessions))
+        metrics.gauge("kraken_connected", "Krakens currently connected",
+                      fn=lambda: sum(1 for s in self.sessions.values() if s.ble_client is not None))
+        metrics.gauge("kraken_connect_queue_depth", "Connection attempts waiting to start",
+                      fn=lambda: self.connection_scheduler.queue_depth)
+        metrics.gauge("kraken_connects_in_flight", "Connection attempts running",
+                      fn=lambda: self.connection_scheduler.in_flight)
+
+    def add_session(self, address):
+        session = self.sessions.get(address)
+        if session is None:
+            logging.info(f"Adding session for Kraken {address}")
+            session = KrakenSession(address, self.csv_ble_info_logger, self.csv_event_logger, self.pressure_logger, self.capture,
+                                    bus=self.bus, gatt_cache=self.gatt_cache)
+            self.sessions[address] = session
+            if self.log_stream_addresses == "all" or address in self.log_stream_addresses:
+                self.enable_log_stream(address)
+            for callback in self.on_session_added:
+                callback(session)
+        return session
+
+    def enable_log_stream(self, address):
+        """Capture this Kraken's device log from its next connection on (or now, if connected)."""
+        from python.log_stream import LogStream
+
+        session = self.sessions[address]
+        if session.log_stream is not None:
+            return session.log_stream
+        if self.log_password is None:
+            raise ValueError("A log stream needs the logging service password")
+        path = os.path.join(self.out_dir, f"KrakenLog_{address.replace(':', '')}_{self.stamp}.log")
+        session.log_stream = self.log_streams[address] = LogStream(address, path, self.log_password)
+        if session.ble_client is not None and session.ble_client.is_connected:
+            asyncio.ensure_future(session.start_log_stream())
+        return session.log_stream
+
+    async def _flush_periodically(self, interval_seconds=1.0):
+        # Slow log streams and quiet devices' binary rows would otherwise sit
+        # in a half-full buffer until shutdown
+        while True:
+            await asyncio.sleep(interval_seconds)
+            for stream in list(self.log_streams.values()):
+                stream.flush()
+            for logger in self.binary_loggers:
+                logger.flush(wait=False) # the writer thread does the disk I/O
+            if self.gatt_cache is not None:
+                self.gatt_cache.save()
+
+    async def _process_scan_events(self):
+        async for event, address, data in self.scanner.events():
+            slept = self.asleep.get(address)
+            if slept is not None and time.monotonic() - slept > DEEP_SLEEP_GRACE_SECONDS:
+                # Awake again (advertisements queued before it went to sleep don't count)
+                del self.asleep[address]
+                self.held.discard(address)
+            self.add_session(address).process_beacon_data(data)
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "connected": sum(1 for s in self.sessions.values() if s.ble_client is not None),
+            "notifications": sum(s.notifications for s in self.sessions.values()),
+            "scheduler": self.connection_scheduler.stats(),
+            "bus": self.bus.stats() if self.bus is not None else {},
+            "log_streams": {
+                "streams": len(self.log_streams),
+                "received_bytes": sum(s.received_bytes for s in self.log_streams.values()),
+                "lost_bytes": sum(s.lost_bytes for s in self.log_streams.values()),
+            },
+        }
+
+    async def update_firmware(self, image, addresses=None, **campaign_kwargs):
+        """
+        OTA-update `addresses` (default: every known Kraken) with a GBL image
+        while run() keeps the others going; their sessions are disconnected
+        and left alone until the update is over. Returns the finished
+        OtaCampaign (python/ota.py) for its per-device results.
+        """
+        from python.ota import OtaCampaign
+
+        addresses = list(addresses if addresses is not None else self.sessions)
+        campaign = OtaCampaign(image, addresses, **campaign_kwargs) # checks the image before touching any device
+        self.held.update(addresses)
+        try:
+            # A connection attempt that is already running would otherwise reconnect behind our back
+            while any(self.connection_scheduler.is_pending(address) for address in addresses):
+                await asyncio.sleep(0.1)
+            await asyncio.gather(*(self.sessions[address].disconnect() for address in addresses if address in self.sessions))
+            for address in addresses:
+                self.csv_event_logger.write([address, "ota_started", campaign.expected_version])
+            await campaign.run()
+            for address, job in campaign.jobs.items():
+                self.csv_event_logger.write([address, f"ota_{job.state}", job.error or ""])
+                if self.gatt_cache is not None:
+                    self.gatt_cache.invalidate(address, "ota") # new FW, possibly a new GATT layout
+        finally:
+            self.held.difference_update(addresses)
+        return campaign
+
+    def connected_client(self, address):
+        """The session's client if it is connected and set up, else None."""
+        session = self.sessions.get(address)
+        client = session.ble_client if session is not None else None
+        if client is None or not client.is_connected or self.connection_scheduler.is_pending(address):
+            return None
+        return client
+
+    async def broadcast_command(self, command, addresses=None, **broadcast_kwargs):
+        """
+        Apply a python/fleet_commands.py command (a FleetCommand or its name)
+        to `addresses` (default: every known Kraken), through their sessions'
+        connections where there are any. run() leaves the devices alone
+        until it is over, so it doesn't race the on-demand connections; ones
+        sent to deep sleep stay alone until they advertise again. Returns
+        the finished FleetBroadcast for its per-device results.
+        """
+        from python.fleet_commands import COMMANDS, FleetBroadcast
+
+        if isinstance(command, str):
+            command = COMMANDS[command]
+        addresses = list(addresses if addresses is not None else self.sessions)
+        broadcast = FleetBroadcast(command, addresses, connected_client=self.connected_client, **broadcast_kwargs)
+        held = [address for address in addresses if address not in self.held]
+        self.held.update(held)
+        try:
+            while any(self.connection_scheduler.is_pending(address) for address in addresses):
+                await asyncio.sleep(0.1)
+            await broadcast.run()
+            for address, result in broadcast.results.items():
+                self.csv_event_logger.write([address, f"command_{command.name}_{result.state}", result.error or ""])
+                if command.name == "deep_sleep" and result.ok:
+                    self.asleep[address] = time.monotonic()
+        finally:
+            self.held.difference_update(address for address in held if address not in self.asleep)
+        return broadcast
+
+    def stop(self):
+        """Ask run() to wind down."""
+        self.running = False
+
+    async def _start_metrics_export(self):
+        tasks, servers = [], []
+        if self.metrics_file:
+            tasks.append(asyncio.create_task(metrics.export_to_file(self.metrics_file)))
+        if self.metrics_port:
+            try:
+                servers.append(await metrics.serve_prometheus(int(self.metrics_port)))
+            except OSError as e:
+                logging.warning(f"Could not serve metrics on port {self.metrics_port} ({e})")
+        return tasks, servers
+
+    async def run(self, started=None):
+        """Scan and keep every known Kraken connected until stop() is called."""
+        self.running = True
+        metrics_tasks, metrics_servers = await self._start_metrics_export()
+        if self.bus is not None:
+            self.bus.start()
+        self.scanner = ble_utils.KrakenScanner()
+        await self.scanner.start()
+        scan_task = asyncio.create_task(self._process_scan_events())
+        flush_task = asyncio.create_task(self._flush_periodically())
+        self.connection_scheduler.start()
+        if started is not None:
+            started()
+
+        last_stats_log = 0
+        self.run_active = True
+        try:
+            while self.running:
+                # Queue a connection attempt for every Kraken that isn't connected;
+                # the scheduler runs them concurrently, strongest signal first.
+                # NOTE: Work on a copy since the dictionary size can change while iterating
+                for session in list(self.sessions.values()):
+                    if session.ble_client is None and session.address not in self.held:
+                        self.connection_scheduler.submit(session.address, session.run, priority=session.connection_priority())
+
+                if self.connection_scheduler.queue_depth or self.connection_scheduler.in_flight:
+                    if time.monotonic() - last_stats_log > 10:
+                        last_stats_log = time.monotonic()
+                        logging.info(f"Connection scheduler: {self.connection_scheduler.stats()}")
+
+                await asyncio.sleep(1)
+        finally:
+            scan_task.cancel()
+            flush_task.cancel()
+            await self.connection_scheduler.stop()
+            await self.scanner.stop()
+            await asyncio.gather(*(s.disconnect() for s in list(self.sessions.values())), return_exceptions=True)
+            if self.bus is not None:
+                await self.bus.stop() # drain what's queued into the logs before close()
+            for task in metrics_tasks:
+                task.cancel()
+            for server in metrics_servers:
+                server.close()
+            await asyncio.gather(*metrics_tasks, return_exceptions=True)
+            self.run_active = False
+
+    def close(self):
+        """Flush and close every log sink. Call it once run() has returned."""
+        if self.run_active:
+            # run() still disconnects and drains the bus into the sinks: those rows would be dropped
+            logging.warning("KrakenCore.close() called while run() is still active, late rows will be dropped")
+        self.csv_ble_info_logger.close()
+        self.csv_event_logger.close()
+        if self.pressure_logger is not None:
+            self.pressure_logger.close()
+        if self.capture is not None:
+            self.capture.close()
+        for stream in self.log_streams.values():
+            stream.close()
+        if self.gatt_cache is not None:
+            self.gatt_cache.save()
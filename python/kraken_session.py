@@ -0,0 +1,412 @@
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+from typing import NamedTuple
+
+import python.ble_backend as ble_backend
+import python.kraken_uuids as kraken_uuids
+from python import connection_info_decoder, metrics
+from python.gatt_cache import CLIENT_KWARGS, CONNECT_KWARGS
+from python.pressure_data import PressureData
+from python.ring_buffer import RollingSeries
+from python.sl_status_code_parser import sl_status_to_string
+
+# Per-device history: samples kept per series, and how many of the most
+# recent ones the rolling min/max/mean/std cover
+HISTORY_CAPACITY = 1024
+STATS_WINDOW = 128
+
+# series name -> (label, unit)
+HISTORY_SERIES = {
+    "pressure": ("Pressure", "PSI"),
+    "kraken_rssi": ("Kraken RSSI", "dBm"),
+    "central_rssi": ("Central RSSI", "dBm"),
+    "connection_interval": ("Connection Interval", "ms"),
+}
+
+CONNECT_SECONDS = metrics.histogram("kraken_connect_seconds", "Time from connect() to notifications enabled")
+FIRST_NOTIFICATION_SECONDS = metrics.histogram("kraken_first_notification_seconds",
+                                               "Time from connect() to the first notification, by GATT cache use",
+                                               labels=("cache",))
+CONNECT_ATTEMPTS = metrics.counter("kraken_connect_attempts_total", "Connection attempts by outcome", labels=("outcome",))
+NOTIFICATIONS = metrics.counter("kraken_notifications_total", "Notifications received", labels=("address",))
+DECODE_SECONDS = metrics.histogram("kraken_decode_seconds", "Notification decode time", labels=("characteristic",))
+_PRESSURE_DECODE = DECODE_SECONDS.labels("pressure")
+_CONNECTION_INFO_DECODE = DECODE_SECONDS.labels("connection_info")
+
+# Characteristics whose handles go into the GATT cache
+CACHED_UUIDS = (kraken_uuids.KRAKEN_DISPLAY_NAME_CHAR_UUID, kraken_uuids.UUID_FW_REV_CHAR,
+                kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID, kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID)
+
+# Notification kinds
+PRESSURE = "pressure"
+CONNECTION_INFO = "connection_info"
+
+# Event bus topics (python/event_bus.py): raw Packets from the BLE callbacks,
+# decoded Samples from the decoder stage
+RAW_TOPIC = "raw"
+DECODED_TOPIC = "decoded"
+
+class Packet(NamedTuple):
+    timestamp_ns: int
+    session: "KrakenSession"
+    kind: str
+    data: bytes
+    char_uuid: str
+
+class Sample(NamedTuple):
+    timestamp_ns: int
+    session: "KrakenSession"
+    kind: str
+    value: object
+
+class SessionModel:
+    """
+    Per-device state, history and listeners: the part of a session a view
+    needs. KrakenSession fills it from its own BLE connection; in
+    multi-process mode a RemoteSession (python/io_process.py) fills it from
+    the I/O process.
+
+    Consumers (the Kivy KrakenWidget, the headless collector) register with
+    add_listener() and get `listener(session, event, value)` calls:
+
+      "mode"            "Beacon" or "Connected"
+      "identity"        None, read session.name / session.fw_ver
+      "beacon"          advertised RSSI
+      "pressure"        PressureData
+      "connection_info" decoded connection info dict, with PHYs and the
+                        disconnect reason already turned into text
+    """
+    def __init__(self, address, history_capacity=HISTORY_CAPACITY, stats_window=STATS_WINDOW):
+        # state
+        self.current_mode = "Beacon"
+        self.name = None
+        self.fw_ver = None
+        self.address = address
+        self.central_rssi = '?'
+        self.notifications = 0
+
+        # Bounded time series per metric
+        self.history = {series: RollingSeries(history_capacity, stats_window) for series in HISTORY_SERIES}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _emit(self, event, value=None):
+        for listener in self.listeners:
+            listener(self, event, value)
+
+    def _record(self, series, value):
+        if isinstance(value, (int, float)):
+            self.history[series].add(value) # skips e.g. a pressure error string
+
+    def _set_mode(self, mode):
+        self.current_mode = mode
+        self._emit("mode", mode)
+
+    def _set_identity(self, name, fw_ver):
+        self.name = name
+        self.fw_ver = fw_ver
+        self._emit("identity")
+
+    def _set_beacon_rssi(self, rssi):
+        self.central_rssi = rssi
+        self._record("central_rssi", rssi)
+        self._emit("beacon", rssi)
+
+    def update_model(self, kind, interpreted_data):
+        """Fold a decoded notification into the history and tell the listeners."""
+        if kind == PRESSURE:
+            self._record("pressure", interpreted_data.pressure)
+            self._emit("pressure", interpreted_data)
+            return
+
+        self._record("kraken_rssi", interpreted_data['kraken_rssi'])
+        self._record("connection_interval", interpreted_data['connection_interval_ms'])
+        self._emit("connection_info", interpreted_data)
+
+class KrakenSession(SessionModel):
+    """
+    Everything about one Kraken that doesn't need a UI: connecting,
+    decoding notifications, logging and the per-device history (see
+    SessionModel for the listener events).
+
+    Without a `bus` each notification is decoded, logged and folded into the
+    history inside the BLE callback. With one, the callback only publishes a
+    raw Packet and decode() / log() / update_model() run as pipeline stages,
+    see create_pipeline() in python/kraken_core.py.
+    """
+    def __init__(self, address, connection_info_csv_logger, csv_event_logger, pressure_logger=None, capture=None,
+                 history_capacity=HISTORY_CAPACITY, stats_window=STATS_WINDOW, bus=None, gatt_cache=None):
+        super().__init__(address, history_capacity, stats_window)
+        self.ble_client = None
+        self._notification_counter = NOTIFICATIONS.labels(address)
+
+        self.connection_info_csv_logger = connection_info_csv_logger
+        self.csv_event_logger = csv_event_logger
+        self.pressure_logger = pressure_logger
+        self.capture = capture # optional raw notification CaptureWriter, see python/capture.py
+        self.bus = bus # optional EventBus: decode/log/update_model then run as pipeline stages
+        self.log_stream = None # optional LogStream, started on every connect, see python/log_stream.py
+        self.gatt_cache = gatt_cache # optional GattCache, see python/gatt_cache.py
+        self.first_notification_seconds = deque(maxlen=64) # (connected with a cache entry, seconds) per connection
+        self._first_notification_due = None # (connect start time.time_ns(), cache label) until the first notification
+
+        # Event name predates the headless core, kept so existing logs parse the same
+        self.csv_event_logger.write([self.address, "kraken_widget_created", ""])
+
+    # ==========================================================================
+    # Callbacks
+    # ==========================================================================
+
+    def process_beacon_data(self, data):
+        # TODO: Get the advertised name and populate thiss
+        self._set_beacon_rssi(data['rssi'])
+
+
+    def _process_pressure_data_notification(self, sender, data):
+        self._on_notification(PRESSURE, sender, data)
+
+
+    def _process_ble_connection_info_notification(self, sender, data):
+        self._on_notification(CONNECTION_INFO, sender, data)
+
+
+    def _on_notification(self, kind, sender, data):
+        # Runs inside bleak's callback: with a bus, only stamp and enqueue the
+        # raw bytes, the pipeline stages (python/kraken_core.py) do the rest,
+        # counting and capture included
+        timestamp_ns = time.time_ns()
+        if self.bus is not None:
+            self.bus.publish(RAW_TOPIC, Packet(timestamp_ns, self, kind, bytes(data), sender.uuid))
+            return
+
+        self.count_notification(timestamp_ns)
+        if self.capture is not None:
+            self.capture.write(self.address, sender.uuid, data, timestamp_ns)
+        value = self.decode(kind, data)
+        if value is not None:
+            self.log(kind, value, timestamp_ns)
+            self.update_model(kind, value)
+
+    def _record_first_notification(self, timestamp_ns):
+        start_ns, cache = self._first_notification_due
+        if timestamp_ns < start_ns:
+            return # queued before this connection started
+        self._first_notification_due = None
+        seconds = (timestamp_ns - start_ns) / 1e9
+        FIRST_NOTIFICATION_SECONDS.labels(cache).observe(seconds)
+        self.first_notification_seconds.append((cache == "hit", seconds))
+
+    # ==========================================================================
+    # Processing stages
+    # ==========================================================================
+
+    def count_notification(self, timestamp_ns):
+        """Notification counters and the time-to-first-notification sample of this connection."""
+        if self._first_notification_due is not None:
+            self._record_first_notification(timestamp_ns)
+        self.notifications += 1
+        self._notification_counter.inc()
+
+    def decode(self, kind, data):
+        """Raw notification bytes -> PressureData / connection info dict, None if undecodable."""
+        start = time.perf_counter()
+        if kind == PRESSURE:
+            try:
+                interpreted_data = PressureData(data)
+            except struct.error as e:
+                logging.warning(f"{self.address} dropping pressure notification of {len(data)} bytes ({e})")
+                return None
+            _PRESSURE_DECODE.observe(time.perf_counter() - start)
+            logging.debug(interpreted_data)
+            return interpreted_data
+
+        try:
+            decoded = connection_info_decoder.decode(data)
+        except connection_info_decoder.ConnectionInfoDecodeError as e:
+            logging.warning(f"{self.address} dropping BLE connection info notification ({e})")
+            return None
+        _CONNECTION_INFO_DECODE.observe(time.perf_counter() - start)
+
+        interpreted_data = dict(decoded,
+                                central_phy=connection_info_decoder.phy_description(decoded["central_phy"]),
+                                kraken_phy=connection_info_decoder.phy_description(decoded["kraken_phy"]),
+                                last_disconnect_reason=sl_status_to_string(decoded["last_disconnect_reason"]))
+        logging.debug(f"{self.address} BLE connection info -> {interpreted_data}")
+        return interpreted_data
+
+
+    def log(self, kind, interpreted_data, timestamp_ns=None):
+        """Write a decoded notification to the CSV/binary logs."""
+        if kind == PRESSURE:
+            if self.pressure_logger is not None:
+                self.pressure_logger.write([self.address,
+                                            self.name,
+                                            interpreted_data.pressure,
+                                            interpreted_data.battery_raw,
+                                            interpreted_data.scanner_tick,
+                                            interpreted_data.charging_state], timestamp_ns)
+            return
+
+        self.connection_info_csv_logger.write([self.address,
+                                              self.name,
+                                              interpreted_data['kraken_rssi'],
+                                              interpreted_data['kraken_current_power'],
+                                              interpreted_data['kraken_phy'],
+                                              interpreted_data['open_connections'],
+                                              self.central_rssi, # gathered from beacon data
+                                              interpreted_data['central_phy'],
+                                              f"0x{interpreted_data['channel_map']:X}",
+                                              interpreted_data["channel_count"],
+                                              interpreted_data['current_channel'],
+                                              interpreted_data['connection_interval_ms'],
+                                              interpreted_data['supervision_timeout_ms']], timestamp_ns)
+
+
+    def _disconnect_callback(self, client):
+        self._first_notification_due = None
+        self._set_mode("Beacon")
+        self.csv_event_logger.write([self.address, "kraken_disconnected", ""])
+        if client is self.ble_client:
+            self.ble_client = None # allow run() to reconnect
+
+    # ==========================================================================
+    # GATT Helpers
+    # ==========================================================================
+    async def _get_kraken_display_name(self):
+        legacy_kraken_service = self.ble_client.services.get_service(kraken_uuids.KRAKEN_SERVICE_UUID)
+        display_name_char = legacy_kraken_service.get_characteristic(kraken_uuids.KRAKEN_DISPLAY_NAME_CHAR_UUID)
+        return (await self.ble_client.read_gatt_char(display_name_char)).decode('ascii')
+
+    async def _get_fw_version_number(self):
+        device_info_service = self.ble_client.services.get_service(kraken_uuids.DEVICE_INFO_SERVICE_UUID)
+        fw_ver_char = device_info_service.get_characteristic(kraken_uuids.UUID_FW_REV_CHAR)
+        return (await self.ble_client.read_gatt_char(fw_ver_char)).decode('utf-8').rstrip('\x00')
+
+    # ==========================================================================
+    # Run
+    # ==========================================================================
+
+    async def run(self):
+        if not self.ble_client:
+            logging.info(f"Attempting to connect to Kraken {self.address}")
+            start = time.perf_counter()
+            start_ns = time.time_ns()
+            cached = self.gatt_cache.get(self.address) if self.gatt_cache is not None else None
+            try:
+                self.ble_client = ble_backend.create_client(self.address, disconnected_callback=self._disconnect_callback,
+                                                            **(CLIENT_KWARGS if cached else {}))
+                self._first_notification_due = (start_ns, "off" if self.gatt_cache is None else "hit" if cached else "miss")
+                await self.ble_client.connect(**(CONNECT_KWARGS if cached else {}))
+                logging.info(f"Connected to Kraken {self.address}, enabling notifications")
+                self.csv_event_logger.write([self.address, "kraken_connected", ""])
+                self._set_mode("Connected")
+
+                if cached is None:
+                    self._set_identity(await self._get_kraken_display_name(), await self._get_fw_version_number())
+                elif self.gatt_cache.matches(cached, self.ble_client.services):
+                    # Name and FW version are re-read once the notifications are flowing
+                    self._set_identity(cached["name"], cached["fw_ver"])
+                else:
+                    self.gatt_cache.invalidate(self.address, "handles")
+                    raise RuntimeError("GATT layout differs from the cached one, reconnecting with a full discovery")
+
+                if self.ble_client.services.get_characteristic(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID):
+                    logging.info(f"Subscribing to BLE connection info notifications for Kraken {self.address}")
+                    await self.ble_client.start_notify(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID, self._process_ble_connection_info_notification)
+                else:
+                    logging.warning(f"Kraken {self.address} does not support BLE connection info notifications")
+
+                logging.info(f"Enable standard pressure notifications for Kraken {self.address}")
+                await self.ble_client.start_notify(kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID, self._process_pressure_data_notification)
+
+                if self.log_stream is not None:
+                    await self.start_log_stream()
+                if cached is not None:
+                    asyncio.ensure_future(self._refresh_metadata(self.ble_client, cached))
+                elif self.gatt_cache is not None:
+                    self.gatt_cache.store(self.address, self.name, self.fw_ver, self.ble_client.services, CACHED_UUIDS)
+            except asyncio.CancelledError:
+                # Connection attempt timed out (see ConnectionScheduler)
+                CONNECT_ATTEMPTS.labels("cancelled").inc()
+                self._abandon_client()
+                raise
+            except Exception as e:
+                logging.warning(f"Failed to connect to Kraken {self.address} ({e})")
+                CONNECT_ATTEMPTS.labels("failed").inc()
+                self._abandon_client()
+                return False
+            CONNECT_SECONDS.observe(time.perf_counter() - start)
+            CONNECT_ATTEMPTS.labels("succeeded").inc()
+        return True
+
+    async def _refresh_metadata(self, client, cached):
+        try:
+            name, fw_ver = await self._get_kraken_display_name(), await self._get_fw_version_number()
+        except Exception as e:
+            logging.debug(f"Could not refresh the name and FW version of Kraken {self.address} ({e})")
+            return
+        if client is not self.ble_client:
+            return # disconnected meanwhile
+        if fw_ver != cached["fw_ver"]:
+            # The cached layout belongs to the old FW: start over with a full discovery
+            logging.info(f"Kraken {self.address} now runs FW {fw_ver} (cached {cached['fw_ver']}), reconnecting")
+            self.gatt_cache.invalidate(self.address, "fw_version")
+            await self.disconnect()
+        elif name != cached["name"]:
+            self._set_identity(name, fw_ver)
+            self.gatt_cache.store(self.address, name, fw_ver, client.services, CACHED_UUIDS)
+
+    async def start_log_stream(self):
+        # A log stream that won't start (e.g. wrong password) must not cost the pressure connection
+        try:
+            await self.log_stream.start(self.ble_client)
+            logging.info(f"Streaming the device log of Kraken {self.address} to {self.log_stream.path}")
+            self.csv_event_logger.write([self.address, "log_stream_started", self.log_stream.path])
+        except Exception as e:
+            logging.warning(f"Could not start the log stream of Kraken {self.address} ({e})")
+            self.csv_event_logger.write([self.address, "log_stream_failed", str(e)])
+
+    async def open_nus_channel(self, window=16):
+        """Framed request/response channel over this connection's Nordic UART service, see python/nus.py."""
+        from python.nus import NusChannel
+
+        if self.ble_client is None:
+            raise RuntimeError(f"Kraken {self.address} is not connected")
+        channel = NusChannel(self.ble_client, window=window)
+        await channel.open()
+        return channel
+
+    def _abandon_client(self):
+        # Drop a failed or half-set-up connection so the next run() retries from scratch
+        self._first_notification_due = None
+        client = self.ble_client
+        self.ble_client = None
+        if client is not None:
+            asyncio.ensure_future(self._disconnect_quietly(client))
+
+    async def _disconnect_quietly(self, client):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logging.debug(f"Ignoring error while dropping connection to Kraken {self.address} ({e})")
+
+    async def disconnect(self):
+        client = self.ble_client
+        self.ble_client = None
+        if client is not None:
+            await self._disconnect_quietly(client)
+            self._set_mode("Beacon")
+
+    def connection_priority(self):
+        # Lower runs first: strongest advertised RSSI first, unknown RSSI last
+        if isinstance(self.central_rssi, (int, float)):
+            return -self.central_rssi
+        return 1000
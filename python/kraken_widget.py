@@ -1,5 +1,3 @@
-import logging
-
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
@@ -8,14 +6,246 @@ from kivy.uix.label import Label
 from kivy.uix.scrollview import ScrollView
 from kivy.metrics import dp
 
-import numpy as np
-from bleak import BleakClient
-
-import python.kraken_uuids as kraken_uuids
-from python.sl_status_code_parser import sl_status_to_string
+from python.kraken_session import HISTORY_SERIES
+from python.sparkline import Sparkline
+
+# Simple functions to create consistent label widgets
+def _create_simple_label_widget(text, font_size='18sp'):
+    lbl = Label(text=text, 
+                markup=True, 
+                size_hint=(1, None),
+                text_size=(None, None),
+                halign='left',
+                valign='middle',
+                font_size=font_size)
+    
+    # Make text wrap to label width and compute height from texture
+    lbl.bind(
+        width=lambda inst, w: setattr(inst, "text_size", (w, None)),
+        texture_size=lambda inst, ts: setattr(inst, "height", max(ts[1], dp(28)))
+    )
+    # initial text_size
+    lbl.text_size = (lbl.width, None)
+
+    return lbl
+
+def _create_simple_heading_widget(text):
+    return _create_simple_label_widget(f"[b][u]{text}[/u][/b]", font_size='28sp')
+
+def _create_simple_subheading_widget(text):
+    return _create_simple_label_widget(f"[b]{text}[/b]", font_size='22sp')
+
+
+# Detail view layout: ("heading" | "subheading", text), ("field", field name)
+# or ("chart", history series name)
+DETAIL_LAYOUT = [
+    ("field", "current_mode"),
+    ("field", "device_name"),
+    ("field", "fw_ver"),
+    ("heading", "BLE Connection Info"),
+    ("subheading", "Kraken Side"),
+    ("field", "kraken_rssi"),
+    ("field", "open_connections"),
+    ("field", "kraken_phy"),
+    ("field", "kraken_current_power"),
+    ("field", "kraken_max_power"),
+    ("field", "last_disconnect_reason"),
+    ("subheading", "Central Side"),
+    ("field", "central_rssi"),
+    ("field", "central_phy"),
+    ("subheading", "Environment"),
+    ("field", "channel_map"),
+    ("field", "current_channel"),
+    ("field", "connection_interval"),
+    ("field", "supervision_timeout"),
+    ("heading", "Standard Data Stream"),
+    ("field", "latest_pressure"),
+    ("chart", "pressure"),
+    ("heading", "Statistics"),
+    ("field", "pressure_stats"),
+    ("field", "kraken_rssi_stats"),
+    ("chart", "kraken_rssi"),
+    ("field", "central_rssi_stats"),
+    ("chart", "central_rssi"),
+    ("field", "connection_interval_stats"),
+]
+# Session events -> history series they add samples to
+_EVENT_SERIES = {
+    "beacon": ("central_rssi",),
+    "pressure": ("pressure",),
+    "connection_info": ("kraken_rssi", "connection_interval"),
+}
+# Detail fields formatted from the latest decoded connection info dict
+_CONNECTION_INFO_FIELDS = {
+    "kraken_rssi": lambda d: f"Kraken RSSI: {d['kraken_rssi']} dBm",
+    "kraken_current_power": lambda d: f"Kraken Current Power: {d['kraken_current_power']} dB",
+    "kraken_max_power": lambda d: f"Kraken Max Power: {d['kraken_max_power']} dB",
+    "channel_map": lambda d: f"Channel Map: 0x{d['channel_map']:X} ({d['channel_count']} channels available)",
+    "current_channel": lambda d: f"Current Channel: {d['current_channel']}",
+    "connection_interval": lambda d: f"Connection Interval: {d['connection_interval_ms']} ms",
+    "supervision_timeout": lambda d: f"Supervision Timeout: {d['supervision_timeout_ms']} ms",
+    "central_phy": lambda d: f"Central Phy: {d['central_phy']}",
+    "kraken_phy": lambda d: f"Kraken Phy: {d['kraken_phy']}",
+    "last_disconnect_reason": lambda d: f"Last Disconnect Reason: {d['last_disconnect_reason']}",
+    "open_connections": lambda d: f"Open Connections: {d['open_connections']}",
+}
 
 class KrakenWidget:
-    def __init__(self, address, connection_info_csv_logger, csv_event_logger):
+    """
+    Kivy view of a KrakenSession (see python/kraken_session.py): the device
+    tab and its dashboard row. All BLE work and logging stays in the session.
+    """
+    def __init__(self, session, render_scheduler=None, dashboard=None, teardown_hidden=False):
+        # The tab gets this container; the detail view inside it is only built
+        # the first time the tab is selected (see set_visibility)
+        self.container = BoxLayout()
+        self.scroll = None
+        self.layout = None
+        self.teardown_hidden = teardown_hidden
+
+        self.session = session
+        self.address = session.address
+        self.history = session.history
+        self.render_scheduler = render_scheduler
+        self.dashboard = dashboard
+
+        # UI model: callbacks update `fields` (field -> formatted text) and the
+        # labels, when they exist, are only touched in flush_ui()
+        self.fields = {
+            "current_mode": "Current Mode: Beacon",
+            "device_name": "Device Name: ?",
+            "fw_ver": "FW Version: ?",
+            "kraken_rssi": "Kraken RSSI: ?",
+            "kraken_current_power": "Kraken Current Power: ?",
+            "kraken_max_power": "Kraken Max Power: ?",
+            "kraken_phy": "Kraken Phy: ?",
+            "open_connections": "Open Connections: ?",
+            "last_disconnect_reason": "Last Disconnect reason: ?",
+            "central_rssi": "Central RSSI: ?",
+            "central_phy": "Central Phy: ?",
+            "channel_map": "Channel Map: ?",
+            "current_channel": "Current Channel: ?",
+            "connection_interval": "Connection Interval: ?",
+            "supervision_timeout": "Supervision Timeout: ?",
+            "latest_pressure": "Latest Pressure: ?",
+        }
+        # The stats and connection info text is only formatted when a detail
+        # view exists to show it (see flush_ui); until then the latest
+        # connection info dict is kept as it arrived
+        for series in HISTORY_SERIES:
+            self.fields[f"{series}_stats"] = self._format_stats(series)
+        self._stale_stats = set()
+        self._connection_info = None
+        self._stale_connection_info = False
+        self._detail_labels = {}
+        self._charts = []
+        self._pending_detail = set()
+        self.detail_visible = False
+
+        if self.dashboard is not None:
+            self.dashboard.add_device(self.address, history=self.history["pressure"])
+
+        # The session may have been running before this view existed
+        self._on_mode(session.current_mode)
+        if session.name is not None:
+            self._on_identity()
+        if isinstance(session.central_rssi, (int, float)):
+            self._on_beacon(session.central_rssi)
+        session.add_listener(self._on_session_event)
+
+    def build(self):
+        return self.container
+
+
+    # ==========================================================================
+    # UI model
+    # ==========================================================================
+
+    def _set_field(self, field, text):
+        if self.fields.get(field) == text:
+            return
+        self.fields[field] = text
+        if not self._detail_labels:
+            return # Nothing built yet, the labels pick up the model when they are
+
+        self._pending_detail.add(field)
+        self._mark_dirty()
+
+
+    def _history_updated(self, series):
+        if not self._detail_labels:
+            return
+
+        self._stale_stats.add(series)
+        self._mark_dirty()
+
+
+    def _mark_dirty(self):
+        if self.render_scheduler is None:
+            self.flush_ui(force=True)
+        else:
+            self.render_scheduler.mark_dirty(self)
+
+
+    def _format_connection_info(self):
+        for field, format_field in _CONNECTION_INFO_FIELDS.items():
+            text = format_field(self._connection_info)
+            if self.fields[field] != text:
+                self.fields[field] = text
+                self._pending_detail.add(field)
+        self._stale_connection_info = False
+
+
+    def _format_stats(self, series):
+        title, unit = HISTORY_SERIES[series]
+        h = self.history[series]
+        if h.mean is None:
+            return f"{title}: no samples"
+        return (f"{title}: min {h.min:.1f} / max {h.max:.1f} / mean {h.mean:.1f} / std {h.stddev:.2f} "
+                f"/ ewma {h.ewma:.1f} {unit} (last {h.stats()['n']})")
+
+
+    def _update_dashboard(self, **fields):
+        if self.dashboard is not None:
+            self.dashboard.update(self.address, **fields)
+
+
+    def set_visibility(self, detail):
+        self.detail_visible = detail
+        if detail and self.scroll is None:
+            self.show_ui()
+        elif not detail and self.teardown_hidden and self.scroll is not None:
+            self.hide_ui()
+        elif self._pending_detail or self._stale_stats or self._stale_connection_info:
+            if self.render_scheduler is None:
+                self.flush_ui()
+            else:
+                self.render_scheduler.mark_dirty(self)
+
+
+    def flush_ui(self, force=False):
+        """Push changed fields to visible labels, hidden ones stay pending."""
+        if not (self.detail_visible or force):
+            return
+        for series in self._stale_stats:
+            field = f"{series}_stats"
+            self.fields[field] = self._format_stats(series)
+            self._pending_detail.add(field)
+        self._stale_stats.clear()
+        if self._stale_connection_info:
+            self._format_connection_info()
+        for field in self._pending_detail:
+            text = self.fields[field]
+            label = self._detail_labels[field]
+            if label.text != text:
+                label.text = text
+        self._pending_detail.clear()
+        for chart in self._charts:
+            chart.refresh()
+
+
+    def show_ui(self):
+        """Build the detail view from the current model."""
         # Outer container can just be the ScrollView
         self.scroll = ScrollView(size_hint=(1, 1))
 
@@ -31,337 +261,89 @@ class KrakenWidget:
 
         self.scroll.add_widget(self.layout)
 
-        
-        # state
-        self.current_mode = "beacon"
-        self.name = None
-        self.fw_ver = None
-        self.address = address
-        self.central_rssi = '?'
-        self.ble_client = None
-
-        self.connection_info_csv_logger = connection_info_csv_logger
-        self.csv_event_logger = csv_event_logger
-
-        # widgets
-        # Simple function to create consistent label widgets
-        def _create_simple_label_widget(text):
-            lbl = Label(text=text, 
-                        markup=True, 
-                        size_hint=(1, None),
-                        text_size=(None, None),
-                        halign='left',
-                        valign='middle',
-                        font_size='18sp')
-            
-            # Make text wrap to label width and compute height from texture
-            lbl.bind(
-                width=lambda inst, w: setattr(inst, "text_size", (w, None)),
-                texture_size=lambda inst, ts: setattr(inst, "height", max(ts[1], dp(28)))
-            )
-            # initial text_size
-            lbl.text_size = (lbl.width, None)
-
-            return lbl
-
-
-        self.current_mode_label = _create_simple_label_widget(text="Current Mode: Beacon")
-        self.device_name_label = _create_simple_label_widget(text="Device Name: ?")
-        self.fw_ver_label = _create_simple_label_widget(text="FW Version: ?")
-
-        self.kraken_rssi_label = _create_simple_label_widget(text="Kraken RSSI: ?")
-        self.kraken_current_power_label = _create_simple_label_widget(text="Kraken Current Power: ?")
-        self.kraken_max_power_label = _create_simple_label_widget(text="Kraken Max Power: ?")
-        self.kraken_phy_label = _create_simple_label_widget(text="Kraken Phy: ?")
-        self.kraken_open_connection_count_label = _create_simple_label_widget(text="Open Connections: ?")
-        self.kraken_last_disconnect_reason_label = _create_simple_label_widget(text="Last Disconnect reason: ?")
-
-        self.central_rssi_label = _create_simple_label_widget(text="Central RSSI: ?")
-        self.central_phy_label = _create_simple_label_widget(text="Central Phy: ?")
-        
-        self.ble_channel_map_label = _create_simple_label_widget(text="Channel Map: ?")
-        self.ble_current_channel_label = _create_simple_label_widget(text="Current Channel: ?")
-        self.ble_connection_interval_label = _create_simple_label_widget(text="Connection Interval: ?")
-        self.ble_supervision_timeout_label = _create_simple_label_widget(text="Supervision Timeout: ?")
-
-        self.latest_pressure_label = _create_simple_label_widget(text="Latest Pressure: ?")
-
-        self.csv_event_logger.write([self.address, "kraken_widget_created", ""])
-
-        self.dashboard_widget = BoxLayout(
-            orientation="vertical",
-            size_hint_y=None,
-            spacing=dp(6),
-            padding=(dp(10), dp(10))
-        )
-        self.dashboard_widget.bind(minimum_height=self.dashboard_widget.setter("height"))
-        
-        self.dashboard_name_label = _create_simple_label_widget("Name: ?")
-        self.dashboard_widget.add_widget(self.dashboard_name_label)
-        self.dashboard_mode_label = _create_simple_label_widget("Mode: Beacon")
-        self.dashboard_widget.add_widget(self.dashboard_mode_label)
-        self.dashboard_address_label = _create_simple_label_widget(f"Address: {address}")
-        self.dashboard_widget.add_widget(self.dashboard_address_label)
-        self.dashboard_kraken_rssi_label = _create_simple_label_widget("Kraken RSSI: ?")
-        self.dashboard_widget.add_widget(self.dashboard_kraken_rssi_label)
-        self.dashboard_central_rssi_label = _create_simple_label_widget("Central RSSI: ?")
-        self.dashboard_widget.add_widget(self.dashboard_central_rssi_label)
+        for series in HISTORY_SERIES:
+            self.fields[f"{series}_stats"] = self._format_stats(series)
+        self._stale_stats.clear()
+        if self._connection_info is not None:
+            self._format_connection_info()
 
-    def build(self):
-        self.show_ui()
+        # Define the UI layout
+        for kind, value in DETAIL_LAYOUT:
+            if kind == "heading":
+                self.layout.add_widget(_create_simple_heading_widget(value))
+            elif kind == "subheading":
+                self.layout.add_widget(_create_simple_subheading_widget(value))
+            elif kind == "chart":
+                chart = Sparkline(self.history[value], size_hint=(1, None), height=dp(80))
+                self._charts.append(chart)
+                self.layout.add_widget(chart)
+            else:
+                label = _create_simple_label_widget(self.fields[value])
+                self._detail_labels[value] = label
+                self.layout.add_widget(label)
+        self._pending_detail.clear()
 
-        return self.scroll
+        self.container.add_widget(self.scroll)
 
 
-    def get_dashboard_widget(self):
-        return self.dashboard_widget
+    def hide_ui(self):
+        """Drop the detail view widgets, the model is kept for the next show_ui()."""
+        self.container.clear_widgets()
+        self.scroll = None
+        self.layout = None
+        self._detail_labels = {}
+        self._charts = []
+        self._pending_detail.clear()
+        self._stale_stats.clear()
+        self._stale_connection_info = False
 
+    # ==========================================================================
+    # Session events
+    # ==========================================================================
 
-    def show_ui(self):
-        self.layout.clear_widgets()
-
-        def _create_simple_heading_widget(text):
-            lbl = Label(text=f"[b][u]{text}[/u][/b]", 
-                        markup=True, 
-                        size_hint=(1, None),
-                        text_size=(None, None),
-                        halign='left',
-                        valign='middle',
-                        font_size='28sp')
-            
-            # Make text wrap to label width and compute height from texture
-            lbl.bind(
-                width=lambda inst, w: setattr(inst, "text_size", (w, None)),
-                texture_size=lambda inst, ts: setattr(inst, "height", max(ts[1], dp(28)))
-            )
-            # initial text_size
-            lbl.text_size = (lbl.width, None)
-
-            return lbl
-        
-        def _create_simple_subheading_widget(text):
-            lbl = Label(text=f"[b]{text}[/b]", 
-                        markup=True, 
-                        size_hint=(1, None),
-                        text_size=(None, None),
-                        halign='left',
-                        valign='middle',
-                        font_size='22sp')
-            
-            # Make text wrap to label width and compute height from texture
-            lbl.bind(
-                width=lambda inst, w: setattr(inst, "text_size", (w, None)),
-                texture_size=lambda inst, ts: setattr(inst, "height", max(ts[1], dp(28)))
-            )
-            # initial text_size
-            lbl.text_size = (lbl.width, None)
-
-            return lbl
+    def _on_session_event(self, session, event, value):
+        handler = self._event_handlers.get(event)
+        if handler is not None:
+            handler(self, value)
+        for series in _EVENT_SERIES.get(event, ()):
+            self._history_updated(series)
 
-        # Define the UI layout
-        self.layout.add_widget(self.current_mode_label)
-        self.layout.add_widget(self.device_name_label)
-        self.layout.add_widget(self.fw_ver_label)
-
-        self.layout.add_widget(_create_simple_heading_widget("BLE Connection Info"))
-        self.layout.add_widget(_create_simple_subheading_widget("Kraken Side"))
-        self.layout.add_widget(self.kraken_rssi_label)
-        self.layout.add_widget(self.kraken_open_connection_count_label)
-        self.layout.add_widget(self.kraken_phy_label)
-        self.layout.add_widget(self.kraken_current_power_label)
-        self.layout.add_widget(self.kraken_max_power_label)
-        self.layout.add_widget(self.kraken_last_disconnect_reason_label)
-
-        self.layout.add_widget(_create_simple_subheading_widget("Central Side"))
-        self.layout.add_widget(self.central_rssi_label)
-        self.layout.add_widget(self.central_phy_label)
-
-        self.layout.add_widget(_create_simple_subheading_widget("Environment"))
-        self.layout.add_widget(self.ble_channel_map_label)
-        self.layout.add_widget(self.ble_current_channel_label)
-        self.layout.add_widget(self.ble_connection_interval_label)
-        self.layout.add_widget(self.ble_supervision_timeout_label)
-
-        self.layout.add_widget(_create_simple_heading_widget("Standard Data Stream"))
-        self.layout.add_widget(self.latest_pressure_label)
 
-    # ==========================================================================
-    # Callbacks
-    # ==========================================================================
+    def _on_mode(self, mode):
+        self._set_field("current_mode", f"Current Mode: {mode}")
+        self._update_dashboard(mode=mode)
 
-    def process_beacon_data(self, data):
-        # TODO: Get the advertised name and populate thiss
-        self.central_rssi = data['rssi']
-        self.central_rssi_label.text = f"Central RSSI: {self.central_rssi} dBm"
-        self.dashboard_central_rssi_label.text = f"Central RSSI: {self.central_rssi} dBm"
 
+    def _on_identity(self, value=None):
+        self._set_field("device_name", f"Device Name: {self.session.name}")
+        self._set_field("fw_ver", f"FW Version: {self.session.fw_ver}")
+        self._update_dashboard(name=self.session.name)
 
-    def _process_pressure_data_notification(self, sender, data):
-        interpreted_data = PressureData(data)
-        logging.debug(interpreted_data)
-        self.latest_pressure_label.text = f"Latest Pressure: {interpreted_data.pressure} PSI"
 
+    def _on_beacon(self, rssi):
+        self._set_field("central_rssi", f"Central RSSI: {rssi} dBm")
+        self._update_dashboard(central_rssi=rssi)
 
-    def _process_ble_connection_info_notification(self, sender, data):
-        def phy_id_to_desc(id):
-            lookup = {
-                1: "1M",
-                2: "2M",
-                4: "Coded PHY - 125k (S=8) or 500k (S=2)"
-            }
-            if id in lookup.keys():
-                return lookup[id]
-            else:
-                return id
-            
-        # TODO: Check the len matches expectations
-        interpreted_data = {
-            "kraken_rssi": np.frombuffer(data, dtype=np.int8, count=1)[0],
-            "kraken_current_power": np.frombuffer(data, dtype=np.int8, count=2)[1],
-            "kraken_max_power": data[2],
-            "channel_map": (data[3] << (4*8)) | (data[4] << (3*8)) | (data[5] << (2*8)) | (data[6] << (1*8)) | (data[7]),
-            "current_channel": data[8],
-            "connection_interval_ms": ((data [9] << 8) | data[10]) * 1.25,
-            "supervision_timeout_ms": ((data[11] << 8) | data[12]) * 10,
-            "central_phy": phy_id_to_desc(data[13]),
-            "kraken_phy": phy_id_to_desc(data[14]),
-            "last_disconnect_reason": sl_status_to_string((data[15] << 8) | data[16]),
-            "open_connections": data[17]
-        }
-        logging.debug(f"{self.address} BLE connection info -> {interpreted_data}")
-
-        # Do some extra processing to improve UI
-        channel_count = 0
-        working_channel_map = interpreted_data["channel_map"]
-        for i in range(8*5):
-            if working_channel_map & 0x01:
-                channel_count += 1
-            working_channel_map >>= 1
-
-        self.connection_info_csv_logger.write([self.address, 
-                                              self.name,
-                                              interpreted_data['kraken_rssi'],
-                                              interpreted_data['kraken_current_power'],
-                                              interpreted_data['kraken_phy'],
-                                              interpreted_data['open_connections'],
-                                              self.central_rssi, # gathered from beacon data
-                                              interpreted_data['central_phy'],
-                                              f"0x{interpreted_data['channel_map']:X}",
-                                              channel_count,
-                                              interpreted_data['current_channel'],
-                                              interpreted_data['connection_interval_ms'],
-                                              interpreted_data['supervision_timeout_ms']])
-        
-
-        # Update UI
-        self.kraken_rssi_label.text = f"Kraken RSSI: {interpreted_data['kraken_rssi']} dBm"
-        self.kraken_current_power_label.text = f"Kraken Current Power: {interpreted_data['kraken_current_power']} dB"
-        self.kraken_max_power_label.text = f"Kraken Max Power: {interpreted_data['kraken_max_power']} dB"
-        self.ble_channel_map_label.text = f"Channel Map: 0x{interpreted_data['channel_map']:X} ({channel_count} channels available)"
-        self.ble_current_channel_label.text = f"Current Channel: {interpreted_data['current_channel']}"
-        self.ble_connection_interval_label.text = f"Connection Interval: {interpreted_data['connection_interval_ms']} ms"
-        self.ble_supervision_timeout_label.text = f"Supervision Timeout: {interpreted_data['supervision_timeout_ms']} ms"
-        self.central_phy_label.text = f"Central Phy: {interpreted_data['central_phy']}"
-        self.kraken_phy_label.text = f"Kraken Phy: {interpreted_data['kraken_phy']}"
-        self.kraken_last_disconnect_reason_label.text = f"Last Disconnect Reason: {interpreted_data['last_disconnect_reason']}"
-        self.kraken_open_connection_count_label.text = f"Open Connections: {interpreted_data['open_connections']}"
-
-        self.dashboard_kraken_rssi_label.text = f"Kraken RSSI: {interpreted_data['kraken_rssi']} dBm"
-
-
-    def _disconnect_callback(self, client):
-        self.current_mode = "Beacon"
-        self.current_mode_label.text = f"Current Mode: Beacon"
-        self.dashboard_mode_label.text = f"Current Mode: Beacon"
-        self.csv_event_logger.write([self.address, "kraken_disconnected", ""])
 
+    def _on_pressure(self, interpreted_data):
+        self._set_field("latest_pressure", f"Latest Pressure: {interpreted_data.pressure} PSI")
+        self._update_dashboard(pressure=interpreted_data.pressure)
 
-    # ==========================================================================
-    # GATT Helpers
-    # ==========================================================================
-    async def _get_kraken_display_name(self):
-        legacy_kraken_service = self.ble_client.services.get_service(kraken_uuids.KRAKEN_SERVICE_UUID)
-        display_name_char = legacy_kraken_service.get_characteristic(kraken_uuids.KRAKEN_DISPLAY_NAME_CHAR_UUID)
-        return (await self.ble_client.read_gatt_char(display_name_char)).decode('ascii')
-    
-    async def _get_fw_version_number(self):
-        device_info_service = self.ble_client.services.get_service(kraken_uuids.DEVICE_INFO_SERVICE_UUID)
-        fw_ver_char = device_info_service.get_characteristic(kraken_uuids.UUID_FW_REV_CHAR)
-        return (await self.ble_client.read_gatt_char(fw_ver_char)).decode('utf-8').rstrip('\x00')
 
-    # ==========================================================================
-    # Run
-    # ==========================================================================
+    def _on_connection_info(self, interpreted_data):
+        self._update_dashboard(kraken_rssi=interpreted_data['kraken_rssi'])
+        self._connection_info = interpreted_data
+        if not self._detail_labels:
+            return # show_ui() formats the latest one
 
-    async def run(self):
-        if not self.ble_client:
-            logging.info(f"Attempting to connect to Kraken {self.address}")
-            try:
-                self.ble_client = BleakClient(self.address, disconnect_callback=self._disconnect_callback)
-                await self.ble_client.connect()
-                logging.info(f"Connected to Kraken {self.address}, enabling notifications")
-                self.csv_event_logger.write([self.address, "kraken_connected", ""])
-                self.current_mode = "Connected"
-                self.current_mode_label.text = f"Current Mode: Connected"
-                self.dashboard_mode_label.text = f"Current Mode: Connected"
-
-                self.name = await self._get_kraken_display_name()
-                self.fw_ver = await self._get_fw_version_number()
-                self.device_name_label.text = f"Device Name: {self.name}"
-                self.dashboard_name_label.text = f"Device Name: {self.name}"
-                self.fw_ver_label.text = f"FW Version: {self.fw_ver}"
-
-                if self.ble_client.services.get_characteristic(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID):
-                    logging.info(f"Subscribing to BLE connection info notifications for Kraken {self.address}")
-                    await self.ble_client.start_notify(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID, self._process_ble_connection_info_notification)
-                else:
-                    logging.warning(f"Kraken {self.address} does not support BLE connection info notifications")
-                
-                logging.info(f"Enable standard pressure notifications for Kraken {self.address}")
-                await self.ble_client.start_notify(kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID, self._process_pressure_data_notification)
-            except Exception as e:
-                logging.warning(f"Failed to connect to Kraken {self.address} ({e})")
-
-
-# ==============================================================================
-# Other Helpers
-# ==============================================================================
-
-class PressureData:
-    def __init__(self, notification_data):
-        self._notification_data = notification_data
-
-        kraken_index = 0
-        self.name = self.bin2string(notification_data[kraken_index:kraken_index + 16], 16)
-        self.pressure = self.reading_to_psi(notification_data[kraken_index + 16:kraken_index + 21])
-        self.address = ':'.join(hex(ord(chr(b)))[2:].upper() for b in notification_data[kraken_index + 21:kraken_index + 27])
-        self.battery = self.get_battery_reading(notification_data[kraken_index + 27])
-        self.scanner_tick = notification_data[kraken_index + 28]
-        if len(notification_data) > 29:
-            self.charging_state = notification_data[kraken_index + 29]
-        else:
-            self.charging_state = None
-
-    def bin2string(self, byte_array, length):
-        result = ''
-        for i in range(length):
-            if byte_array[i] == 0:
-                break
-            result += chr(byte_array[i])
-        return result
-
-    def bytes_to_string(self, byte_array):
-        return ''.join(chr(b) for b in byte_array)
-
-    def reading_to_psi(self, byte_array):
-        try:
-            return int(byte_array.decode('utf-8').rstrip('\x00'))/10
-        except:
-            # simply return the string as a backup (could indicate error state)
-            return byte_array.decode('utf-8')
-
-    def get_battery_reading(self, value):
-        if value == 255:
-            return "Charging.."
-        else:
-            return f"{value}%"
\ No newline at end of file
+        self._stale_connection_info = True
+        self._mark_dirty()
+
+
+    _event_handlers = {
+        "mode": _on_mode,
+        "identity": _on_identity,
+        "beacon": _on_beacon,
+        "pressure": _on_pressure,
+        "connection_info": _on_connection_info,
+    }
@@ -0,0 +1,169 @@
+"""
+Load-generation harness for the Kraken pipeline, driven by the simulated BLE
+backend so it runs on a plain Linux box with no radio.
+
+    python -m python.load_harness --devices 1 10 100 500 --duration 10
+
+For each fleet size every simulated Kraken is connected through a
+KrakenSession (via the ConnectionScheduler) and streams notifications for
+`--duration` seconds. Nothing here imports Kivy: the BLE path is measured on
+its own. Reported per run:
+
+  * fleet bring-up time and connect latency percentiles
+  * notifications/s offered by the simulated fleet and handled by the
+    sessions (counted in KrakenSession, which decodes, logs and updates the
+    model inline); a gap between the two is a backlog or drops
+  * CPU use of this process (% of one core)
+  * frame time: the actual period of a 60 Hz tick on the same asyncio loop,
+    i.e. how late a frame of the app would be
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import python.ble_backend as ble_backend
+from python import csv_log
+from python.connection_scheduler import ConnectionScheduler
+from python.sim_kraken import SimulatedFleet
+
+FRAME_PERIOD_SECONDS = 1 / 60
+
+
+class _ModelUpdates:
+    """
+    Session listener standing in for the app's views: like the
+    RenderScheduler it only notes which sessions changed, and flush() picks
+    them up once per UI frame.
+    """
+    def __init__(self, rate_hz):
+        self.rate_hz = rate_hz
+        self._dirty = set()
+        self.updates = 0
+
+    def __call__(self, session, event, value):
+        self._dirty.add(session)
+
+    def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        self.updates += len(dirty)
+
+
+async def _measure_frames(frame_times, stop_event, model_updates):
+    loop = asyncio.get_running_loop()
+    last = loop.time()
+    frames_per_render = max(1, round(1 / (FRAME_PERIOD_SECONDS * model_updates.rate_hz)))
+    frame = 0
+    while not stop_event.is_set():
+        await asyncio.sleep(FRAME_PERIOD_SECONDS)
+        frame += 1
+        # Stand-in for the Clock tick that drives the RenderScheduler in the app
+        if frame % frames_per_render == 0:
+            model_updates.flush()
+        now = loop.time()
+        frame_times.append(now - last)
+        last = now
+
+
+async def run_load(device_count, duration_seconds, pressure_rate_hz, connection_info_rate_hz,
+                   mean_seconds_between_disconnects, connect_latency_seconds, max_in_flight, ui_rate_hz, out_dir):
+    from python.kraken_session import KrakenSession
+
+    fleet = SimulatedFleet(device_count,
+                           pressure_rate_hz=pressure_rate_hz,
+                           connection_info_rate_hz=connection_info_rate_hz,
+                           mean_seconds_between_disconnects=mean_seconds_between_disconnects,
+                           connect_latency_seconds=connect_latency_seconds)
+    fleet.install()
+    try:
+        info_logger = csv_log.CSVLogger(["address", "name", "kraken_rssi", "kraken_power", "kraken_phy", "connection_count", "central_rssi", "central_phy", "channel_map", "available_channels", "current_channel", "connection_interval_ms", "supervision_timeout_ms"],
+                                        os.path.join(out_dir, f"LoadBleConnectionData_{device_count}.csv"))
+        event_logger = csv_log.CSVLogger(["source", "event", "notes"],
+                                         os.path.join(out_dir, f"LoadEventLog_{device_count}.csv"))
+
+        model_updates = _ModelUpdates(ui_rate_hz)
+        sessions = [KrakenSession(address, info_logger, event_logger) for address in fleet.devices]
+        for session in sessions:
+            session.add_listener(model_updates)
+        scheduler = ConnectionScheduler(max_in_flight=max_in_flight)
+        scheduler.start()
+        bring_up_start = time.perf_counter()
+        for s in sessions:
+            scheduler.submit(s.address, s.run, priority=s.connection_priority())
+        await scheduler.wait_idle()
+        bring_up_seconds = time.perf_counter() - bring_up_start
+        connect_latency = scheduler.latency_percentiles()
+        await scheduler.stop()
+
+        frame_times = []
+        stop_event = asyncio.Event()
+        frame_task = asyncio.create_task(_measure_frames(frame_times, stop_event, model_updates))
+
+        sent_before = fleet.notifications_sent
+        handled_before = sum(s.notifications for s in sessions)
+        cpu_before = time.process_time()
+        wall_before = time.perf_counter()
+        await asyncio.sleep(duration_seconds)
+        wall = time.perf_counter() - wall_before
+        cpu = time.process_time() - cpu_before
+        sent = fleet.notifications_sent - sent_before
+        handled = sum(s.notifications for s in sessions) - handled_before
+
+        stop_event.set()
+        await frame_task
+        for s in sessions:
+            await s.disconnect()
+    finally:
+        ble_backend.reset_backend()
+
+    frame_times.sort()
+    return {
+        "devices": device_count,
+        "bring_up_s": bring_up_seconds,
+        "connect_ms_p50": connect_latency[50],
+        "connect_ms_p99": connect_latency[99],
+        "sent_per_s": sent / wall,
+        "handled_per_s": handled / wall,
+        "cpu_percent": 100 * cpu / wall,
+        "frame_ms_mean": 1000 * statistics.fmean(frame_times) if frame_times else float('nan'),
+        "frame_ms_p99": 1000 * frame_times[int(0.99 * (len(frame_times) - 1))] if frame_times else float('nan'),
+        "frame_ms_max": 1000 * frame_times[-1] if frame_times else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Kraken load harness")
+    parser.add_argument("--devices", type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument("--duration", type=float, default=10, help="seconds to stream per fleet size")
+    parser.add_argument("--pressure-rate", type=float, default=10, help="pressure notifications/s per device")
+    parser.add_argument("--info-rate", type=float, default=1, help="connection info notifications/s per device")
+    parser.add_argument("--disconnect-every", type=float, default=None,
+                        help="mean seconds between injected disconnects per device")
+    parser.add_argument("--connect-latency", type=float, default=0.5, help="simulated seconds per connect")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="concurrent connection attempts")
+    parser.add_argument("--ui-rate", type=float, default=10, help="UI refresh rate in Hz")
+    parser.add_argument("--out-dir", default=None, help="where to put the CSV output (default: temp dir)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix="kraken_load_")
+    os.makedirs(out_dir, exist_ok=True)
+
+    print(f"{'devices':>8} {'bring-up s':>10} {'conn p50':>9} {'conn p99':>9} {'sent/s':>10} {'handled/s':>10} {'cpu %':>7} {'frame ms':>9} {'p99 ms':>8} {'max ms':>8}")
+    for n in args.devices:
+        result = asyncio.run(run_load(n, args.duration, args.pressure_rate, args.info_rate,
+                                      args.disconnect_every, args.connect_latency, args.max_in_flight, args.ui_rate, out_dir))
+        # No percentiles when nothing connected
+        p50, p99 = (f"{ms:.0f}" if ms is not None else "-" for ms in (result['connect_ms_p50'], result['connect_ms_p99']))
+        print(f"{result['devices']:>8} {result['bring_up_s']:>10.2f} {p50:>9} {p99:>9} "
+              f"{result['sent_per_s']:>10.0f} {result['handled_per_s']:>10.0f} {result['cpu_percent']:>7.1f} "
+              f"{result['frame_ms_mean']:>9.2f} {result['frame_ms_p99']:>8.2f} {result['frame_ms_max']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Offline per-device analytics over the CSV logs in the data directory.
+
+    python -m python.log_analytics Data/ -o summary.json --workers 8
+
+Every KrakenBleConnectionData_*.csv and KrakenEventLog_*.csv file is handled
+by a worker process, which streams it in chunks of `--chunk-rows` rows and
+folds them into fixed-size per-device accumulators (DeviceSummary). The
+parent merges those as files finish, so memory depends on the number of
+devices, not on how much log there is.
+
+Per device the summary has the Kraken/central RSSI and TX power
+distributions, the PHY mix, connection-interval stats, connect/disconnect
+counts and time between disconnects. Gaps between disconnects are only
+measured within one event log (one app session).
+"""
+
+import csv
+import glob
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+CONNECTION_DATA_PATTERN = "KrakenBleConnectionData_*.csv"
+EVENT_LOG_PATTERN = "KrakenEventLog_*.csv"
+
+# Signed 8-bit range covers RSSI and TX power
+INT8_MIN = -128
+INT8_BINS = 256
+
+DEFAULT_CHUNK_ROWS = 20000
+
+# ==============================================================================
+# Accumulators
+# ==============================================================================
+
+class RunningStats:
+    """count/mean/std/min/max that can be merged across files."""
+    __slots__ = ("n", "total", "total_sq", "min", "max")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add_totals(self, n, total, total_sq, minimum, maximum):
+        self.n += n
+        self.total += total
+        self.total_sq += total_sq
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def add(self, value):
+        self.n += 1
+        self.total += value
+        self.total_sq += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        if not self.n:
+            return None
+        mean = self.total / self.n
+        return {
+            "n": self.n,
+            "mean": round(mean, 3),
+            "std": round(math.sqrt(max(self.total_sq / self.n - mean * mean, 0.0)), 3),
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+def _histogram_summary(hist):
+    n = int(hist.sum())
+    if not n:
+        return None
+    values = np.arange(INT8_MIN, INT8_MIN + INT8_BINS)
+    cdf = np.cumsum(hist)
+    percentile = lambda p: int(values[np.searchsorted(cdf, p / 100 * n)])
+    present = np.flatnonzero(hist)
+    return {
+        "n": n,
+        "mean": round(float((values * hist).sum() / n), 2),
+        "min": int(values[present[0]]),
+        "p5": percentile(5),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "max": int(values[present[-1]]),
+        "histogram": {int(values[i]): int(hist[i]) for i in present},
+    }
+
+
+class DeviceSummary:
+    def __init__(self):
+        self.name = None
+        self.samples = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.kraken_rssi = np.zeros(INT8_BINS, dtype=np.int64)
+        self.central_rssi = np.zeros(INT8_BINS, dtype=np.int64)
+        self.tx_power = np.zeros(INT8_BINS, dtype=np.int64)
+        self.kraken_phy = Counter()
+        self.central_phy = Counter()
+        self.connection_interval = RunningStats()
+        self.connection_intervals = Counter() # only a handful of distinct values in practice
+        self.connects = 0
+        self.disconnects = 0
+        self.disconnect_gaps = RunningStats()
+
+    def _seen(self, first, last):
+        if self.first_seen is None or first < self.first_seen:
+            self.first_seen = first
+        if self.last_seen is None or last > self.last_seen:
+            self.last_seen = last
+
+    def merge(self, other):
+        self.name = other.name or self.name
+        self.samples += other.samples
+        if other.first_seen is not None:
+            self._seen(other.first_seen, other.last_seen)
+        self.kraken_rssi += other.kraken_rssi
+        self.central_rssi += other.central_rssi
+        self.tx_power += other.tx_power
+        self.kraken_phy.update(other.kraken_phy)
+        self.central_phy.update(other.central_phy)
+        self.connection_interval.merge(other.connection_interval)
+        self.connection_intervals.update(other.connection_intervals)
+        self.connects += other.connects
+        self.disconnects += other.disconnects
+        self.disconnect_gaps.merge(other.disconnect_gaps)
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "samples": self.samples,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "kraken_rssi_dbm": _histogram_summary(self.kraken_rssi),
+            "central_rssi_dbm": _histogram_summary(self.central_rssi),
+            "kraken_tx_power_db": _histogram_summary(self.tx_power),
+            "kraken_phy": dict(self.kraken_phy),
+            "central_phy": dict(self.central_phy),
+            "connection_interval_ms": dict(self.connection_interval.summary() or {},
+                                           values={str(k): v for k, v in sorted(self.connection_intervals.items())})
+                                      if self.connection_interval.n else None,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "seconds_between_disconnects": self.disconnect_gaps.summary(),
+        }
+
+# ==============================================================================
+# Per-file workers
+# ==============================================================================
+
+def _iter_chunks(csv_file, chunk_rows):
+    """Yield (header, rows) chunks. Repeated header lines (appended sessions) are skipped."""
+    with open(csv_file, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        rows = []
+        for row in reader:
+            if row == header or len(row) != len(header):
+                continue
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield header, rows
+                rows = []
+        if rows:
+            yield header, rows
+
+
+def _numeric_column(column, dtype):
+    """Parse a column of strings, returning (values, valid mask). '?' etc. are invalid."""
+    strings = np.array(column)
+    valid = (strings != '?') & (strings != '')
+    values = np.zeros(len(strings), dtype=dtype)
+    try:
+        values[valid] = strings[valid].astype(dtype)
+        return values, valid
+    except ValueError:
+        pass
+    # Slow path for anything else that doesn't parse
+    for i in np.flatnonzero(valid):
+        try:
+            values[i] = float(strings[i])
+        except ValueError:
+            valid[i] = False
+    return values, valid
+
+
+def _int8_histograms(device_index, column, device_count):
+    """One INT8_BINS histogram per device in a single bincount."""
+    values, valid = _numeric_column(column, np.int64)
+    bins = np.clip(values[valid], INT8_MIN, INT8_MIN + INT8_BINS - 1) - INT8_MIN
+    flat = np.bincount(device_index[valid] * INT8_BINS + bins, minlength=device_count * INT8_BINS)
+    return flat.reshape(device_count, INT8_BINS)
+
+
+def summarize_connection_data(csv_file, chunk_rows=DEFAULT_CHUNK_ROWS):
+    devices = {}
+    for header, rows in _iter_chunks(csv_file, chunk_rows):
+        col = {name: i for i, name in enumerate(header)}
+        if "address" not in col:
+            logging.warning(f"{csv_file} has no address column, skipping it")
+            return devices
+
+        # Work column-wise on the whole chunk, with every row tagged by device
+        columns = list(zip(*rows))
+        column = lambda name: columns[col[name]] if name in col else None
+        address_column = column("address")
+        addresses, first_index, device_index = np.unique(np.array(address_column), return_index=True, return_inverse=True)
+        count = len(addresses)
+        last_index = len(rows) - 1 - np.unique(np.array(address_column[::-1]), return_index=True)[1]
+        chunk_devices = [devices.setdefault(str(a), DeviceSummary()) for a in addresses]
+        samples = np.bincount(device_index, minlength=count)
+
+        histograms = {}
+        for attr, name in (("kraken_rssi", "kraken_rssi"), ("central_rssi", "central_rssi"), ("tx_power", "kraken_power")):
+            if name in col:
+                histograms[attr] = _int8_histograms(device_index, column(name), count)
+
+        intervals = None
+        if "connection_interval_ms" in col:
+            values, valid = _numeric_column(column("connection_interval_ms"), np.float64)
+            owner, values = device_index[valid], values[valid]
+            minimum = np.full(count, np.inf)
+            maximum = np.full(count, -np.inf)
+            np.minimum.at(minimum, owner, values)
+            np.maximum.at(maximum, owner, values)
+            intervals = (np.bincount(owner, minlength=count),
+                         np.bincount(owner, weights=values, minlength=count),
+                         np.bincount(owner, weights=values * values, minlength=count),
+                         minimum, maximum)
+            for (i, value), n in Counter(zip(owner.tolist(), values.tolist())).items():
+                chunk_devices[i].connection_intervals[value] += n
+
+        for i, device in enumerate(chunk_devices):
+            device.samples += int(samples[i])
+            if "Timestamp" in col:
+                # Rows are written in time order
+                device._seen(column("Timestamp")[first_index[i]], column("Timestamp")[last_index[i]])
+            if "name" in col:
+                name = column("name")[last_index[i]]
+                if name and name != "None":
+                    device.name = name
+            for attr, hist in histograms.items():
+                getattr(device, attr)[:] += hist[i]
+            if intervals is not None and intervals[0][i]:
+                n, total, total_sq, minimum, maximum = (a[i] for a in intervals)
+                device.connection_interval.add_totals(int(n), float(total), float(total_sq), float(minimum), float(maximum))
+
+        for attr, name in (("kraken_phy", "kraken_phy"), ("central_phy", "central_phy")):
+            if name in col:
+                for (address, phy), n in Counter(zip(address_column, column(name))).items():
+                    getattr(devices[address], attr)[phy] += n
+    return devices
+
+
+def _parse_timestamp(text):
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+def summarize_event_log(csv_file, chunk_rows=DEFAULT_CHUNK_ROWS):
+    devices = {}
+    last_disconnect = {}
+    for header, rows in _iter_chunks(csv_file, chunk_rows):
+        col = {name: i for i, name in enumerate(header)}
+        if not {"Timestamp", "source", "event"} <= col.keys():
+            logging.warning(f"{csv_file} is not an event log, skipping it")
+            return devices
+        ts_i, source_i, event_i = col["Timestamp"], col["source"], col["event"]
+        for row in rows:
+            event = row[event_i]
+            if event == "kraken_connected":
+                devices.setdefault(row[source_i], DeviceSummary()).connects += 1
+            elif event == "kraken_disconnected":
+                address = row[source_i]
+                device = devices.setdefault(address, DeviceSummary())
+                device.disconnects += 1
+                timestamp = _parse_timestamp(row[ts_i])
+                if timestamp is None:
+                    continue
+                previous = last_disconnect.get(address)
+                if previous is not None and timestamp >= previous:
+                    device.disconnect_gaps.add(timestamp - previous)
+                last_disconnect[address] = timestamp
+    return devices
+
+
+def summarize_file(csv_file, chunk_rows=DEFAULT_CHUNK_ROWS):
+    if os.path.basename(csv_file).startswith("KrakenEventLog_"):
+        return csv_file, summarize_event_log(csv_file, chunk_rows)
+    return csv_file, summarize_connection_data(csv_file, chunk_rows)
+
+# ==============================================================================
+# Driver
+# ==============================================================================
+
+def find_logs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, CONNECTION_DATA_PATTERN))
+            files += glob.glob(os.path.join(path, EVENT_LOG_PATTERN))
+        else:
+            files.append(path)
+    # Largest first so one big file doesn't end up last on a single worker
+    return sorted(set(files), key=lambda f: os.path.getsize(f), reverse=True)
+
+
+def analyze(files, workers=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Summarize `files` on a process pool. Returns (devices, failed files)."""
+    devices = {}
+    failed = []
+
+    def merge(file_devices):
+        for address, partial in file_devices.items():
+            devices.setdefault(address, DeviceSummary()).merge(partial)
+
+    if workers == 1:
+        for csv_file in files:
+            merge(summarize_file(csv_file, chunk_rows)[1])
+        return devices, failed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(summarize_file, csv_file, chunk_rows): csv_file for csv_file in files}
+        for future in as_completed(futures):
+            try:
+                _, file_devices = future.result()
+            except Exception as e:
+                logging.warning(f"Failed to summarize {futures[future]} ({e})")
+                failed.append(futures[future])
+                continue
+            merge(file_devices)
+    return devices, failed
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize Kraken CSV logs per device")
+    parser.add_argument("paths", nargs="+", help="log files or directories (e.g. Data/)")
+    parser.add_argument("-o", "--output", default="kraken_summary.json")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count, 1 = no pool)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    files = find_logs(args.paths)
+    start = time.perf_counter()
+    devices, failed = analyze(files, args.workers, args.chunk_rows)
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "generated": datetime.now().isoformat(timespec='seconds'),
+        "files": len(files),
+        "failed_files": failed,
+        "devices": {address: devices[address].summary() for address in sorted(devices)},
+    }
+    with open(args.output, mode='w') as file:
+        json.dump(summary, file, separators=(',', ':'))
+    logging.info(f"Summarized {len(files)} files, {len(devices)} devices in {elapsed:.2f} s -> {args.output}")
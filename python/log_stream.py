@@ -0,0 +1,306 @@
+"""
+Capture of the on-device logging service (LOGGING_SERVICE_UUID) to disk.
+
+A LogStream unlocks the service by writing the password to
+LOGGING_PASSWORD_CHAR_UUID, subscribes to LOGGING_STREAM_CHAR_UUID and
+appends the raw notification bytes to one file per device:
+
+    <out dir>/KrakenLog_<address>_<stamp>.log
+
+The notification callback does nothing but copy the chunk into a
+preallocated buffer. Full buffers are handed to a single writer thread
+shared by every stream and come back empty once they are on disk, so the
+event loop never decodes, splits or writes anything. If a stream's buffers
+are all still waiting for the disk, new chunks are dropped and counted in
+`lost_bytes` instead of blocking the BLE callbacks.
+
+Lines are only found and decoded when the file is read, by LogView:
+
+    python -m python.log_stream view KrakenLog_C0DE00000001_20250101_120000.log --tail 50
+    python -m python.log_stream bench --devices 25 --rate 400 --duration 10
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import python.kraken_uuids as kraken_uuids
+from python import metrics
+
+LOG_STREAM_BYTES = metrics.counter("kraken_log_stream_bytes_total", "Log stream bytes received from Krakens")
+LOG_STREAM_LOST_BYTES = metrics.counter("kraken_log_stream_lost_bytes_total",
+                                        "Log stream bytes dropped because the disk fell behind")
+LOG_STREAM_WRITE_SECONDS = metrics.histogram("kraken_log_stream_write_seconds", "Time to write one log stream buffer")
+
+# Largest ATT notification payload (MTU 515), so one chunk always fits a buffer
+MAX_CHUNK = 512
+
+
+class LogStream:
+    """
+    One Kraken's log stream. `buffer_count` buffers of `buffer_size` bytes are
+    allocated up front; at 244 byte chunks a 64 KiB buffer holds ~270
+    notifications.
+    """
+    def __init__(self, address, path, password, buffer_size=64 * 1024, buffer_count=8):
+        if buffer_size < MAX_CHUNK:
+            raise ValueError(f"buffer_size must be at least {MAX_CHUNK} bytes")
+        self.address = address
+        self.path = path
+        self.password = password
+        self.buffer_size = buffer_size
+
+        self._buffer = bytearray(buffer_size)
+        self._fill = 0
+        self._free = deque(bytearray(buffer_size) for _ in range(buffer_count - 1)) # returned by the writer thread
+        self._file = open(path, mode='ab')
+        self._closed = threading.Event()
+        self.client = None
+
+        self.notifications = 0
+        self.received_bytes = 0
+        self.lost_bytes = 0
+        # Updated by the writer thread only
+        self.written_bytes = 0
+        self.write_errors = 0
+
+    # ==========================================================================
+    # BLE side (event loop)
+    # ==========================================================================
+
+    async def start(self, client):
+        """Unlock the logging service on a connected client and subscribe to the stream."""
+        await client.write_gatt_char(kraken_uuids.LOGGING_PASSWORD_CHAR_UUID, self.password.encode('utf-8'), response=True)
+        await client.start_notify(kraken_uuids.LOGGING_STREAM_CHAR_UUID, self.on_notification)
+        self.client = client
+
+    async def stop(self):
+        client, self.client = self.client, None
+        if client is not None and client.is_connected:
+            try:
+                await client.stop_notify(kraken_uuids.LOGGING_STREAM_CHAR_UUID)
+            except Exception as e:
+                logging.debug(f"Ignoring error while stopping the log stream of Kraken {self.address} ({e})")
+
+    def on_notification(self, sender, data):
+        n = len(data)
+        self.notifications += 1
+        self.received_bytes += n
+        LOG_STREAM_BYTES.inc(n)
+        if self._fill + n > self.buffer_size and not self._hand_off():
+            self.lost_bytes += n
+            LOG_STREAM_LOST_BYTES.inc(n)
+            return
+        self._buffer[self._fill:self._fill + n] = data
+        self._fill += n
+
+    def _hand_off(self):
+        """Queue the current buffer for the disk and continue in a free one. False if none is free."""
+        if not self._free:
+            return False
+        _WRITER.submit(self, self._buffer, self._fill)
+        self._buffer = self._free.popleft()
+        self._fill = 0
+        return True
+
+    def flush(self):
+        """Queue what the current buffer holds, so slow streams still reach the disk regularly."""
+        if self._fill:
+            self._hand_off()
+
+    def close(self, timeout_seconds=10):
+        if self._closed.is_set():
+            return
+        if self._fill:
+            _WRITER.submit(self, self._buffer, self._fill) # closing, no need for a free buffer to continue in
+            self._fill = 0
+        _WRITER.submit(self, None, 0)
+        if not self._closed.wait(timeout_seconds):
+            logging.warning(f"Log stream file {self.path} did not close within {timeout_seconds} s")
+        if self.lost_bytes:
+            logging.warning(f"Log stream of Kraken {self.address} lost {self.lost_bytes} bytes")
+
+    def stats(self):
+        return {
+            "notifications": self.notifications,
+            "received_bytes": self.received_bytes,
+            "written_bytes": self.written_bytes,
+            "lost_bytes": self.lost_bytes,
+            "write_errors": self.write_errors,
+        }
+
+
+class _DiskWriter:
+    """The one thread that writes every LogStream's buffers, started on first use."""
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, stream, buffer, length):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="LogStreamWriter", daemon=True)
+                    self._thread.start()
+        self._queue.put((stream, buffer, length))
+
+    def _run(self):
+        while True:
+            stream, buffer, length = self._queue.get()
+            if buffer is None:
+                stream._file.close()
+                stream._closed.set()
+                continue
+            start = time.perf_counter()
+            try:
+                with memoryview(buffer) as view:
+                    stream._file.write(view[:length])
+                stream._file.flush()
+                stream.written_bytes += length
+            except (OSError, ValueError) as e:
+                stream.write_errors += 1
+                logging.warning(f"Could not write the log stream of Kraken {stream.address} ({e})")
+            LOG_STREAM_WRITE_SECONDS.observe(time.perf_counter() - start)
+            stream._free.append(buffer)
+
+
+_WRITER = _DiskWriter()
+
+# ==============================================================================
+# Viewer
+# ==============================================================================
+
+class LogView:
+    """
+    Lines of a captured log stream file. The file is memory mapped, line
+    boundaries are found in one vectorized pass and a line is only decoded
+    when it is accessed.
+    """
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self._file = open(path, mode='rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        newlines = np.flatnonzero(np.frombuffer(self._data, dtype=np.uint8) == 0x0A)
+        self._starts = np.concatenate(([0], newlines + 1))
+        self._ends = np.concatenate((newlines, [size]))
+        if size and self._starts[-1] == size:
+            # Ends with a newline: no partial last line
+            self._starts, self._ends = self._starts[:-1], self._ends[:-1]
+        elif not size:
+            self._starts, self._ends = self._starts[:0], self._ends[:0]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def line(self, index):
+        return (self._data[self._starts[index]:self._ends[index]]
+                .decode(self.encoding, errors='replace').rstrip("\r"))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.line(i) for i in range(*index.indices(len(self)))]
+        return self.line(index)
+
+    def __iter__(self):
+        return (self.line(i) for i in range(len(self)))
+
+    def grep(self, pattern):
+        """Indices of the lines matching the regex `pattern`, searched in the raw bytes."""
+        regex = re.compile(pattern.encode(self.encoding) if isinstance(pattern, str) else pattern)
+        offsets = [match.start() for match in regex.finditer(self._data)]
+        indices = np.searchsorted(self._starts, offsets, side='right') - 1
+        return list(dict.fromkeys(indices.tolist())) # one entry per line, in order
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+# ==============================================================================
+# Command line
+# ==============================================================================
+
+def _view(args):
+    view = LogView(args.file)
+    try:
+        indices = view.grep(args.grep) if args.grep else range(len(view))
+        if args.tail:
+            indices = indices[-args.tail:]
+        for i in indices:
+            print(view.line(i))
+    finally:
+        view.close()
+
+
+async def _bench(args):
+    import tempfile
+
+    from python.kraken_core import KrakenCore
+    from python.sim_kraken import SimulatedFleet
+
+    fleet = SimulatedFleet(args.devices, log_rate_hz=args.rate, logging_password="bench")
+    fleet.install()
+    out_dir = tempfile.mkdtemp(prefix="kraken_log_stream_")
+    core = KrakenCore(out_dir, max_in_flight=8, log_streams="all", log_password="bench")
+
+    async def stop_later():
+        await asyncio.sleep(args.duration)
+        core.stop()
+
+    asyncio.create_task(stop_later())
+    start = time.perf_counter()
+    await core.run()
+    elapsed = time.perf_counter() - start
+    core.close()
+
+    streams = core.log_streams.values()
+    received = sum(s.received_bytes for s in streams)
+    written = sum(s.written_bytes for s in streams)
+    lost = sum(s.lost_bytes for s in streams)
+    on_disk = sum(os.path.getsize(s.path) for s in streams)
+    lines = 0
+    for s in streams:
+        view = LogView(s.path)
+        lines += len(view)
+        view.close()
+    print(f"{len(streams)} streams, {sum(s.notifications for s in streams)} notifications, "
+          f"{received / 1e6:.1f} MB received ({received / elapsed / 1e6:.2f} MB/s over {elapsed:.1f} s)")
+    print(f"devices sent {sum(d.log_bytes_sent for d in fleet.devices.values())} bytes, received {received}, "
+          f"written {written}, on disk {on_disk}, lost {lost}; {lines} lines in {out_dir}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Kraken log stream files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    view = commands.add_parser("view", help="print the lines of a log stream file")
+    view.add_argument("file")
+    view.add_argument("--tail", type=int, default=None, help="only the last N (matching) lines")
+    view.add_argument("--grep", default=None, help="only lines matching this regular expression")
+    bench = commands.add_parser("bench", help="stream from simulated Krakens and check nothing is lost")
+    bench.add_argument("--devices", type=int, default=25)
+    bench.add_argument("--rate", type=float, default=400, help="log notifications per second per device")
+    bench.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.command == "view":
+        _view(args)
+    else:
+        logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+        asyncio.run(_bench(args))
+
+
+if __name__ == "__main__":
+    main()
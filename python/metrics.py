@@ -0,0 +1,273 @@
+"""
+In-process metrics: counters, gauges and latency histograms for the hot
+paths (scanning, connecting, decoding, CSV writes, UI frames), cheap enough
+to leave on in production.
+
+Instruments are registered once at import time of the module that uses them
+and updated with plain attribute arithmetic, no locks and no allocation:
+
+    DECODE_SECONDS = metrics.histogram("kraken_decode_seconds", "Notification decode time", labels=("characteristic",))
+    PRESSURE_DECODE = DECODE_SECONDS.labels("pressure")
+    ...
+    start = time.perf_counter()
+    decode(data)
+    PRESSURE_DECODE.observe(time.perf_counter() - start)
+
+Updates happen on the asyncio thread, except for the per-file CSV batch
+histograms and the log stream write histogram, which each belong to one
+writer thread, so the GIL is all the synchronisation needed.
+
+The registry renders the Prometheus text exposition format, either to a file
+(for node_exporter's textfile collector) or over a minimal HTTP endpoint:
+
+    KRAKEN_METRICS_FILE=/var/lib/node_exporter/kraken.prom
+    KRAKEN_METRICS_PORT=9464
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds, 5 us to 30 s: covers per-packet decode at the low end
+# and connection setup at the high end
+DEFAULT_LATENCY_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                           1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0)
+
+# ==============================================================================
+# Instruments
+# ==============================================================================
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """A value that is set, or read from `fn` when collected."""
+    __slots__ = ("value", "fn")
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+
+class Histogram:
+    """Fixed-bucket histogram: observe() is one bisect and three additions."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=DEFAULT_LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0..1) by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower # above the largest bound, all we know is the lower edge
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.bounds[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+# ==============================================================================
+# Registry
+# ==============================================================================
+
+class Metric:
+    """
+    A named instrument family. Without labels it proxies the single child, so
+    `metric.inc()` / `metric.observe()` work directly; with labels, use
+    `metric.labels(value, ...)` once and keep the child.
+    """
+    def __init__(self, kind, name, help_text, labels=(), factory=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._factory = factory
+        self.children = {}
+        if not self.label_names:
+            self._single = self.children[()] = factory()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self.children[key] = self._factory()
+        return child
+
+    def remove(self, *values):
+        self.children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, attr):
+        # Unlabelled metric: forward inc/set/observe/time/value/... to the only child
+        single = self.__dict__.get("_single")
+        if single is None:
+            raise AttributeError(attr)
+        value = getattr(single, attr)
+        if callable(value):
+            self.__dict__[attr] = value # bound method: cache it, later calls skip __getattr__
+        return value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, kind, name, help_text, labels, factory):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Metric(kind, name, help_text, labels, factory)
+        elif metric.kind != kind or metric.label_names != tuple(labels):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind} with labels {metric.label_names}")
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register("counter", name, help_text, labels, Counter)
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        metric = self._register("gauge", name, help_text, labels, Gauge)
+        if fn is not None:
+            metric.labels().fn = fn # the latest owner (e.g. a new KrakenCore) takes over
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    # ==========================================================================
+    # Prometheus text exposition
+    # ==========================================================================
+
+    def prometheus_text(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, child in list(metric.children.items()):
+                labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(metric.label_names, key))
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, n in zip(child.bounds + (math.inf,), child.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f'{metric.name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{metric.name}_sum{suffix} {child.sum!r}")
+                    lines.append(f"{metric.name}_count{suffix} {child.count}")
+                else:
+                    value = child.get() if metric.kind == "gauge" else child.value
+                    lines.append(f"{metric.name}{{{labels}}} {value}" if labels else f"{metric.name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Write then rename, so a scraper never sees a half written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, mode='w') as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The process wide registry the app instruments itself into
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# ==============================================================================
+# Exporters
+# ==============================================================================
+
+async def export_to_file(path, interval_seconds=10, registry=REGISTRY):
+    """Rewrite `path` with the Prometheus text every `interval_seconds`, until cancelled."""
+    try:
+        while True:
+            try:
+                registry.write_prometheus(path)
+            except OSError as e:
+                logging.warning(f"Could not write metrics to {path} ({e})")
+            await asyncio.sleep(interval_seconds)
+    finally:
+        try:
+            registry.write_prometheus(path) # final values on shutdown
+        except OSError:
+            pass
+
+
+async def serve_prometheus(port, host="127.0.0.1", registry=REGISTRY):
+    """
+    Minimal HTTP endpoint: any request gets the current metrics. Listens on
+    localhost by default, put a reverse proxy in front to expose it.
+    """
+    async def handle(reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            body = registry.prometheus_text().encode('utf-8')
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
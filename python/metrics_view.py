@@ -0,0 +1,111 @@
+import time
+
+from kivy.clock import Clock
+from kivy.metrics import dp
+from kivy.uix.label import Label
+from kivy.uix.scrollview import ScrollView
+
+from python import metrics
+
+# Shown as per-device rates instead of in the counter list
+PER_DEVICE_COUNTER = "kraken_notifications_total"
+
+REFRESH_INTERVAL_SECONDS = 1.0
+
+def _fmt_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1e-3:
+        return f"{value * 1e6:.1f} us"
+    if value < 1:
+        return f"{value * 1e3:.1f} ms"
+    return f"{value:.2f} s"
+
+def _series_name(metric, key):
+    if not key:
+        return metric.name
+    return metric.name + "{" + ",".join(f"{n}={v}" for n, v in zip(metric.label_names, key)) + "}"
+
+
+class MetricsView:
+    """
+    "Metrics" tab: the python/metrics.py registry as a plain text table.
+
+    Refreshes once a second, and only while the tab is on screen, so it costs
+    nothing the rest of the time. Per-device notification rates are computed
+    from the counter deltas between refreshes.
+    """
+    def __init__(self, registry=metrics.REGISTRY):
+        self.registry = registry
+        self.visible = False
+        self._event = None
+        self._last_counts = {}
+        self._last_time = None
+
+        self.label = Label(font_name="RobotoMono-Regular", font_size='13sp',
+                           halign='left', valign='top', size_hint_y=None, padding=(dp(10), dp(10)))
+        self.label.bind(width=lambda inst, width: setattr(inst, "text_size", (width, None)),
+                        texture_size=lambda inst, size: setattr(inst, "height", size[1]))
+        self.root = ScrollView(do_scroll_x=False)
+        self.root.add_widget(self.label)
+
+    def build(self):
+        return self.root
+
+    def set_visible(self, visible):
+        self.visible = visible
+        if visible and self._event is None:
+            self.refresh()
+            self._event = Clock.schedule_interval(lambda dt: self.refresh(), REFRESH_INTERVAL_SECONDS)
+        elif not visible and self._event is not None:
+            self._event.cancel()
+            self._event = None
+            self._last_time = None # rates restart when the tab is shown again
+
+    def refresh(self):
+        self.label.text = self.render_text()
+
+    def render_text(self):
+        counters, gauges, histograms = [], [], []
+        per_device = None
+        for metric in list(self.registry.metrics.values()):
+            if metric.name == PER_DEVICE_COUNTER:
+                per_device = metric
+                continue
+            for key, child in list(metric.children.items()):
+                name = _series_name(metric, key)
+                if metric.kind == "counter":
+                    counters.append(f"  {name:<52}{child.value:>12}")
+                elif metric.kind == "gauge":
+                    gauges.append(f"  {name:<52}{child.get():>12}")
+                elif child.count:
+                    # Label values (e.g. file names) can be long, so the numbers get their own line
+                    histograms.append(f"  {name}")
+                    histograms.append(f"  {'':<12}{child.count:>9} {_fmt_seconds(child.mean):>10} "
+                                      f"{_fmt_seconds(child.quantile(0.5)):>10} {_fmt_seconds(child.quantile(0.95)):>10} "
+                                      f"{_fmt_seconds(child.quantile(0.99)):>10}")
+
+        lines = ["Gauges"] + gauges + ["", "Counters"] + counters
+        lines += ["", f"  {'Latency':<12}{'count':>9} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10}"] + histograms
+        if per_device is not None:
+            lines += ["", *self._per_device_rates(per_device)]
+        return "\n".join(lines)
+
+    def _per_device_rates(self, metric):
+        now = time.monotonic()
+        elapsed = now - self._last_time if self._last_time is not None else None
+        counts = {key[0]: child.value for key, child in list(metric.children.items())}
+        rates = []
+        for address, count in counts.items():
+            previous = self._last_counts.get(address)
+            rate = (count - previous) / elapsed if elapsed and previous is not None else None
+            rates.append((address, count, rate))
+        self._last_counts, self._last_time = counts, now
+
+        rates.sort(key=lambda r: r[2] if r[2] is not None else -1, reverse=True)
+        lines = [f"  {'Notifications':<24}{'total':>12}{'per s':>10}",
+                 f"  {'all devices':<24}{sum(counts.values()):>12}"
+                 f"{sum(r[2] for r in rates if r[2] is not None) if elapsed else 0:>10.1f}"]
+        for address, count, rate in rates:
+            lines.append(f"  {address:<24}{count:>12}{rate if rate is not None else 0:>10.1f}")
+        return lines
@@ -0,0 +1,364 @@
+"""
+Framed request/response channel over the Nordic UART service (NUS), for
+pulling bulk data such as the stored pressure history off a Kraken.
+
+NUS is a plain byte stream: the central writes to UART_RX_CHAR_UUID and the
+Kraken notifies on UART_TX_CHAR_UUID. On top of it both sides exchange
+frames (little-endian):
+
+    uint8 magic 0xA5, uint8 type, uint16 request_id, uint16 seq, uint16 length
+    payload (length bytes)
+    uint32 CRC-32 of header and payload
+
+A frame is cut into MTU-sized writes/notifications by the sender and put
+back together by FrameDecoder on the other side, whatever the fragment
+boundaries; after a bad CRC, or a header claiming more than the agreed frame
+payload (MAX_FRAME_PAYLOAD unless the channel is told otherwise), it
+resynchronises on the next magic byte.
+
+    central                              Kraken
+    REQUEST id=7 seq=window [opcode, args]  ---->
+                                 <----   DATA id=7 seq=0..n  (at most `window` unacknowledged)
+    ACK id=7 seq=k               ---->   (cumulative: all frames before k arrived)
+                                 <----   END id=7 [uint32 total length]   or   ERROR id=7 [message]
+    END id=7                     ---->   (the whole response arrived, the Kraken can drop it)
+
+The window keeps enough DATA frames in flight to cover the round trip, so
+the link stays busy instead of idling for an ACK after every frame.
+
+A DATA frame lost to a bad CRC shows up as a gap in seq, an END before all
+the bytes, or no progress for `retransmit_seconds`. The central then sends
+
+    NACK id=7 seq=k              ---->   (all frames before k arrived, send again from k)
+
+and the Kraken goes back to frame k. It keeps a response until the central's
+END, so even a lost END or tail can be asked for again. After
+`max_retransmits` NACKs in a row without progress the request fails.
+
+    channel = NusChannel(client)
+    await channel.open()
+    history = await channel.read_pressure_history(0, 10000)   # HISTORY_DTYPE array
+    await channel.close()
+
+    python -m python.nus bench --size 1000000 --mtu 247 --latency-ms 15 --window 1 4 16 [--loss 0.01]
+"""
+
+import asyncio
+import itertools
+import logging
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import python.kraken_uuids as kraken_uuids
+from python import metrics
+
+MAGIC = 0xA5
+HEADER = struct.Struct("<BBHHH")
+CRC = struct.Struct("<I")
+FRAME_OVERHEAD = HEADER.size + CRC.size
+# Largest frame payload the firmware sends or accepts, its NUS frame buffer
+MAX_FRAME_PAYLOAD = 4096
+
+FRAME_REQUEST = 0x01
+FRAME_DATA = 0x02
+FRAME_END = 0x03
+FRAME_ACK = 0x04
+FRAME_ERROR = 0x05
+FRAME_NACK = 0x06
+FRAME_TYPES = frozenset((FRAME_REQUEST, FRAME_DATA, FRAME_END, FRAME_ACK, FRAME_ERROR, FRAME_NACK))
+
+# Request opcodes, first payload byte of a REQUEST
+OP_ECHO = 0x01          # returns the rest of the payload
+OP_READ_HISTORY = 0x02  # uint32 first record, uint32 count -> HISTORY_DTYPE records
+OP_READ_BLOB = 0x03     # uint32 size -> that many test bytes (benchmarking)
+
+HISTORY_DTYPE = np.dtype([
+    ("timestamp_s", "<u4"),
+    ("pressure_psi", "<f4"),
+    ("battery", "u1"),
+    ("scanner_tick", "u1"),
+    ("reserved", "<u2"),
+])
+
+NUS_BYTES = metrics.counter("kraken_nus_bytes_total", "Response payload bytes received over NUS")
+NUS_CRC_ERRORS = metrics.counter("kraken_nus_crc_errors_total", "NUS frames dropped for a bad CRC")
+NUS_RETRANSMITS = metrics.counter("kraken_nus_retransmits_total", "NACKs sent to have lost NUS frames sent again")
+NUS_REQUEST_SECONDS = metrics.histogram("kraken_nus_request_seconds", "NUS request to complete response")
+
+
+class NusError(Exception):
+    pass
+
+# ==============================================================================
+# Frames
+# ==============================================================================
+
+def encode_frame(frame_type, request_id, seq=0, payload=b""):
+    header = HEADER.pack(MAGIC, frame_type, request_id, seq, len(payload))
+    return header + payload + CRC.pack(zlib.crc32(payload, zlib.crc32(header)))
+
+
+def fragments(frame, size):
+    """Cut a frame into `size` byte pieces for one write/notification each."""
+    return [frame[offset:offset + size] for offset in range(0, len(frame), size)]
+
+
+class FrameDecoder:
+    """Reassembles frames from arbitrarily fragmented NUS bytes, of at most `max_payload` payload bytes."""
+    def __init__(self, max_payload=MAX_FRAME_PAYLOAD):
+        self.max_payload = max_payload
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """Add received bytes; returns the [(type, request_id, seq, payload)] completed by them."""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        while len(buffer) >= HEADER.size:
+            if buffer[0] != MAGIC:
+                start = buffer.find(MAGIC)
+                del buffer[:start if start >= 0 else len(buffer)]
+                continue
+            magic, frame_type, request_id, seq, length = HEADER.unpack_from(buffer)
+            if frame_type not in FRAME_TYPES or length > self.max_payload:
+                # A 0xA5 inside some payload, not a frame start: don't wait for the length it seems to give
+                del buffer[:1]
+                continue
+            end = HEADER.size + length + CRC.size
+            if len(buffer) < end:
+                break
+            crc, = CRC.unpack_from(buffer, end - CRC.size)
+            if zlib.crc32(memoryview(buffer)[:end - CRC.size]) != crc:
+                # Lost sync or corrupted: skip this magic byte and look for the next one
+                self.crc_errors += 1
+                NUS_CRC_ERRORS.inc()
+                del buffer[:1]
+                continue
+            frames.append((frame_type, request_id, seq, bytes(buffer[HEADER.size:end - CRC.size])))
+            del buffer[:end]
+        return frames
+
+# ==============================================================================
+# Central side
+# ==============================================================================
+
+class _PendingResponse:
+    __slots__ = ("future", "parts", "next_seq", "received", "started", "heard", "last_progress", "nacked_seq",
+                 "nacked_at", "retransmits", "timer")
+
+    def __init__(self, future):
+        self.future = future
+        self.parts = []
+        self.next_seq = 0
+        self.received = 0
+        self.started = self.last_progress = time.perf_counter()
+        self.heard = False # any frame of the response arrived, i.e. the Kraken has it
+        self.nacked_seq = None
+        self.nacked_at = 0.0
+        self.retransmits = 0 # NACKs since the last frame that arrived in order
+        self.timer = None
+
+
+class NusChannel:
+    """
+    Request/response over an already connected client's NUS. Several
+    requests may be outstanding; their frames are told apart by request id.
+    """
+    def __init__(self, client, window=16, request_timeout_seconds=60, max_frame_payload=MAX_FRAME_PAYLOAD,
+                 retransmit_seconds=1.0, max_retransmits=5):
+        self.client = client
+        self.window = max(1, window)
+        self.ack_every = max(1, self.window // 2)
+        self.request_timeout_seconds = request_timeout_seconds
+        self.retransmit_seconds = retransmit_seconds
+        self.max_retransmits = max_retransmits
+        self.max_frame_payload = max_frame_payload
+        self.fragment_size = None
+        self.decoder = FrameDecoder(max_frame_payload)
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._outgoing = asyncio.Queue()
+        self._writer_task = None
+
+    async def open(self):
+        mtu = getattr(self.client, "mtu_size", None) or 23
+        self.fragment_size = mtu - 3
+        await self.client.start_notify(kraken_uuids.UART_TX_CHAR_UUID, self._on_notification)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        for pending in self._pending.values():
+            if pending.timer is not None:
+                pending.timer.cancel()
+            if not pending.future.done():
+                pending.future.set_exception(NusError("channel closed"))
+        self._pending.clear()
+        try:
+            await self.client.stop_notify(kraken_uuids.UART_TX_CHAR_UUID)
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing the NUS channel ({e})")
+
+    async def request(self, payload, timeout_seconds=None):
+        """Send one request and return the reassembled response payload."""
+        if len(payload) > self.max_frame_payload:
+            raise ValueError(f"NUS request payload is limited to {self.max_frame_payload} bytes")
+        request_id = next(self._ids) & 0xFFFF
+        loop = asyncio.get_running_loop()
+        pending = self._pending[request_id] = _PendingResponse(loop.create_future())
+        # A REQUEST's seq is the window the peer may fill before waiting for an ACK
+        self._outgoing.put_nowait(encode_frame(FRAME_REQUEST, request_id, self.window, payload))
+        pending.timer = loop.call_later(self.retransmit_seconds, self._check_stalled, request_id)
+        try:
+            response = await asyncio.wait_for(pending.future, timeout_seconds or self.request_timeout_seconds)
+        finally:
+            pending.timer.cancel()
+            self._pending.pop(request_id, None)
+        NUS_REQUEST_SECONDS.observe(time.perf_counter() - pending.started)
+        return response
+
+    async def echo(self, data):
+        return await self.request(bytes([OP_ECHO]) + data)
+
+    async def read_blob(self, size):
+        return await self.request(struct.pack("<BI", OP_READ_BLOB, size))
+
+    async def read_pressure_history(self, first, count):
+        data = await self.request(struct.pack("<BII", OP_READ_HISTORY, first, count))
+        if len(data) % HISTORY_DTYPE.itemsize:
+            raise NusError(f"history response of {len(data)} bytes is not a whole number of records")
+        return np.frombuffer(data, dtype=HISTORY_DTYPE)
+
+    async def _writer(self):
+        # One task writes everything, so fragments of different frames never interleave
+        client = self.client
+        while True:
+            frame = await self._outgoing.get()
+            for piece in fragments(frame, self.fragment_size):
+                await client.write_gatt_char(kraken_uuids.UART_RX_CHAR_UUID, piece, response=False)
+
+    def _on_notification(self, sender, data):
+        for frame_type, request_id, seq, payload in self.decoder.feed(data):
+            pending = self._pending.get(request_id)
+            if pending is None or pending.future.done():
+                continue # late frames of a request that timed out
+            pending.heard = True
+            if frame_type == FRAME_DATA:
+                ahead = (seq - pending.next_seq) & 0xFFFF
+                if ahead:
+                    if ahead < 0x8000:
+                        self._nack(request_id, pending) # the frames in between were lost
+                    continue # otherwise a frame we already have, sent again after a NACK
+                pending.parts.append(payload)
+                pending.received += len(payload)
+                pending.next_seq += 1
+                pending.last_progress = time.perf_counter()
+                pending.retransmits = 0
+                NUS_BYTES.inc(len(payload))
+                if pending.next_seq % self.ack_every == 0:
+                    self._outgoing.put_nowait(encode_frame(FRAME_ACK, request_id, pending.next_seq & 0xFFFF))
+            elif frame_type == FRAME_END:
+                total, = struct.unpack_from("<I", payload)
+                if total > pending.received:
+                    self._nack(request_id, pending) # the tail was lost
+                elif total < pending.received:
+                    pending.future.set_exception(NusError(f"response ended after {total} bytes, got {pending.received}"))
+                else:
+                    # Tell the Kraken it can let go of the response
+                    self._outgoing.put_nowait(encode_frame(FRAME_END, request_id, pending.next_seq & 0xFFFF))
+                    pending.future.set_result(b"".join(pending.parts))
+            elif frame_type == FRAME_ERROR:
+                pending.future.set_exception(NusError(payload.decode('utf-8', errors='replace')))
+
+    def _nack(self, request_id, pending, force=False):
+        """Ask for everything from the next frame we are missing, at most once per `retransmit_seconds`."""
+        now = time.perf_counter()
+        if not force and pending.nacked_seq == pending.next_seq and now - pending.nacked_at < self.retransmit_seconds:
+            return # already asked, the frames sent again are on their way
+        if pending.heard:
+            # Before any frame arrived the Kraken may just be slow to start, the request timeout covers that
+            pending.retransmits += 1
+            if pending.retransmits > self.max_retransmits:
+                pending.future.set_exception(NusError(f"frame {pending.next_seq} still missing after "
+                                                      f"{self.max_retransmits} retransmits"))
+                return
+        pending.nacked_seq = pending.next_seq
+        pending.nacked_at = now
+        NUS_RETRANSMITS.inc()
+        self._outgoing.put_nowait(encode_frame(FRAME_NACK, request_id, pending.next_seq & 0xFFFF))
+
+    def _check_stalled(self, request_id):
+        # Nothing arriving at all, e.g. the END or the last frames of a window were lost
+        pending = self._pending.get(request_id)
+        if pending is None or pending.future.done():
+            return
+        idle = time.perf_counter() - max(pending.last_progress, pending.nacked_at)
+        if idle >= self.retransmit_seconds:
+            self._nack(request_id, pending, force=True)
+            idle = 0.0
+        if not pending.future.done():
+            pending.timer = asyncio.get_running_loop().call_later(self.retransmit_seconds - idle,
+                                                                  self._check_stalled, request_id)
+
+# ==============================================================================
+# Benchmark
+# ==============================================================================
+
+async def _bench(args):
+    import python.ble_backend as ble_backend
+    from python.sim_kraken import SimulatedFleet
+
+    print(f"{args.size} bytes, MTU {args.mtu}, one-way latency {args.latency_ms} ms, "
+          f"link {args.link_kbps} kB/s, frames up to {args.frame_payload} bytes, {100 * args.loss:g}% notifications lost")
+    print(f"  {'window':>6}{'seconds':>10}{'bytes/s':>12}{'of link':>9}{'resent':>8}")
+    for window in args.window:
+        fleet = SimulatedFleet(1, mtu=args.mtu, nus_latency_seconds=args.latency_ms / 1000,
+                               nus_link_bytes_per_second=args.link_kbps * 1000,
+                               nus_frame_payload=args.frame_payload, nus_loss_rate=args.loss,
+                               pressure_rate_hz=0, connection_info_rate_hz=0)
+        fleet.install()
+        client = ble_backend.create_client(next(iter(fleet.devices)))
+        await client.connect()
+        channel = NusChannel(client, window=window, max_frame_payload=args.frame_payload)
+        await channel.open()
+        start = time.perf_counter()
+        data = await channel.read_blob(args.size)
+        seconds = time.perf_counter() - start
+        await channel.close()
+        await client.disconnect()
+        if len(data) != args.size:
+            raise NusError(f"got {len(data)} of {args.size} bytes")
+        rate = len(data) / seconds
+        resent = sum(device.nus.frames_resent for device in fleet.devices.values())
+        print(f"  {window:>6}{seconds:>10.2f}{rate:>12.0f}{100 * rate / (args.link_kbps * 1000):>8.0f}%{resent:>8}")
+    ble_backend.reset_backend()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NUS framed channel tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="bulk read throughput against a simulated Kraken")
+    bench.add_argument("--size", type=int, default=1_000_000, help="bytes to read")
+    bench.add_argument("--mtu", type=int, default=247)
+    bench.add_argument("--latency-ms", type=float, default=15, help="one-way link latency")
+    bench.add_argument("--link-kbps", type=float, default=100, help="link throughput in kB/s")
+    bench.add_argument("--frame-payload", type=int, default=1024, help="largest DATA frame payload the peer sends")
+    bench.add_argument("--window", type=int, nargs="+", default=[1, 4, 16], help="window sizes to compare")
+    bench.add_argument("--loss", type=float, default=0.0, help="fraction of notifications corrupted on the link")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(_bench(args))
+
+
+if __name__ == "__main__":
+    main()
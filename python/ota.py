@@ -0,0 +1,470 @@
+"""
+Over-the-air firmware updates through the Silicon Labs OTA service
+(UUID_OTA_SERVICE), for one Kraken or a whole fleet at once.
+
+Per device (OtaJob):
+
+  1. connect; if the application is running (the Kraken service is there),
+     write 0x00 to OTA control so it reboots into the AppLoader, reconnect
+  2. write 0x00 to OTA control, then stream the image into OTA data in
+     MTU-sized chunks as write-without-response, with a write-with-response
+     every `window` chunks so unacknowledged writes can't overrun the link
+  3. write 0x03: the AppLoader verifies the image (GBL CRC, signature) and
+     fails the write if it doesn't
+  4. write 0x04 to boot the new application, reconnect and compare its
+     UUID_APPLICATION_VERSION with the version inside the image
+
+OtaCampaign runs an OtaJob per device, at most `concurrency` at a time, and
+keeps per-device state, progress and bytes/s (also exported as metrics).
+
+Images are GBL files: parse_gbl() checks their tags and CRC before anything
+is sent and reads the application version out of them.
+
+    python -m python.ota firmware.gbl --address C0:DE:00:00:00:01 --concurrency 8
+    python -m python.ota --make-test-image test.gbl --version 2.1.0 --size 200000
+    python -m python.ota test.gbl --simulated 20
+"""
+
+import asyncio
+import logging
+import random
+import struct
+import time
+import zlib
+from collections import deque
+
+import python.ble_backend as ble_backend
+import python.kraken_uuids as kraken_uuids
+from python import metrics
+
+# OTA control commands
+OTA_BEGIN = 0x00
+OTA_END = 0x03
+OTA_REBOOT = 0x04
+
+# GBL tags, see Silicon Labs UG266
+GBL_TAG_HEADER = 0x03A617EB
+GBL_TAG_APPLICATION = 0xF40A0AF4
+GBL_TAG_PROGRAM = 0xFE0101FE
+GBL_TAG_END = 0xFC0404FC
+_GBL_TAG = struct.Struct("<II")
+_GBL_APPLICATION = struct.Struct("<III16s") # type, version, capabilities, product id
+GBL_HEADER_VERSION = 0x03000000
+
+ATT_HEADER_BYTES = 3
+DEFAULT_MTU = 23
+
+OTA_BYTES = metrics.counter("kraken_ota_bytes_total", "Firmware image bytes written to OTA data")
+OTA_UPDATES = metrics.counter("kraken_ota_updates_total", "Finished OTA updates", labels=("outcome",))
+OTA_SECONDS = metrics.histogram("kraken_ota_seconds", "Time to update one Kraken, first connect to confirmed version",
+                                buckets=(5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0))
+OTA_PROGRESS = metrics.gauge("kraken_ota_progress", "Fraction of the image sent", labels=("address",))
+OTA_RATE = metrics.gauge("kraken_ota_bytes_per_second", "Upload rate of a running OTA update", labels=("address",))
+
+
+class OtaError(Exception):
+    pass
+
+# ==============================================================================
+# Versions and GBL images
+# ==============================================================================
+
+def version_to_int(version):
+    """"2.1.0" -> 0x02010000 (major and minor one byte each, patch two)."""
+    major, minor, patch = (int(part) for part in version.split("."))
+    return (major << 24) | (minor << 16) | patch
+
+
+def version_to_string(version):
+    return f"{version >> 24}.{(version >> 16) & 0xFF}.{version & 0xFFFF}"
+
+
+def parse_gbl(image):
+    """
+    Check a GBL image's tag structure and CRC. Returns a dict with the
+    "tags" (tag id -> [(offset, length)]) and the "application_version"
+    (None without an application tag). Raises OtaError if it is malformed.
+    """
+    tags = {}
+    application_version = None
+    offset = 0
+    while True:
+        if offset + _GBL_TAG.size > len(image):
+            raise OtaError("GBL image ends without an end tag")
+        tag, length = _GBL_TAG.unpack_from(image, offset)
+        if offset == 0 and tag != GBL_TAG_HEADER:
+            raise OtaError("not a GBL image (no header tag)")
+        data_offset = offset + _GBL_TAG.size
+        if data_offset + length > len(image):
+            raise OtaError(f"GBL tag {tag:#010x} at {offset} runs past the end of the image")
+        tags.setdefault(tag, []).append((data_offset, length))
+
+        if tag == GBL_TAG_APPLICATION and length >= _GBL_APPLICATION.size:
+            application_version = _GBL_APPLICATION.unpack_from(image, data_offset)[1]
+        elif tag == GBL_TAG_END:
+            # The CRC covers everything up to and including the end tag's id and length
+            crc, = struct.unpack_from("<I", image, data_offset)
+            if zlib.crc32(image[:data_offset]) != crc:
+                raise OtaError("GBL image CRC mismatch")
+            if data_offset + length != len(image):
+                raise OtaError("data after the GBL end tag")
+            return {"tags": tags, "application_version": application_version}
+        offset = data_offset + length
+
+
+def build_gbl(version, payload_size, seed=0):
+    """An unsigned GBL image with an application tag and `payload_size` random program bytes, for testing."""
+    def tag(tag_id, data):
+        return _GBL_TAG.pack(tag_id, len(data)) + data
+
+    payload = random.Random(seed).randbytes(payload_size)
+    image = (tag(GBL_TAG_HEADER, struct.pack("<II", GBL_HEADER_VERSION, 0))
+             + tag(GBL_TAG_APPLICATION, _GBL_APPLICATION.pack(1, version_to_int(version), 0, b"kraken".ljust(16, b"\x00")))
+             + tag(GBL_TAG_PROGRAM, struct.pack("<I", 0) + payload)
+             + _GBL_TAG.pack(GBL_TAG_END, 4))
+    return image + struct.pack("<I", zlib.crc32(image))
+
+# ==============================================================================
+# One device
+# ==============================================================================
+
+def _chunk_size(client, max_chunk):
+    # One ATT write per chunk, a multiple of 4 bytes (the AppLoader writes flash in words)
+    mtu = getattr(client, "mtu_size", None) or DEFAULT_MTU
+    size = min(max_chunk, mtu - ATT_HEADER_BYTES)
+    return max(4, size - size % 4)
+
+
+class OtaJob:
+    """Update of one Kraken; run() returns True once the new version is confirmed."""
+    def __init__(self, address, image, expected_version=None, window=16, max_chunk=244,
+                 connect_attempts=10, reconnect_delay_seconds=1.0, reboot_timeout_seconds=10):
+        self.address = address
+        self.image = image
+        self.expected_version = expected_version
+        self.window = max(1, window)
+        self.max_chunk = max_chunk
+        self.connect_attempts = connect_attempts
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self.reboot_timeout_seconds = reboot_timeout_seconds
+
+        self.state = "queued"
+        self.error = None
+        self.total = len(image)
+        self.bytes_sent = 0
+        self.chunk_size = None
+        self.started = None
+        self.upload_started = None
+        self.upload_finished = None
+        self.finished = None
+        self.listeners = [] # listener(job) on state changes and every window of chunks
+
+        self.client = None
+        self._disconnected = None
+
+    @property
+    def progress(self):
+        return self.bytes_sent / self.total if self.total else 1.0
+
+    @property
+    def bytes_per_second(self):
+        if self.upload_started is None:
+            return 0.0
+        end = self.upload_finished if self.upload_finished is not None else time.monotonic()
+        return self.bytes_sent / max(1e-6, end - self.upload_started)
+
+    @property
+    def elapsed_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def _emit(self):
+        for listener in self.listeners:
+            listener(self)
+
+    def _set_state(self, state):
+        self.state = state
+        self._emit()
+
+    async def run(self):
+        self.started = time.monotonic()
+        OTA_PROGRESS.labels(self.address).fn = lambda: self.progress
+        OTA_RATE.labels(self.address).fn = lambda: self.bytes_per_second
+        try:
+            await self._update()
+        except asyncio.CancelledError:
+            self.error = "cancelled"
+            self._fail()
+            raise
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            self._fail()
+            return False
+        finally:
+            self.finished = time.monotonic()
+            # The per-device gauges only make sense while the job runs, and their closures keep it alive
+            OTA_PROGRESS.remove(self.address)
+            OTA_RATE.remove(self.address)
+            await self._disconnect()
+        OTA_SECONDS.observe(self.finished - self.started)
+        OTA_UPDATES.labels("succeeded").inc()
+        logging.info(f"OTA update of Kraken {self.address} done in {self.elapsed_seconds:.1f} s "
+                     f"({self.bytes_per_second / 1024:.1f} KiB/s)")
+        self._set_state("done")
+        return True
+
+    def _fail(self):
+        logging.warning(f"OTA update of Kraken {self.address} failed while {self.state} ({self.error})")
+        OTA_UPDATES.labels("failed").inc()
+        self._set_state("failed")
+
+    async def _update(self):
+        self._set_state("connecting")
+        client = await self._connect()
+        if client.services.get_service(kraken_uuids.KRAKEN_SERVICE_UUID) is not None:
+            # The application is running: have it reboot into the AppLoader
+            self._set_state("rebooting")
+            await self._write_control(OTA_BEGIN, expect_reboot=True)
+            client = await self._connect()
+        if client.services.get_characteristic(kraken_uuids.UUID_OTA_DATA) is None:
+            raise OtaError("no OTA data characteristic")
+
+        self._set_state("uploading")
+        await self._write_control(OTA_BEGIN)
+        await self._upload()
+
+        self._set_state("verifying")
+        try:
+            await self._write_control(OTA_END)
+        except Exception as e:
+            raise OtaError(f"image rejected ({e})") from e
+        await self._write_control(OTA_REBOOT, expect_reboot=True)
+
+        if self.expected_version is not None:
+            self._set_state("confirming")
+            client = await self._connect()
+            data = await client.read_gatt_char(kraken_uuids.UUID_APPLICATION_VERSION)
+            version = int.from_bytes(bytes(data[:4]), 'little')
+            if version != self.expected_version:
+                raise OtaError(f"running {version_to_string(version)} after the update, "
+                               f"expected {version_to_string(self.expected_version)}")
+
+    async def _upload(self):
+        client = self.client
+        data_char = client.services.get_characteristic(kraken_uuids.UUID_OTA_DATA)
+        size = self.chunk_size = _chunk_size(client, self.max_chunk)
+        image = self.image
+        window = self.window
+        self.bytes_sent = 0
+        self.upload_started = time.monotonic()
+        self.upload_finished = None
+        for index, offset in enumerate(range(0, len(image), size)):
+            chunk = image[offset:offset + size]
+            # Every `window`th chunk and the last one with response: the round
+            # trip drains whatever the unacknowledged writes queued up
+            acknowledged = (index + 1) % window == 0 or offset + size >= len(image)
+            await client.write_gatt_char(data_char, chunk, response=acknowledged)
+            self.bytes_sent += len(chunk)
+            OTA_BYTES.inc(len(chunk))
+            if acknowledged:
+                self._emit()
+        self.upload_finished = time.monotonic()
+
+    async def _write_control(self, command, expect_reboot=False):
+        client = self.client
+        if not expect_reboot:
+            await client.write_gatt_char(kraken_uuids.UUID_OTA_CONTROL, bytes([command]), response=True)
+            return
+        try:
+            await client.write_gatt_char(kraken_uuids.UUID_OTA_CONTROL, bytes([command]), response=True)
+        except Exception as e:
+            # The device may reset before the write response makes it out
+            logging.debug(f"Ignoring error from OTA control write {command:#04x} to Kraken {self.address} ({e})")
+        try:
+            await asyncio.wait_for(self._disconnected.wait(), self.reboot_timeout_seconds)
+        except asyncio.TimeoutError:
+            raise OtaError(f"did not reboot within {self.reboot_timeout_seconds} s of command {command:#04x}")
+        self.client = None
+
+    async def _connect(self):
+        last_error = None
+        for attempt in range(self.connect_attempts):
+            if attempt:
+                await asyncio.sleep(self.reconnect_delay_seconds) # e.g. still booting
+            disconnected = asyncio.Event()
+            client = ble_backend.create_client(self.address, disconnected_callback=lambda c, event=disconnected: event.set())
+            try:
+                await client.connect()
+            except Exception as e:
+                last_error = e
+                continue
+            self.client = client
+            self._disconnected = disconnected
+            return client
+        raise OtaError(f"could not connect in {self.connect_attempts} attempts ({last_error})")
+
+    async def _disconnect(self):
+        client, self.client = self.client, None
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logging.debug(f"Ignoring error while disconnecting from Kraken {self.address} ({e})")
+
+# ==============================================================================
+# Fleet
+# ==============================================================================
+
+class OtaCampaign:
+    """
+    Updates every address in `addresses` with `image`, at most `concurrency`
+    devices at a time. The image is checked with parse_gbl() up front, so a
+    broken file fails here and not on every device.
+    """
+    def __init__(self, image, addresses, concurrency=4, device_timeout_seconds=900, **job_kwargs):
+        self.image = bytes(image)
+        self.expected_version = parse_gbl(self.image)["application_version"]
+        self.concurrency = concurrency
+        self.device_timeout_seconds = device_timeout_seconds
+        self.jobs = {address: OtaJob(address, self.image, expected_version=self.expected_version, **job_kwargs)
+                     for address in addresses}
+        self.started = None
+        self.finished = None
+
+    async def run(self):
+        """Update every device. Returns True if all of them succeeded."""
+        self.started = time.monotonic()
+        queue = deque(self.jobs.values())
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(self.concurrency, len(queue)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished = time.monotonic()
+        return all(job.state == "done" for job in self.jobs.values())
+
+    async def _worker(self, queue):
+        while queue:
+            job = queue.popleft()
+            try:
+                await asyncio.wait_for(job.run(), self.device_timeout_seconds)
+            except asyncio.TimeoutError:
+                job.error = f"timed out after {self.device_timeout_seconds} s"
+
+    @property
+    def bytes_sent(self):
+        return sum(job.bytes_sent for job in self.jobs.values())
+
+    def stats(self):
+        states = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started is not None else 0
+        return {
+            "devices": len(self.jobs),
+            "states": states,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_second": self.bytes_sent / elapsed if elapsed else 0.0,
+            "elapsed_seconds": elapsed,
+        }
+
+    def progress_lines(self, only_active=False):
+        lines = []
+        for job in self.jobs.values():
+            if only_active and job.state in ("queued", "done", "failed"):
+                continue
+            line = (f"  {job.address:<20}{job.state:<12}{100 * job.progress:>6.1f} %"
+                    f"{job.bytes_per_second / 1024:>9.1f} KiB/s{job.elapsed_seconds:>8.1f} s")
+            if job.error:
+                line += f"  {job.error}"
+            lines.append(line)
+        return lines
+
+# ==============================================================================
+# Command line
+# ==============================================================================
+
+async def _scan_for_krakens(seconds):
+    import python.ble_utils as ble_utils
+
+    scanner = ble_utils.KrakenScanner()
+    found = []
+
+    async def collect():
+        async for event, address, data in scanner.events():
+            if event == "discovered":
+                found.append(address)
+
+    await scanner.start()
+    task = asyncio.create_task(collect())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await scanner.stop()
+    return found
+
+
+async def _run_campaign(args, image):
+    addresses = args.address or await _scan_for_krakens(args.scan_seconds)
+    if not addresses:
+        print("no Krakens to update")
+        return False
+    campaign = OtaCampaign(image, addresses, concurrency=args.concurrency, window=args.window, max_chunk=args.max_chunk)
+    print(f"updating {len(addresses)} Krakens to "
+          f"{version_to_string(campaign.expected_version) if campaign.expected_version is not None else 'an unversioned image'}, "
+          f"{len(image)} bytes, {args.concurrency} at a time")
+
+    task = asyncio.create_task(campaign.run())
+    while not task.done():
+        await asyncio.wait({task}, timeout=args.status_interval)
+        stats = campaign.stats()
+        print(f"{stats['elapsed_seconds']:7.1f} s  {stats['states']}  {stats['bytes_per_second'] / 1024:.1f} KiB/s total")
+        for line in campaign.progress_lines(only_active=True):
+            print(line)
+    ok = task.result()
+    print("\n".join(["result"] + campaign.progress_lines()))
+    return ok
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Update Kraken firmware over the air")
+    parser.add_argument("image", nargs="?", help="GBL image to install")
+    parser.add_argument("--address", action="append", help="Kraken to update, repeat for several (default: scan)")
+    parser.add_argument("--scan-seconds", type=float, default=10, help="how long to scan when no --address is given")
+    parser.add_argument("--concurrency", type=int, default=4, help="devices updated at the same time")
+    parser.add_argument("--window", type=int, default=16, help="writes without response between acknowledged ones")
+    parser.add_argument("--max-chunk", type=int, default=244, help="largest OTA data write, further capped by the MTU")
+    parser.add_argument("--status-interval", type=float, default=1.0, help="seconds between progress reports")
+    parser.add_argument("--simulated", type=int, default=0, help="update N simulated Krakens instead of real ones")
+    parser.add_argument("--make-test-image", metavar="PATH", help="write an unsigned test image to PATH and exit")
+    parser.add_argument("--version", default="1.0.1", help="application version of --make-test-image")
+    parser.add_argument("--size", type=int, default=200 * 1024, help="program bytes in --make-test-image")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.make_test_image:
+        with open(args.make_test_image, mode='wb') as file:
+            file.write(build_gbl(args.version, args.size))
+        return
+    if not args.image:
+        parser.error("an image is required")
+    with open(args.image, mode='rb') as file:
+        image = file.read()
+    if args.simulated:
+        from python.sim_kraken import SimulatedFleet
+        fleet = SimulatedFleet(args.simulated)
+        fleet.install()
+        args.address = args.address or list(fleet.devices)
+
+    try:
+        sys.exit(0 if asyncio.run(_run_campaign(args, image)) else 1)
+    except OtaError as e:
+        sys.exit(f"{args.image}: {e}")
+
+
+if __name__ == "__main__":
+    main()
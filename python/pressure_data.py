@@ -0,0 +1,130 @@
+"""
+Pressure notification parsing.
+
+Notification layout (29 or 30 bytes):
+
+    0   16 bytes  name, NUL padded ASCII
+    16  5 bytes   pressure reading, ASCII decimal in tenths of a PSI, NUL padded
+    21  6 bytes   scanner address
+    27  uint8     battery % (255 while charging)
+    28  uint8     scanner tick
+    29  uint8     charging state (newer firmware only)
+
+PressureData parses a single notification with one struct unpack.
+decode_pressure_batch turns a buffer of many fixed-size notifications into
+arrays in one vectorized pass.
+"""
+
+import struct
+
+import numpy as np
+
+RECORD_SIZE = 30
+LEGACY_RECORD_SIZE = 29
+
+BATTERY_CHARGING = 255
+# charging_state value used by decode_pressure_batch for 29-byte records
+CHARGING_STATE_UNKNOWN = 255
+
+_LAYOUT = struct.Struct("16s5s6sBB")
+_HEX = [f"{b:X}" for b in range(256)]
+
+_RECORD_DTYPE = np.dtype([
+    ("name", "S16"),
+    ("reading", "u1", (5,)),
+    ("address", "u1", (6,)),
+    ("battery", "u1"),
+    ("scanner_tick", "u1"),
+])
+
+BATCH_DTYPE = np.dtype([
+    ("name", "S16"),
+    ("address", "u1", (6,)),
+    ("pressure", "f4"),
+    ("error", "?"),
+    ("battery", "u1"),
+    ("scanner_tick", "u1"),
+    ("charging_state", "u1"),
+])
+
+
+class PressureData:
+    __slots__ = ("_notification_data", "name", "pressure", "address", "battery_raw", "battery",
+                 "scanner_tick", "charging_state")
+
+    def __init__(self, notification_data):
+        self._notification_data = notification_data
+
+        name, reading, address, self.battery_raw, self.scanner_tick = _LAYOUT.unpack_from(notification_data)
+        self.name = name.split(b'\x00', 1)[0].decode('latin-1')
+        self.pressure = self.reading_to_psi(reading)
+        self.address = ':'.join([_HEX[b] for b in address])
+        self.battery = self.get_battery_reading(self.battery_raw)
+        if len(notification_data) > 29:
+            self.charging_state = notification_data[29]
+        else:
+            self.charging_state = None
+
+    def __repr__(self):
+        return (f"PressureData(name={self.name!r}, pressure={self.pressure!r}, address={self.address!r}, "
+                f"battery={self.battery!r}, scanner_tick={self.scanner_tick}, charging_state={self.charging_state})")
+
+    def bin2string(self, byte_array, length):
+        return bytes(byte_array[:length]).split(b'\x00', 1)[0].decode('latin-1')
+
+    def bytes_to_string(self, byte_array):
+        return bytes(byte_array).decode('latin-1')
+
+    def reading_to_psi(self, byte_array):
+        try:
+            return int(bytes(byte_array).rstrip(b'\x00')) / 10
+        except ValueError:
+            # simply return the string as a backup (could indicate error state)
+            return bytes(byte_array).decode('utf-8', errors='replace')
+
+    def get_battery_reading(self, value):
+        if value == BATTERY_CHARGING:
+            return "Charging.."
+        else:
+            return f"{value}%"
+
+
+def decode_pressure_batch(buffer, record_size=RECORD_SIZE):
+    """
+    Decode back-to-back pressure notifications of `record_size` bytes (29 or 30).
+
+    Returns a BATCH_DTYPE structured array. Readings that are not a plain
+    (optionally negative) decimal number get pressure NaN and error True.
+    charging_state is CHARGING_STATE_UNKNOWN for 29-byte records.
+    """
+    if record_size not in (RECORD_SIZE, LEGACY_RECORD_SIZE):
+        raise ValueError(f"Unsupported pressure record size {record_size}")
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size % record_size:
+        raise ValueError(f"Pressure batch of {raw.size} bytes is not a multiple of {record_size}")
+    rows = raw.reshape(-1, record_size)
+    records = np.ascontiguousarray(rows[:, :LEGACY_RECORD_SIZE]).view(_RECORD_DTYPE)[:, 0]
+
+    reading = records["reading"]
+    is_null = reading == 0
+    is_digit = (reading >= ord('0')) & (reading <= ord('9'))
+    is_minus = np.zeros_like(is_null)
+    is_minus[:, 0] = reading[:, 0] == ord('-')
+    # NULs may only pad the end, and there has to be at least one digit
+    nul_padding_only = (np.logical_or.accumulate(is_null, axis=1) == is_null).all(axis=1)
+    valid = (is_digit | is_null | is_minus).all(axis=1) & nul_padding_only & is_digit.any(axis=1)
+
+    value = np.zeros(len(records), dtype=np.int32)
+    for col in range(reading.shape[1]):
+        value = np.where(is_digit[:, col], value * 10 + (reading[:, col].astype(np.int32) - ord('0')), value)
+    value = np.where(is_minus[:, 0], -value, value)
+
+    out = np.empty(len(records), dtype=BATCH_DTYPE)
+    out["name"] = records["name"]
+    out["address"] = records["address"]
+    out["pressure"] = np.where(valid, value / np.float32(10), np.nan)
+    out["error"] = ~valid
+    out["battery"] = records["battery"]
+    out["scanner_tick"] = records["scanner_tick"]
+    out["charging_state"] = rows[:, 29] if record_size == RECORD_SIZE else CHARGING_STATE_UNKNOWN
+    return out
@@ -0,0 +1,47 @@
+import time
+
+from kivy.clock import Clock
+
+from python import metrics
+
+FLUSH_SECONDS = metrics.histogram("kraken_ui_flush_seconds", "Time to apply one batch of coalesced UI updates")
+
+class RenderScheduler:
+    """
+    Coalesces UI updates into one Clock tick.
+
+    BLE callbacks only update a widget's model and call mark_dirty(widget).
+    At `rate_hz` every dirty widget gets flush_ui() called once, which pushes
+    changed fields to whatever is currently visible. Changes for hidden views
+    stay pending in the widget, which marks itself dirty again when its
+    visibility changes.
+    """
+    def __init__(self, rate_hz=10):
+        self.rate_hz = rate_hz
+        self._dirty = set()
+        self._event = None
+        self.flushes = 0
+
+    def start(self):
+        if self._event is None:
+            self._event = Clock.schedule_interval(self._tick, 1.0 / self.rate_hz)
+
+    def stop(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+
+    def mark_dirty(self, widget):
+        self._dirty.add(widget)
+
+    def flush(self):
+        start = time.perf_counter()
+        dirty = self._dirty
+        self._dirty = set()
+        for widget in dirty:
+            widget.flush_ui()
+        self.flushes += 1
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def _tick(self, dt):
+        self.flush()
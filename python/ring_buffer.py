@@ -0,0 +1,142 @@
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+class RollingSeries:
+    """
+    Fixed-capacity time series with incremental rolling statistics.
+
+    The last `capacity` samples are kept in preallocated arrays (value and
+    timestamp, float64), so memory per series is fixed at construction, see
+    `nbytes`. min/max/mean/stddev cover the last `window` samples (window <=
+    capacity) and are maintained in O(1) per sample: a sliding Welford update
+    for mean/variance and monotonic deques (bounded by the window) for
+    min/max. The EWMA covers every sample seen.
+    NaN samples are ignored.
+    """
+    def __init__(self, capacity=1024, window=128, ewma_alpha=0.1):
+        if not 0 < window <= capacity:
+            raise ValueError(f"window must be in 1..capacity ({capacity}), got {window}")
+        self.capacity = capacity
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._next = 0    # index the next sample goes to
+        self.count = 0    # samples currently stored (<= capacity)
+        self.total = 0    # samples ever added
+
+        self._n = 0       # samples currently in the window
+        self._mean = 0.0
+        self._m2 = 0.0
+        # (sample number, value), values monotonic so the front is the extreme
+        self._min_q = deque(maxlen=window)
+        self._max_q = deque(maxlen=window)
+        self.ewma = None
+
+    @property
+    def nbytes(self):
+        # Arrays plus worst case for the two deques (2-tuples of int and float)
+        return self._values.nbytes + self._times.nbytes + 2 * self.window * 64
+
+    def add(self, value, timestamp=None):
+        value = float(value)
+        if math.isnan(value):
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        # The sample falling out of the window is still in the ring (window <= capacity)
+        leaving = None
+        if self._n == self.window:
+            leaving = float(self._values[(self._next - self.window) % self.capacity])
+
+        self._values[self._next] = value
+        self._times[self._next] = timestamp
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        seq = self.total
+        self.total += 1
+
+        if leaving is None:
+            self._n += 1
+            delta = value - self._mean
+            self._mean += delta / self._n
+            self._m2 += delta * (value - self._mean)
+        else:
+            old_mean = self._mean
+            self._mean += (value - leaving) / self._n
+            self._m2 += (value - leaving) * (value - self._mean + leaving - old_mean)
+            if self._m2 < 0:
+                self._m2 = 0.0 # rounding
+
+        oldest_in_window = seq - self.window + 1
+        while self._min_q and self._min_q[-1][1] >= value:
+            self._min_q.pop()
+        self._min_q.append((seq, value))
+        while self._min_q[0][0] < oldest_in_window:
+            self._min_q.popleft()
+        while self._max_q and self._max_q[-1][1] <= value:
+            self._max_q.pop()
+        self._max_q.append((seq, value))
+        while self._max_q[0][0] < oldest_in_window:
+            self._max_q.popleft()
+
+        self.ewma = value if self.ewma is None else self.ewma + self.ewma_alpha * (value - self.ewma)
+
+    @property
+    def last(self):
+        return float(self._values[(self._next - 1) % self.capacity]) if self.count else None
+
+    @property
+    def min(self):
+        return self._min_q[0][1] if self._min_q else None
+
+    @property
+    def max(self):
+        return self._max_q[0][1] if self._max_q else None
+
+    @property
+    def mean(self):
+        return self._mean if self._n else None
+
+    @property
+    def stddev(self):
+        # Population standard deviation over the window
+        return math.sqrt(self._m2 / self._n) if self._n else None
+
+    def values(self):
+        """Stored samples, oldest first (a copy)."""
+        if self.count < self.capacity:
+            return self._values[:self.count].copy()
+        return np.concatenate((self._values[self._next:], self._values[:self._next]))
+
+    def since(self, total):
+        """
+        Samples added after the first `total` ones, oldest first, as
+        (values, sample number of the first one). Samples that have already
+        been overwritten are skipped.
+        """
+        n = min(self.total - total, self.count)
+        if n <= 0:
+            return np.empty(0, dtype=np.float64), self.total
+        idx = np.arange(self._next - n, self._next) % self.capacity
+        return self._values[idx], self.total - n
+
+    def timestamps(self):
+        if self.count < self.capacity:
+            return self._times[:self.count].copy()
+        return np.concatenate((self._times[self._next:], self._times[:self._next]))
+
+    def stats(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "stddev": self.stddev,
+            "ewma": self.ewma,
+            "n": self._n,
+        }
@@ -0,0 +1,142 @@
+"""
+Single-producer ring buffer of fixed-size NumPy records in
+multiprocessing.shared_memory, for handing samples from the BLE I/O process
+to the UI process without pickling or copying.
+
+Layout: a 64 byte header (magic, version, capacity, record size, records
+written so far) followed by `capacity` records of `dtype`.
+
+The producer writes record n into slot n % capacity and then bumps the
+written counter, so a record is complete before readers can see it. A reader
+keeps its own position; read() returns NumPy views straight into the shared
+block (at most two, when the range wraps) and how many records it lost
+because the producer lapped it. Views stay valid until the producer comes
+round again, i.e. for `capacity` further records: size the ring for the
+producer's rate times the longest gap between reads, and use the records
+before the next read().
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x4B52494E # "KRIN"
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "<u4"),
+    ("version", "<u4"),
+    ("capacity", "<u8"),
+    ("itemsize", "<u8"),
+    ("written", "<u8"),
+])
+HEADER_SIZE = 64
+
+
+def _attach_shared_memory(name):
+    """Open an existing block without making this process its owner."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older Pythons register every opened block with the resource tracker,
+        # which would unlink it when this (non-owning) process exits
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class ShmRing:
+    def __init__(self, shm, dtype, owner):
+        self.shm = shm
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self._header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        self.capacity = int(self._header["capacity"][0])
+        self._written = self._header["written"] # view, always re-read
+        self.records = np.ndarray((self.capacity,), dtype=self.dtype, buffer=shm.buf, offset=HEADER_SIZE)
+
+        # reader side
+        self.read_position = 0
+        self.lost = 0
+
+    @classmethod
+    def create(cls, dtype, capacity, name=None):
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * dtype.itemsize)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[0] = (MAGIC, VERSION, capacity, dtype.itemsize, 0)
+        return cls(shm, dtype, owner=True)
+
+    @classmethod
+    def attach(cls, name, dtype):
+        shm = _attach_shared_memory(name)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            shm.close()
+            raise ValueError(f"Shared memory block {name} is not a version {VERSION} ring")
+        if header["itemsize"] != np.dtype(dtype).itemsize:
+            shm.close()
+            raise ValueError(f"Ring {name} holds {header['itemsize']} byte records, expected {np.dtype(dtype).itemsize}")
+        ring = cls(shm, dtype, owner=False)
+        ring.read_position = ring.written # start at the live edge
+        return ring
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def written(self):
+        return int(self._written[0])
+
+    # ==========================================================================
+    # Producer
+    # ==========================================================================
+
+    def append(self, record):
+        """Write one record (a tuple in dtype field order). Producer only."""
+        n = int(self._written[0])
+        self.records[n % self.capacity] = record
+        self._written[0] = n + 1
+
+    # ==========================================================================
+    # Reader
+    # ==========================================================================
+
+    def read(self):
+        """Return ([views of the new records], records lost since the last read)."""
+        written = self.written
+        start = self.read_position
+        lost = 0
+        if written - start > self.capacity:
+            lost = written - start - self.capacity
+            start = written - self.capacity
+        self.read_position = written
+        self.lost += lost
+
+        count = written - start
+        if count == 0:
+            return [], lost
+        first = start % self.capacity
+        head = min(count, self.capacity - first)
+        chunks = [self.records[first:first + head]]
+        if count > head:
+            chunks.append(self.records[:count - head])
+        return chunks, lost
+
+    def close(self):
+        if self.records is None:
+            return # already closed
+        # Views into the block have to go before it can be closed
+        self.records = None
+        self._header = None
+        self._written = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # a caller still holds a view from read(), the mapping goes when that does
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,747 @@
+"""
+In-process simulated Kraken fleet.
+
+Emulates N Krakens well enough to drive the app without a radio: each device
+advertises KRAKEN_SERVICE_UUID, serves the display name and FW revision
+characteristics and pushes pressure and BLE connection info notifications at a
+configurable rate, optionally dropping the connection at random. Each one
+also runs a small OTA AppLoader (python/ota.py): it reboots into it on
+request, takes the image at a modelled link rate, checks the GBL CRC and
+comes back up running the image's version. Once unlocked with its password
+the logging service streams synthetic log lines, split across MTU-sized
+notifications like the firmware does, and the Nordic UART service answers
+python/nus.py requests over a link with a modelled latency and rate. The
+fleet command characteristics (python/fleet_commands.py) set the LED
+pattern, clear the error, reset the device or put it to sleep, during which
+it neither advertises nor accepts connections.
+
+    fleet = SimulatedFleet(100, pressure_rate_hz=10)
+    fleet.install()   # ble_backend now hands out simulated scanners/clients
+"""
+
+import asyncio
+import logging
+import random
+import struct
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from bleak.exc import BleakError
+from bleak.uuids import normalize_uuid_str
+
+import python.ble_backend as ble_backend
+import python.kraken_uuids as kraken_uuids
+from python import nus, ota
+
+# ==============================================================================
+# Packet builders
+# ==============================================================================
+
+def build_pressure_packet(name, pressure_psi, address, battery, scanner_tick, charging_state=None):
+    """Build a pressure notification in the layout PressureData expects."""
+    packet = bytearray(struct.pack("16s5s", name.encode('ascii')[:16], str(int(round(pressure_psi * 10))).encode('ascii')[:5]))
+    packet += bytes(int(b, 16) for b in address.split(':'))
+    packet += bytes([battery & 0xFF, scanner_tick & 0xFF])
+    if charging_state is not None:
+        packet.append(charging_state & 0xFF)
+    return bytes(packet)
+
+
+def build_connection_info_packet(kraken_rssi, kraken_current_power, kraken_max_power, channel_map,
+                                 current_channel, connection_interval_ms, supervision_timeout_ms,
+                                 central_phy, kraken_phy, last_disconnect_reason, open_connections):
+    """Build a BLE connection info notification (18 bytes, multi-byte fields big-endian)."""
+    return struct.pack(">bbB5sBHHBBHB",
+                       kraken_rssi,
+                       kraken_current_power,
+                       kraken_max_power,
+                       channel_map.to_bytes(5, 'big'),
+                       current_channel,
+                       int(round(connection_interval_ms / 1.25)),
+                       int(round(supervision_timeout_ms / 10)),
+                       central_phy,
+                       kraken_phy,
+                       last_disconnect_reason,
+                       open_connections)
+
+# ==============================================================================
+# Simulated devices
+# ==============================================================================
+
+class SimulatedKraken:
+    def __init__(self, address, name, fw_ver="1.0.0-sim", rssi=-60,
+                 pressure_rate_hz=10.0, connection_info_rate_hz=1.0,
+                 mean_seconds_between_disconnects=None, connect_latency_seconds=0.05,
+                 ota_link_bytes_per_second=40000, ota_round_trip_seconds=0.03, mtu=247, reboot_seconds=0.2,
+                 log_rate_hz=20.0, logging_password="kraken", connection_event_seconds=0.0075,
+                 nus_latency_seconds=0.0075, nus_link_bytes_per_second=100000, nus_frame_payload=1024,
+                 nus_loss_rate=0.0, att_round_trip_seconds=0.03, deep_sleep_seconds=30.0, discovery_seconds=0.4, seed=None):
+        self.address = address
+        self.name = name
+        self.fw_ver = fw_ver
+        self.rssi = rssi
+        self.pressure_rate_hz = pressure_rate_hz
+        self.connection_info_rate_hz = connection_info_rate_hz
+        self.mean_seconds_between_disconnects = mean_seconds_between_disconnects
+        self.connect_latency_seconds = connect_latency_seconds
+        # Full service discovery, skipped when the central uses its GATT cache
+        self.discovery_seconds = discovery_seconds
+        self.rng = random.Random(seed if seed is not None else address)
+        self.mtu = mtu
+        self.reboot_seconds = reboot_seconds
+        # Notifications due within one connection event go out together
+        self.connection_event_seconds = connection_event_seconds
+
+        # Logging service
+        self.log_rate_hz = log_rate_hz
+        self.logging_password = logging_password
+        self.logging_unlocked = False
+        self.log_lines = 0
+        self.log_bytes_sent = 0
+        self._log_backlog = bytearray()
+
+        # Nordic UART service, pushed to the clients instead of notified on a timer
+        self.nus = SimulatedNusPeer(self, nus_latency_seconds, nus_link_bytes_per_second, nus_frame_payload, nus_loss_rate)
+        self.push_uuids = {normalize_uuid_str(kraken_uuids.UART_TX_CHAR_UUID)}
+
+        # OTA: "application" or "apploader", see python/ota.py
+        self.mode = "application"
+        self.application_version = ota.version_to_int(fw_ver.split("-")[0]) if fw_ver[:1].isdigit() else 0
+        self.ota_link_bytes_per_second = ota_link_bytes_per_second
+        self.ota_round_trip_seconds = ota_round_trip_seconds
+        self.ota_image = None
+        self.ota_verified_version = None
+        self.reboot_pending = False
+        self.booting_until = 0.0
+        self.clients = set()
+
+        # Fleet commands, see python/fleet_commands.py
+        self.att_round_trip_seconds = att_round_trip_seconds
+        self.deep_sleep_seconds = deep_sleep_seconds
+        self.asleep_until = 0.0 # neither advertises nor accepts connections before this
+        self.led_pattern = None
+        self.error_code = 0
+        self.soft_resets = 0
+
+        self.pressure_psi = 14.7
+        self.scanner_tick = 0
+        self.connection_count = 0
+        self.last_disconnect_reason = 0
+        self.notifications_sent = 0
+
+        # uuid -> handler(data) for writable characteristics, extended by features
+        # that talk to the device (OTA, commands...)
+        self.write_handlers = {
+            normalize_uuid_str(kraken_uuids.UUID_OTA_CONTROL): self._ota_control,
+            normalize_uuid_str(kraken_uuids.UUID_OTA_DATA): self._ota_data,
+            normalize_uuid_str(kraken_uuids.LOGGING_PASSWORD_CHAR_UUID): self._logging_password,
+            normalize_uuid_str(kraken_uuids.UART_RX_CHAR_UUID): self.nus.receive,
+            normalize_uuid_str(kraken_uuids.LED_PATTERN_UUID): self._led_pattern,
+            normalize_uuid_str(kraken_uuids.LED_CLEAR_UUID): self._led_clear,
+            normalize_uuid_str(kraken_uuids.KRAKEN_STATE_TRY_CLEAR_ERROR_CHAR_UUID): self._clear_error,
+            normalize_uuid_str(kraken_uuids.KRAKEN_SOFT_RESET_CHAR_UUID): self._soft_reset,
+            normalize_uuid_str(kraken_uuids.KRAKEN_DEEP_SLEEP_CHAR_UUID): self._deep_sleep,
+        }
+
+    @property
+    def asleep(self):
+        return time.monotonic() < self.asleep_until
+
+    def advertised_rssi(self):
+        return self.rssi + self.rng.randint(-4, 4)
+
+    def read(self, uuid):
+        if uuid == normalize_uuid_str(kraken_uuids.UUID_APPLICATION_VERSION):
+            return bytearray(self.application_version.to_bytes(4, 'little'))
+        if uuid == normalize_uuid_str(kraken_uuids.UUID_OTA_VERSION):
+            return bytearray([3])
+        if self.mode != "application":
+            raise BleakError(f"Characteristic {uuid} is not readable in the AppLoader of simulated Kraken {self.address}")
+        if uuid == normalize_uuid_str(kraken_uuids.KRAKEN_DISPLAY_NAME_CHAR_UUID):
+            return bytearray(self.name.encode('ascii'))
+        if uuid == normalize_uuid_str(kraken_uuids.UUID_FW_REV_CHAR):
+            return bytearray(self.fw_ver.encode('utf-8') + b'\x00')
+        raise BleakError(f"Characteristic {uuid} is not readable on simulated Kraken {self.address}")
+
+    def write(self, uuid, data):
+        handler = self.write_handlers.get(uuid)
+        if handler is None:
+            raise BleakError(f"Characteristic {uuid} is not writable on simulated Kraken {self.address}")
+        handler(bytes(data))
+
+    # ==========================================================================
+    # OTA
+    # ==========================================================================
+
+    def _ota_control(self, data):
+        command = data[0]
+        if self.mode == "application":
+            if command == ota.OTA_BEGIN:
+                self.mode = "apploader"
+                self.reboot_pending = True
+            return
+        if command == ota.OTA_BEGIN:
+            self.ota_image = bytearray()
+            self.ota_verified_version = None
+        elif command == ota.OTA_END:
+            if self.ota_image is None:
+                raise BleakError("OTA end without begin")
+            try:
+                self.ota_verified_version = ota.parse_gbl(bytes(self.ota_image))["application_version"]
+            except ota.OtaError as e:
+                self.ota_image = None
+                raise BleakError(f"ATT error 0x80: {e}")
+        elif command == ota.OTA_REBOOT:
+            if self.ota_verified_version is not None:
+                self.application_version = self.ota_verified_version
+                self.fw_ver = ota.version_to_string(self.application_version)
+            self.ota_image = None
+            self.ota_verified_version = None
+            self.mode = "application"
+            self.reboot_pending = True
+
+    def _ota_data(self, data):
+        if self.mode != "apploader" or self.ota_image is None:
+            raise BleakError("OTA data before OTA begin")
+        self.ota_image += data
+
+    def write_seconds(self, uuid, length, response):
+        """Link time a write takes: OTA/NUS data at the modelled rate, plus a round trip if acknowledged."""
+        if uuid == normalize_uuid_str(kraken_uuids.UART_RX_CHAR_UUID) and self.nus.link_bytes_per_second:
+            return length / self.nus.link_bytes_per_second + (2 * self.nus.latency_seconds if response else 0.0)
+        if uuid == normalize_uuid_str(kraken_uuids.UUID_OTA_DATA) and self.ota_link_bytes_per_second:
+            return length / self.ota_link_bytes_per_second + (self.ota_round_trip_seconds if response else 0.0)
+        return self.att_round_trip_seconds if response else 0.0
+
+    # ==========================================================================
+    # Commands
+    # ==========================================================================
+
+    def _led_pattern(self, data):
+        self.led_pattern = data
+
+    def _led_clear(self, data):
+        self.led_pattern = None
+
+    def _clear_error(self, data):
+        self.error_code = 0
+
+    def _soft_reset(self, data):
+        self.soft_resets += 1
+        self.reboot_pending = True
+
+    def _deep_sleep(self, data):
+        self.reboot_pending = True
+        self.asleep_until = time.monotonic() + self.deep_sleep_seconds
+
+    # ==========================================================================
+    # Logging service
+    # ==========================================================================
+
+    def _logging_password(self, data):
+        self.logging_unlocked = data == self.logging_password.encode('utf-8')
+        if not self.logging_unlocked:
+            raise BleakError("ATT error 0x05: insufficient authentication (wrong logging password)")
+
+    def next_log_packet(self):
+        size = self.mtu - 3
+        while len(self._log_backlog) < size:
+            self.log_lines += 1
+            self._log_backlog += (f"{self.log_lines:08d} I app: pressure {self.pressure_psi:.1f} psi, "
+                                  f"tick {self.scanner_tick}, heap {self.rng.randrange(10000, 20000)}\n").encode('ascii')
+        packet = bytes(self._log_backlog[:size])
+        del self._log_backlog[:size]
+        self.log_bytes_sent += size
+        return packet
+
+    def pressure_history(self, first, count):
+        """Stored history records `first` to `first + count`, the same every time they are read."""
+        index = np.arange(first, first + count)
+        records = np.zeros(count, dtype=nus.HISTORY_DTYPE)
+        records["timestamp_s"] = 1_700_000_000 + index
+        records["pressure_psi"] = 14.7 + 0.5 * np.sin(index / 50)
+        records["battery"] = 100 - (index // 3600) % 100
+        records["scanner_tick"] = index & 0xFF
+        return records
+
+    def next_pressure_packet(self):
+        self.pressure_psi = max(0.0, self.pressure_psi + self.rng.uniform(-0.3, 0.3))
+        self.scanner_tick = (self.scanner_tick + 1) & 0xFF
+        return build_pressure_packet(self.name, self.pressure_psi, self.address, 87, self.scanner_tick, 0)
+
+    def next_connection_info_packet(self):
+        return build_connection_info_packet(kraken_rssi=self.advertised_rssi(),
+                                            kraken_current_power=self.rng.choice([0, 4, 8]),
+                                            kraken_max_power=8,
+                                            channel_map=0x1FFFFFFFFF,
+                                            current_channel=self.rng.randrange(37),
+                                            connection_interval_ms=30,
+                                            supervision_timeout_ms=4000,
+                                            central_phy=1,
+                                            kraken_phy=1,
+                                            last_disconnect_reason=self.last_disconnect_reason,
+                                            open_connections=1)
+
+    def notification_interval(self, uuid):
+        if self.mode != "application":
+            return None
+        if uuid == normalize_uuid_str(kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID):
+            return 1.0 / self.pressure_rate_hz if self.pressure_rate_hz else None
+        if uuid == normalize_uuid_str(kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID):
+            return 1.0 / self.connection_info_rate_hz if self.connection_info_rate_hz else None
+        if uuid == normalize_uuid_str(kraken_uuids.LOGGING_STREAM_CHAR_UUID):
+            return 1.0 / self.log_rate_hz if self.log_rate_hz else None
+        return None
+
+    def next_notification(self, uuid):
+        if uuid == normalize_uuid_str(kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID):
+            return self.next_pressure_packet()
+        if uuid == normalize_uuid_str(kraken_uuids.LOGGING_STREAM_CHAR_UUID):
+            return self.next_log_packet()
+        return self.next_connection_info_packet()
+
+
+class SimulatedFleet:
+    def __init__(self, device_count, advertising_interval_seconds=0.1, **device_kwargs):
+        self.advertising_interval_seconds = advertising_interval_seconds
+        self.devices = {}
+        self.gatt_cached = set() # (address, mode) the central has discovered, i.e. its OS GATT cache
+        for i in range(device_count):
+            address = "C0:DE:%02X:%02X:%02X:%02X" % ((i >> 24) & 0xFF, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+            self.devices[address] = SimulatedKraken(address, f"SimKraken{i:04d}", **device_kwargs)
+
+    @property
+    def notifications_sent(self):
+        return sum(d.notifications_sent for d in self.devices.values())
+
+    def install(self):
+        fleet = self
+
+        class _Scanner(SimulatedScanner):
+            pass
+        _Scanner.fleet = fleet
+
+        class _Client(SimulatedClient):
+            pass
+        _Client.fleet = fleet
+
+        ble_backend.set_backend(_Scanner, _Client)
+        logging.info(f"Installed simulated BLE backend with {len(self.devices)} Krakens")
+
+class SimulatedNusPeer:
+    """
+    Kraken end of python/nus.py. Incoming bytes and outgoing notifications
+    each arrive `latency_seconds` after they are sent; notifications leave at
+    `link_bytes_per_second`. DATA frames respect the window from the REQUEST,
+    a NACK sends them again from the frame it names, and a response is kept
+    until the central's END (or for RESPONSE_LINGER_SECONDS after our END).
+    `loss_rate` is the chance a notification gets a corrupted byte, i.e. the
+    frame it belongs to fails its CRC.
+    """
+    RESPONSE_LINGER_SECONDS = 5.0
+
+    def __init__(self, device, latency_seconds, link_bytes_per_second, frame_payload, loss_rate=0.0):
+        self.device = device
+        self.latency_seconds = latency_seconds
+        self.link_bytes_per_second = link_bytes_per_second
+        self.frame_payload = frame_payload
+        self.loss_rate = loss_rate
+        self.frames_resent = 0
+        self.reset()
+
+    def reset(self):
+        self.decoder = nus.FrameDecoder()
+        self._acked = {}    # request id -> frames acknowledged (full count, not wrapped to 16 bits)
+        self._resend_from = {} # request id -> frame a NACK asked to go back to
+        self._complete = {} # request id -> the central's END arrived
+        self._ack_events = {}
+        self._tx = None
+        self._sender_task = None
+        self._link_free_at = 0.0
+
+    def receive(self, data):
+        asyncio.get_running_loop().call_later(self.latency_seconds, self._receive_now, bytes(data))
+
+    def _receive_now(self, data):
+        for frame_type, request_id, seq, payload in self.decoder.feed(data):
+            if frame_type == nus.FRAME_REQUEST:
+                asyncio.ensure_future(self._respond(request_id, max(1, seq), payload))
+            elif frame_type in (nus.FRAME_ACK, nus.FRAME_NACK) and request_id in self._acked:
+                acked = self._acked[request_id]
+                self._acked[request_id] = acked = acked + ((seq - acked) & 0xFFFF)
+                if frame_type == nus.FRAME_NACK:
+                    self._resend_from[request_id] = acked
+                self._ack_events[request_id].set()
+            elif frame_type == nus.FRAME_END and request_id in self._complete:
+                self._complete[request_id] = True
+                self._ack_events[request_id].set()
+
+    def _handle(self, payload):
+        opcode = payload[0] if payload else None
+        if opcode == nus.OP_ECHO:
+            return payload[1:]
+        if opcode == nus.OP_READ_HISTORY:
+            first, count = struct.unpack_from("<II", payload, 1)
+            return self.device.pressure_history(first, count).tobytes()
+        if opcode == nus.OP_READ_BLOB:
+            size, = struct.unpack_from("<I", payload, 1)
+            return (np.arange(size) % 251).astype(np.uint8).tobytes()
+        raise nus.NusError(f"unknown opcode {opcode}")
+
+    async def _respond(self, request_id, window, payload):
+        try:
+            response = self._handle(payload)
+        except (nus.NusError, struct.error) as e:
+            self._send(nus.encode_frame(nus.FRAME_ERROR, request_id, 0, str(e).encode('utf-8')))
+            return
+        frame_count = -(-len(response) // self.frame_payload)
+        self._acked[request_id] = 0
+        self._resend_from[request_id] = None
+        self._complete[request_id] = False
+        event = self._ack_events[request_id] = asyncio.Event()
+        try:
+            seq = 0
+            while True:
+                while seq < frame_count:
+                    resend = self._resend_from[request_id]
+                    if resend is not None:
+                        # Go back to the first frame the central is missing
+                        self.frames_resent += max(0, seq - resend)
+                        seq, self._resend_from[request_id] = resend, None
+                    if seq >= self._acked[request_id] + window:
+                        event.clear()
+                        await event.wait()
+                        continue
+                    offset = seq * self.frame_payload
+                    self._send(nus.encode_frame(nus.FRAME_DATA, request_id, seq & 0xFFFF,
+                                                response[offset:offset + self.frame_payload]))
+                    seq += 1
+                self._send(nus.encode_frame(nus.FRAME_END, request_id, 0, struct.pack("<I", len(response))))
+                # Keep the response until the central's END, a NACK may still ask for frames (or our END) again
+                while not self._complete[request_id] and self._resend_from[request_id] is None:
+                    event.clear()
+                    try:
+                        await asyncio.wait_for(event.wait(), self.RESPONSE_LINGER_SECONDS)
+                    except asyncio.TimeoutError:
+                        return
+                resend = self._resend_from[request_id]
+                if resend is None or self._complete[request_id]:
+                    return
+                self._resend_from[request_id] = None
+                self.frames_resent += frame_count - resend
+                seq = resend
+        finally:
+            del self._acked[request_id], self._resend_from[request_id], self._complete[request_id]
+            del self._ack_events[request_id]
+
+    def _send(self, frame):
+        if self._tx is None:
+            self._tx = asyncio.Queue()
+            self._sender_task = asyncio.create_task(self._sender())
+        self._tx.put_nowait(frame)
+
+    async def _sender(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            frame = await self._tx.get()
+            for piece in nus.fragments(frame, self.device.mtu - 3):
+                if self.loss_rate and self.device.rng.random() < self.loss_rate:
+                    corrupted = bytearray(piece)
+                    corrupted[self.device.rng.randrange(len(piece))] ^= 0xFF
+                    piece = bytes(corrupted)
+                now = loop.time()
+                self._link_free_at = max(self._link_free_at, now) + len(piece) / self.link_bytes_per_second
+                loop.call_at(self._link_free_at + self.latency_seconds, self._deliver, piece)
+                if self._link_free_at - now > 0.005:
+                    await asyncio.sleep(self._link_free_at - now) # don't run ahead of the link
+
+    def _deliver(self, piece):
+        for client in list(self.device.clients):
+            client.push(normalize_uuid_str(kraken_uuids.UART_TX_CHAR_UUID), piece)
+
+# ==============================================================================
+# bleak look-alikes
+# ==============================================================================
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid, handle):
+        self.uuid = normalize_uuid_str(uuid)
+        self.handle = handle
+
+    def __str__(self):
+        return f"{self.uuid} (Handle: {self.handle})"
+
+
+class SimulatedService:
+    def __init__(self, uuid, char_uuids, first_handle):
+        self.uuid = normalize_uuid_str(uuid)
+        self.characteristics = [SimulatedCharacteristic(c, first_handle + 2 * i) for i, c in enumerate(char_uuids)]
+
+    def get_characteristic(self, specifier):
+        for char in self.characteristics:
+            if char.uuid == _uuid_of(specifier) or char.handle == specifier:
+                return char
+        return None
+
+
+class SimulatedServices:
+    _APPLOADER_LAYOUT = {
+        kraken_uuids.UUID_OTA_SERVICE: [kraken_uuids.UUID_OTA_CONTROL,
+                                        kraken_uuids.UUID_OTA_DATA,
+                                        kraken_uuids.UUID_BOOTLOADER_VERSION,
+                                        kraken_uuids.UUID_APPLOADER_VERSION,
+                                        kraken_uuids.UUID_OTA_VERSION,
+                                        kraken_uuids.UUID_APPLICATION_VERSION],
+    }
+    _LAYOUT = {
+        kraken_uuids.DEVICE_INFO_SERVICE_UUID: [kraken_uuids.UUID_FW_REV_CHAR,
+                                                kraken_uuids.MANUF_NAME_CHAR_UUID,
+                                                kraken_uuids.MODEL_NUM_CHAR_UUID],
+        kraken_uuids.KRAKEN_SERVICE_UUID: [kraken_uuids.KRAKEN_DISPLAY_NAME_CHAR_UUID,
+                                           kraken_uuids.PRESSURE_SUBSCRIPTION_CHAR_UUID,
+                                           kraken_uuids.BLE_CONNECTION_INFO_CHAR_UUID,
+                                           kraken_uuids.KRAKEN_DEEP_SLEEP_CHAR_UUID,
+                                           kraken_uuids.KRAKEN_SOFT_RESET_CHAR_UUID],
+        kraken_uuids.KRAKEN_STATE_SERVICE_UUID: [kraken_uuids.KRAKEN_STATE_CHAR_UUID,
+                                                 kraken_uuids.KRAKEN_STATE_TRY_CLEAR_ERROR_CHAR_UUID,
+                                                 kraken_uuids.KRAKEN_STATE_ERROR_CODE_CHAR_UUID,
+                                                 kraken_uuids.LED_PATTERN_UUID,
+                                                 kraken_uuids.LED_CLEAR_UUID],
+        kraken_uuids.UART_SERVICE_UUID: [kraken_uuids.UART_RX_CHAR_UUID,
+                                         kraken_uuids.UART_TX_CHAR_UUID],
+        kraken_uuids.LOGGING_SERVICE_UUID: [kraken_uuids.LOGGING_PASSWORD_CHAR_UUID,
+                                            kraken_uuids.LOGGING_STREAM_CHAR_UUID],
+        kraken_uuids.UUID_OTA_SERVICE: [kraken_uuids.UUID_OTA_CONTROL,
+                                        kraken_uuids.UUID_OTA_DATA,
+                                        kraken_uuids.UUID_BOOTLOADER_VERSION,
+                                        kraken_uuids.UUID_APPLOADER_VERSION,
+                                        kraken_uuids.UUID_OTA_VERSION,
+                                        kraken_uuids.UUID_APPLICATION_VERSION],
+    }
+
+    def __init__(self, apploader=False):
+        self.services = []
+        handle = 1
+        for service_uuid, char_uuids in (self._APPLOADER_LAYOUT if apploader else self._LAYOUT).items():
+            self.services.append(SimulatedService(service_uuid, char_uuids, handle + 1))
+            handle += 2 * len(char_uuids) + 2
+
+    def __iter__(self):
+        return iter(self.services)
+
+    def get_service(self, specifier):
+        for service in self.services:
+            if service.uuid == _uuid_of(specifier):
+                return service
+        return None
+
+    def get_characteristic(self, specifier):
+        for service in self.services:
+            char = service.get_characteristic(specifier)
+            if char is not None:
+                return char
+        return None
+
+
+def _uuid_of(specifier):
+    if isinstance(specifier, SimulatedCharacteristic):
+        return specifier.uuid
+    if isinstance(specifier, str):
+        return normalize_uuid_str(specifier)
+    return specifier
+
+
+class SimulatedScanner:
+    fleet = None
+
+    def __init__(self, detection_callback=None, service_uuids=None, **kwargs):
+        self.detection_callback = detection_callback
+        self.service_uuids = [normalize_uuid_str(u) for u in service_uuids] if service_uuids else None
+        self._task = None
+
+    async def _advertise(self):
+        devices = list(self.fleet.devices.values())
+        service_uuids = [normalize_uuid_str(kraken_uuids.KRAKEN_SERVICE_UUID)]
+        # Spread the advertisements over the interval, like real devices would
+        delay = self.fleet.advertising_interval_seconds / max(1, len(devices))
+        while True:
+            for device in devices:
+                if device.asleep:
+                    await asyncio.sleep(delay)
+                    continue
+                ble_device = SimpleNamespace(address=device.address, name=device.name)
+                advertisement = SimpleNamespace(service_uuids=service_uuids,
+                                                rssi=device.advertised_rssi(),
+                                                local_name=device.name)
+                if self.detection_callback:
+                    self.detection_callback(ble_device, advertisement)
+                await asyncio.sleep(delay)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._advertise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class SimulatedClient:
+    fleet = None
+
+    def __init__(self, address_or_ble_device, disconnected_callback=None, services=None, *, timeout=30, **kwargs):
+        self.address = getattr(address_or_ble_device, 'address', address_or_ble_device)
+        self.disconnected_callback = disconnected_callback
+        self.timeout = timeout
+        self.services = None
+        self._connected = False
+        self._notify_tasks = {}
+        self._push_callbacks = {} # uuid -> (characteristic, callback) for device-initiated notifications
+        self._disconnect_task = None
+        self.device = self.fleet.devices.get(self.address)
+        self.mtu_size = self.device.mtu if self.device is not None else 23
+        self._link_free_at = 0.0
+        self._use_cached_services = kwargs.get("winrt", {}).get("use_cached_services", False)
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self, **kwargs):
+        if self.device is None:
+            await asyncio.sleep(self.timeout)
+            raise BleakError(f"Device with address {self.address} was not found")
+        await asyncio.sleep(self.device.connect_latency_seconds)
+        if self.device.asleep:
+            raise BleakError(f"Device with address {self.address} was not found")
+        if time.monotonic() < self.device.booting_until:
+            raise BleakError(f"Simulated Kraken {self.address} is rebooting")
+        layout = (self.address, self.device.mode)
+        if not ((kwargs.get("dangerous_use_bleak_cache") or self._use_cached_services) and layout in self.fleet.gatt_cached):
+            await asyncio.sleep(self.device.discovery_seconds)
+            self.fleet.gatt_cached.add(layout)
+        self._connected = True
+        self.services = SimulatedServices(apploader=self.device.mode == "apploader")
+        self.device.connection_count += 1
+        self.device.clients.add(self)
+        self.device.logging_unlocked = False
+        self.device.nus.reset()
+        if self.device.mean_seconds_between_disconnects:
+            self._disconnect_task = asyncio.create_task(self._inject_disconnect())
+        return True
+
+    async def disconnect(self):
+        self._teardown()
+        return True
+
+    def _teardown(self):
+        self._connected = False
+        if self.device is not None:
+            self.device.clients.discard(self)
+        for task in self._notify_tasks.values():
+            task.cancel()
+        self._notify_tasks.clear()
+        self._push_callbacks.clear()
+        if self._disconnect_task is not None and self._disconnect_task is not asyncio.current_task():
+            self._disconnect_task.cancel()
+        self._disconnect_task = None
+
+    async def _inject_disconnect(self):
+        await asyncio.sleep(self.device.rng.expovariate(1.0 / self.device.mean_seconds_between_disconnects))
+        logging.info(f"Simulated Kraken {self.address} dropping connection")
+        self.device.last_disconnect_reason = 0x1008 # SL_STATUS_BT_CTRL_CONNECTION_TIMEOUT
+        self._drop()
+
+    def _drop(self):
+        if not self._connected:
+            return
+        self._teardown()
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+
+    def _require_connection(self):
+        if not self._connected:
+            raise BleakError(f"Simulated Kraken {self.address} is not connected")
+
+    async def read_gatt_char(self, char_specifier, **kwargs):
+        self._require_connection()
+        value = self.device.read(_uuid_of(self._resolve(char_specifier)))
+        await asyncio.sleep(self.device.att_round_trip_seconds)
+        return value
+
+    async def write_gatt_char(self, char_specifier, data, response=None):
+        self._require_connection()
+        uuid = _uuid_of(self._resolve(char_specifier))
+        self.device.write(uuid, data)
+        seconds = self.device.write_seconds(uuid, len(data), bool(response))
+        if seconds:
+            # Writes without response queue up on the link; only sleep once
+            # there is a few ms of backlog so small writes don't cost a loop turn each
+            now = time.monotonic()
+            self._link_free_at = max(self._link_free_at, now) + seconds
+            if response or self._link_free_at - now > 0.005:
+                await asyncio.sleep(self._link_free_at - now)
+        if self.device.reboot_pending:
+            # The device resets: every connection to it drops
+            self.device.reboot_pending = False
+            loop = asyncio.get_running_loop()
+            for client in list(self.device.clients):
+                loop.call_later(0.01, client._drop)
+            self.device.booting_until = time.monotonic() + self.device.reboot_seconds
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        self._require_connection()
+        char = self._resolve(char_specifier)
+        await asyncio.sleep(self.device.att_round_trip_seconds) # CCCD write
+        self._require_connection()
+        if char.uuid in self.device.push_uuids:
+            self._push_callbacks[char.uuid] = (char, callback)
+            return
+        if self.device.notification_interval(char.uuid) is None:
+            raise BleakError(f"Characteristic {char.uuid} does not notify on simulated Kraken {self.address}")
+        if char.uuid == normalize_uuid_str(kraken_uuids.LOGGING_STREAM_CHAR_UUID) and not self.device.logging_unlocked:
+            raise BleakError("ATT error 0x05: insufficient authentication (logging service is locked)")
+        self._notify_tasks[char.uuid] = asyncio.create_task(self._notify(char, callback))
+
+    async def stop_notify(self, char_specifier):
+        uuid = self._resolve(char_specifier).uuid
+        self._push_callbacks.pop(uuid, None)
+        task = self._notify_tasks.pop(uuid, None)
+        if task is not None:
+            task.cancel()
+
+    def push(self, uuid, data):
+        """Deliver a notification the device sent on its own, if subscribed."""
+        entry = self._push_callbacks.get(uuid)
+        if entry is None or not self._connected:
+            return
+        char, callback = entry
+        self.device.notifications_sent += 1
+        result = callback(char, bytearray(data))
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def _resolve(self, char_specifier):
+        char = self.services.get_characteristic(char_specifier) if self.services else None
+        if char is None:
+            raise BleakError(f"Characteristic {char_specifier} was not found on simulated Kraken {self.address}")
+        return char
+
+    async def _notify(self, char, callback):
+        interval = self.device.notification_interval(char.uuid)
+        # Random phase so a large fleet doesn't notify in lock step
+        await asyncio.sleep(self.device.rng.uniform(0, interval))
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while self._connected:
+            # Everything that fell due since the last connection event goes out in this one
+            while next_time <= loop.time() and self._connected:
+                data = bytearray(self.device.next_notification(char.uuid))
+                self.device.notifications_sent += 1
+                result = callback(char, data)
+                if asyncio.iscoroutine(result):
+                    await result
+                next_time += interval
+            await asyncio.sleep(max(self.device.connection_event_seconds, next_time - loop.time()))
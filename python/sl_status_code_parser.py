@@ -5,13 +5,17 @@ Based on sl_status.h
 
 from __future__ import annotations
 
+from typing import NamedTuple
+
+import numpy as np
+
 # Keep the map at module scope so it isn't rebuilt on every call.
 _STATUS_MAP: dict[int, str] = {
     # ---------------------------------------------------------------------
     # Space Defines (also SL_STATUS_* macros in the header)
     # ---------------------------------------------------------------------
     0xFF00: "SL_STATUS_SPACE_MASK",
-    0x0000: "SL_STATUS_GENERIC_SPACE",
+    # 0x0000 SL_STATUS_GENERIC_SPACE collides with SL_STATUS_OK, see _SPACE_NAMES
     0x0100: "SL_STATUS_PLATFORM_1_SPACE",
     0x0200: "SL_STATUS_PLATFORM_2_SPACE",
     0x0300: "SL_STATUS_HARDWARE_SPACE",
@@ -371,4 +375,99 @@ def sl_status_to_string(code: int) -> str:
     # Format unknown codes nicely for 16-bit and 32-bit inputs
     if 0 <= code <= 0xFFFF:
         return f"CODE_UNKNOWN (0x{code:04X})"
-    return f"CODE_UNKNOWN (0x{code:08X})"
\ No newline at end of file
+    return f"CODE_UNKNOWN (0x{code:08X})"
+
+
+# ---------------------------------------------------------------------
+# Vectorized classification
+# ---------------------------------------------------------------------
+
+UNKNOWN_NAME = "CODE_UNKNOWN"
+UNKNOWN_ID = 0
+
+# Space (bits 8-15 of a status code) -> SL_STATUS_*_SPACE name
+_SPACE_NAMES: dict[int, str] = {0x00: "SL_STATUS_GENERIC_SPACE"}
+_SPACE_NAMES.update((code >> 8, name) for code, name in _STATUS_MAP.items()
+                    if name.endswith("_SPACE") and code & 0xFF == 0)
+
+# name -> code, including the space names that share a code with a status
+_NAME_TO_CODE: dict[str, int] = {name: code for code, name in _STATUS_MAP.items()}
+_NAME_TO_CODE.update((name, space << 8) for space, name in _SPACE_NAMES.items())
+
+# Categorical ids: index into STATUS_NAMES, 0 is CODE_UNKNOWN. The name tables
+# are object arrays so indexing them only copies references
+_CODES_BY_ID = sorted(_STATUS_MAP)
+STATUS_NAMES = np.array([UNKNOWN_NAME] + [_STATUS_MAP[c] for c in _CODES_BY_ID], dtype=object)
+SPACE_NAMES = np.array([_SPACE_NAMES.get(space, f"UNKNOWN_SPACE (0x{space:02X})") for space in range(0x100)], dtype=object)
+
+_id_lut = None
+
+
+def _code_id_lut() -> np.ndarray:
+    # Dense 16-bit code -> id table (128 KiB), built on first use
+    global _id_lut
+    if _id_lut is None:
+        lut = np.full(0x10000, UNKNOWN_ID, dtype=np.int16)
+        lut[_CODES_BY_ID] = np.arange(1, len(_CODES_BY_ID) + 1, dtype=np.int16)
+        _id_lut = lut
+    return _id_lut
+
+
+class SlStatusBreakdown(NamedTuple):
+    ids: np.ndarray          # int16 categorical id, index into STATUS_NAMES (0 = unknown)
+    spaces: np.ndarray       # uint8 space, bits 8-15 of the code
+    names: np.ndarray        # STATUS_NAMES[ids]
+    space_names: np.ndarray  # SPACE_NAMES[spaces]
+
+
+def classify_sl_status(codes) -> SlStatusBreakdown:
+    """
+    Classify an array of sl_status_t values with table lookups only.
+
+    Codes outside 0..0xFFFF or not defined in sl_status.h get id 0 and the
+    plain name CODE_UNKNOWN (sl_status_to_string() adds the hex value). Like
+    sl_status_to_string(), 0x0000 is SL_STATUS_OK; its space is still
+    reported as SL_STATUS_GENERIC_SPACE.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    in_range = (codes >= 0) & (codes <= 0xFFFF)
+    ids = np.where(in_range, _code_id_lut()[codes & 0xFFFF], UNKNOWN_ID).astype(np.int16)
+    spaces = ((codes >> 8) & 0xFF).astype(np.uint8)
+    return SlStatusBreakdown(ids, spaces, STATUS_NAMES[ids], SPACE_NAMES[spaces])
+
+
+def status_id_to_code(ids) -> np.ndarray:
+    """Categorical ids back to codes (-1 for CODE_UNKNOWN)."""
+    return np.array([-1] + _CODES_BY_ID, dtype=np.int64)[np.asarray(ids)]
+
+
+def sl_status_from_string(name: str) -> int:
+    """
+    Reverse of sl_status_to_string(), also accepting the *_SPACE names.
+    Raises KeyError for names not defined in sl_status.h.
+    """
+    return _NAME_TO_CODE[name]
+
+
+def _benchmark(n=1_000_000):
+    import timeit
+
+    rng = np.random.default_rng(0)
+    known = np.array(_CODES_BY_ID)
+    codes = np.where(rng.random(n) < 0.9, rng.choice(known, n), rng.integers(0, 0x20000, n))
+
+    sample = codes[:10000].tolist()
+    breakdown = classify_sl_status(sample)
+    for code, name in zip(sample, breakdown.names.tolist()):
+        assert sl_status_to_string(code).startswith(name)
+
+    per_value = min(timeit.repeat(lambda: [sl_status_to_string(c) for c in sample], number=1, repeat=3)) / len(sample)
+    vectorized = min(timeit.repeat(lambda: classify_sl_status(codes), number=1, repeat=3)) / n
+    ids_only = min(timeit.repeat(lambda: _code_id_lut()[codes & 0xFFFF], number=1, repeat=3)) / n
+    print(f"sl_status_to_string: {1e9 * per_value:7.1f} ns/code")
+    print(f"classify_sl_status : {1e9 * vectorized:7.1f} ns/code ({per_value / vectorized:.0f}x)")
+    print(f"id lookup only     : {1e9 * ids_only:7.1f} ns/code ({per_value / ids_only:.0f}x)")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,133 @@
+import numpy as np
+
+from kivy.graphics import Color, Line
+from kivy.uix.widget import Widget
+
+class Sparkline(Widget):
+    """
+    Strip chart of a RollingSeries, drawn with a single Line instruction.
+
+    The series is min-max decimated to one column per pixel: every column
+    covers a fixed run of sample numbers and keeps the min and max of its
+    samples, which are drawn as one vertical zig-zag, so spikes survive the
+    downsampling. refresh() only folds in the samples added since the last
+    call; the decimated history is only recomputed when the width changes or
+    a different series is attached. Newest samples are on the right.
+
+    The vertex coordinates are kept too: a refresh moves the y values of the
+    columns that scrolled and computes only the columns that got samples.
+    Everything is rescaled only when the min/max of the chart changes, or
+    the widget moves or resizes.
+    """
+    def __init__(self, series=None, color=(0.3, 0.8, 1, 1), line_width=1.0, **kwargs):
+        super().__init__(**kwargs)
+        with self.canvas:
+            Color(*color)
+            self._line = Line(points=[], width=line_width)
+        self._series = None
+        self._columns = 0
+        self.bind(size=self._on_geometry, pos=self._on_geometry)
+        self.set_series(series)
+
+    def set_series(self, series):
+        if series is self._series:
+            return
+        self._series = series
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self._columns = max(int(self.width), 1)
+        self._col_min = np.full(self._columns, np.inf)
+        self._col_max = np.full(self._columns, -np.inf)
+        self._newest_column = None # absolute column number of the rightmost column
+        self._first = self._columns # the filled columns run from here to the right edge
+        self._range = None # (bottom, top) of the filled columns
+        self._points = np.empty((self._columns, 4)) # x, y of the min, x, y of the max per column
+        self._point_list = [] # _points[_first:] as handed to the Line
+        self._scale = None # the (bottom, top) the y coordinates were computed for
+        if self._series is None:
+            self._samples_per_column = 1
+            self._seen = 0
+        else:
+            self._samples_per_column = max(-(-self._series.capacity // self._columns), 1)
+            self._seen = self._series.total - self._series.count
+        self._line.points = []
+
+    def _on_geometry(self, *args):
+        if max(int(self.width), 1) != self._columns:
+            self._reset()
+            self.refresh()
+        else:
+            self._upload()
+
+    def refresh(self):
+        """Fold in new samples and redraw. Cheap when nothing was added."""
+        series = self._series
+        if series is None or series.total == self._seen:
+            return
+        values, first = series.since(self._seen)
+        self._seen = series.total
+        if not len(values):
+            return
+
+        columns = (first + np.arange(len(values))) // self._samples_per_column
+        newest = int(columns[-1])
+        shift = 0
+        if self._newest_column is not None:
+            shift = newest - self._newest_column
+            if shift >= self._columns:
+                self._col_min.fill(np.inf)
+                self._col_max.fill(-np.inf)
+                self._first = self._columns
+                self._range = None
+            elif shift > 0:
+                self._col_min[:-shift] = self._col_min[shift:]
+                self._col_max[:-shift] = self._col_max[shift:]
+                self._col_min[-shift:] = np.inf
+                self._col_max[-shift:] = -np.inf
+                self._points[:-shift, 1::2] = self._points[shift:, 1::2]
+                self._first = max(self._first - shift, 0)
+        self._newest_column = newest
+
+        index = columns - (newest - self._columns + 1)
+        keep = index >= 0
+        index, values = index[keep], values[keep] # the newest sample is always kept
+        np.minimum.at(self._col_min, index, values)
+        np.maximum.at(self._col_max, index, values)
+        # Samples are consecutive, so the changed columns run from the first one to the right edge
+        start = int(index[0])
+        self._first = min(self._first, start)
+        if shift > 0 or self._range is None:
+            # The extremes may have scrolled out
+            self._range = (self._col_min[self._first:].min(), self._col_max[self._first:].max())
+        else:
+            self._range = (min(self._range[0], values.min()), max(self._range[1], values.max()))
+        self._upload(start, scrolled=shift > 0)
+
+    def _upload(self, start=None, scrolled=True):
+        """Redraw the columns from `start` on; unless `scrolled`, the ones left of it are unchanged."""
+        first = self._first
+        if first == self._columns:
+            self._line.points = []
+            return
+        if start is None or self._scale != self._range:
+            # New geometry or value range: every coordinate moves
+            self._scale = self._range
+            start, scrolled = first, True
+            self._points[:, 0] = self._points[:, 2] = self.x + np.arange(self._columns) * (self.width / self._columns)
+
+        bottom, top = self._scale
+        changed = slice(start, None)
+        if top == bottom:
+            self._points[changed, 1] = self._points[changed, 3] = self.center_y # flat line in the middle
+        else:
+            scale = (self.height - 2) / (top - bottom)
+            self._points[changed, 1] = self.y + 1 + (self._col_min[changed] - bottom) * scale
+            self._points[changed, 3] = self.y + 1 + (self._col_max[changed] - bottom) * scale
+        if scrolled:
+            self._point_list = self._points[first:].ravel().tolist()
+        else:
+            self._point_list[4 * (start - first):] = self._points[changed].ravel().tolist()
+        # Line has no partial update: it copies the list and rebuilds its vertices when drawn
+        self._line.points = self._point_list
@@ -0,0 +1,144 @@
+"""
+Startup timing: per-phase and per-import milliseconds from process start to
+the first frame (and to the core being up), so time-to-first-frame
+regressions show up in numbers rather than as a slow splash screen.
+
+Turned on with KRAKEN_STARTUP_TIMING:
+
+    KRAKEN_STARTUP_TIMING=1                 log the report
+    KRAKEN_STARTUP_TIMING=startup.jsonl     log it and append it as one JSON line
+
+This module must stay cheap to import, it is loaded before Kivy.
+"""
+
+import builtins
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ENV_VAR = "KRAKEN_STARTUP_TIMING"
+
+# Imports faster than this are left out of the report
+REPORT_MIN_IMPORT_MS = 5.0
+
+
+class StartupTimer:
+    """
+    Records named phases and marks relative to `start` (a time.perf_counter()
+    value, normally taken on the first line of the entry point).
+
+    With `trace_imports` every module newly imported from the main thread is
+    timed, including the modules it imports in turn (like python -X importtime,
+    but reported in ms alongside the phases).
+    """
+    def __init__(self, start=None, enabled=False, trace_imports=None, output_path=None):
+        self.start = time.perf_counter() if start is None else start
+        self.enabled = enabled
+        self.output_path = output_path
+        self.phases = []  # (name, start ms, duration ms)
+        self.marks = {}   # name -> ms
+        self.imports = [] # (module, depth, inclusive ms), in load order
+        self._depth = 0
+        self._thread = threading.get_ident()
+        self._original_import = None
+        if trace_imports if trace_imports is not None else enabled:
+            self.install_import_hook()
+
+    @classmethod
+    def from_env(cls, start=None):
+        value = os.environ.get(ENV_VAR, "").strip()
+        if value.lower() in ("", "0", "false", "no"):
+            return cls(start, enabled=False)
+        output_path = None if value.lower() in ("1", "true", "yes") else value
+        return cls(start, enabled=True, output_path=output_path)
+
+    def elapsed_ms(self):
+        return 1000 * (time.perf_counter() - self.start)
+
+    # ==========================================================================
+    # Recording
+    # ==========================================================================
+
+    @contextmanager
+    def phase(self, name):
+        begin = self.elapsed_ms()
+        try:
+            yield
+        finally:
+            self.phases.append((name, begin, self.elapsed_ms() - begin))
+
+    def mark(self, name):
+        ms = self.elapsed_ms()
+        self.marks[name] = ms
+        return ms
+
+    def install_import_hook(self):
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def remove_import_hook(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        # Fast path for the vast majority of calls: already loaded, relative
+        # (always inside an already timed package import) or another thread
+        if level or name in sys.modules or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+
+        entry = [name, self._depth, 0.0]
+        self.imports.append(entry)
+        self._depth += 1
+        begin = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            entry[2] = 1000 * (time.perf_counter() - begin)
+            self._depth -= 1
+
+    # ==========================================================================
+    # Report
+    # ==========================================================================
+
+    def to_dict(self):
+        return {
+            "phases": [{"name": name, "start_ms": round(begin, 1), "ms": round(ms, 1)} for name, begin, ms in self.phases],
+            "marks": {name: round(ms, 1) for name, ms in self.marks.items()},
+            "imports": [{"module": module, "depth": depth, "ms": round(ms, 1)}
+                        for module, depth, ms in self.imports if ms >= REPORT_MIN_IMPORT_MS],
+        }
+
+    def report(self, min_import_ms=REPORT_MIN_IMPORT_MS):
+        lines = ["Startup timing, ms since process start",
+                 f"  {'phase':<28}{'start':>9}{'took':>9}"]
+        for name, begin, ms in self.phases:
+            lines.append(f"  {name:<28}{begin:>9.1f}{ms:>9.1f}")
+        for name, ms in self.marks.items():
+            lines.append(f"  {name + ' at':<28}{ms:>9.1f}")
+        slow = [(module, depth, ms) for module, depth, ms in self.imports if ms >= min_import_ms]
+        if slow:
+            lines.append(f"  imports taking >= {min_import_ms:.0f} ms, inclusive and nested under their importer")
+            for module, depth, ms in slow:
+                lines.append(f"  {ms:>9.1f}  {'  ' * depth}{module}")
+        return "\n".join(lines)
+
+    def finish(self):
+        """Stop tracing imports and, if enabled, log (and optionally save) the report."""
+        self.remove_import_hook()
+        if not self.enabled:
+            return
+        for line in self.report().splitlines():
+            logging.info(line)
+        if self.output_path:
+            try:
+                with open(self.output_path, mode='a') as file:
+                    file.write(json.dumps(dict(self.to_dict(), time=time.time(), argv=sys.argv)) + "\n")
+            except OSError as e:
+                logging.warning(f"Could not write startup timing to {self.output_path} ({e})")